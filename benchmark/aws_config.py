@@ -0,0 +1,66 @@
+"""
+Per-profile cost of writing aws cli credentials: in-process writer versus 'aws configure set' subprocesses.
+
+usage: python benchmark/aws_config.py --profiles 50
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+
+from aws_config import CredentialsFile, set_credentials
+
+
+def subprocess_configure(path: str, profile_name: str, access_key_id: str, secret_access_key: str):
+    env = dict(os.environ, AWS_SHARED_CREDENTIALS_FILE=path, AWS_CONFIG_FILE=path + '.config')
+    subprocess.run(["aws", "configure", "set", "aws_access_key_id", access_key_id, f"--profile={profile_name}"],
+                   env=env, check=True)
+    subprocess.run(["aws", "configure", "set", "aws_secret_access_key", secret_access_key, f"--profile={profile_name}"],
+                   env=env, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', type=int, default=50)
+    parser.add_argument('--subprocess-profiles', type=int, default=5, help="'aws' cli is slow, so fewer profiles.")
+    args = parser.parse_args()
+
+    credentials = {f'profile-{i:04d}': (f'AKIA{i:016d}', f'secret{i:034d}') for i in range(args.profiles)}
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'credentials')
+    rows = []
+    try:
+        started = time.perf_counter()
+        for profile_name, (access_key_id, secret_access_key) in credentials.items():
+            set_credentials({profile_name: (access_key_id, secret_access_key)}, path=path)
+        rows.append(('native, one commit per profile', args.profiles, time.perf_counter() - started))
+
+        started = time.perf_counter()
+        set_credentials(credentials, path=path)
+        rows.append(('native, one commit for all', args.profiles, time.perf_counter() - started))
+        assert CredentialsFile(path).get('profile-0000', 'aws_access_key_id') == credentials['profile-0000'][0]
+
+        if shutil.which('aws'):
+            amount = min(args.subprocess_profiles, args.profiles)
+            started = time.perf_counter()
+            for profile_name, (access_key_id, secret_access_key) in list(credentials.items())[:amount]:
+                subprocess_configure(path, profile_name, access_key_id, secret_access_key)
+            rows.append(("subprocess 'aws configure set'", amount, time.perf_counter() - started))
+        else:
+            print("'aws' cli not found, subprocess path skipped.")
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"{'path':<32} {'profiles':>8} {'ms/profile':>12}")
+    for name, amount, elapsed in rows:
+        print(f"{name:<32} {amount:>8} {elapsed / amount * 1000:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark 'Service.rotate_fleet' against a local moto IAM.
+
+usage: python benchmark/fleet_rotation.py --users 200 --workers 1 4 16
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'groot')]
+
+import boto3
+
+from groot import Service
+from suite import mock_aws
+
+
+def create_users(amount: int):
+    client = boto3.client('iam', region_name='us-east-1')
+    client.create_user(UserName='iam-manager')
+    admin_key = client.create_access_key(UserName='iam-manager')['AccessKey']
+    for i in range(amount):
+        client.create_user(UserName=f'user-{i:05d}', Path='/fleet/')
+        client.create_access_key(UserName=f'user-{i:05d}')
+    return admin_key
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        admin_key = create_users(args.users)
+        service = Service(access_key_id=admin_key['AccessKeyId'], secret_access_key=admin_key['SecretAccessKey'])
+        rows = []
+        for workers in args.workers:
+            started = time.perf_counter()
+            result = service.rotate_fleet(path_prefix='/fleet/', max_workers=workers, force=True)
+            elapsed = time.perf_counter() - started
+            rows.append((workers, elapsed, len(result['Rotated']), len(result['Failed'])))
+
+    print(f"{'workers':>8} {'seconds':>10} {'users/s':>10} {'rotated':>8} {'failed':>7}")
+    for workers, elapsed, rotated, failed in rows:
+        print(f"{workers:>8} {elapsed:>10.3f} {rotated / elapsed:>10.1f} {rotated:>8} {failed:>7}")
+
+
+if __name__ == '__main__':
+    main()
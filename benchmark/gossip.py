@@ -0,0 +1,113 @@
+"""
+Convergence of rotation state gossip (client/gossip.py) between many simulated hosts on localhost.
+
+Every host is a GossipNode on its own UDP port, seeded only with the seed node, like clients started with
+'--gossip seed:7946'. The seed first holds '--users' states (initial sync). Then one host rotates a user and
+the time until every host holds the new key is measured. (Propagation)
+
+usage: python benchmark/gossip.py --nodes 200 --users 1000 --interval 1.0 --fanout 3
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'client'))
+
+from gossip import GossipNode
+
+SECRET = 'benchmark-secret'
+
+
+def wait_until(condition, timeout: float, poll: float = 0.01, started: float = None):
+    """
+    :return: Seconds from 'started' (perf_counter, now for None) until 'condition' was true, None if it timed out.
+    """
+    started = time.perf_counter() if started is None else started
+    while time.perf_counter() - started < timeout:
+        if condition():
+            return time.perf_counter() - started
+        time.sleep(poll)
+    return None
+
+
+def totals(nodes: list):
+    metrics = [node.metrics() for node in nodes]
+    return {name: sum(m[name] for m in metrics) for name in ('sent', 'bytes_sent', 'received', 'applied', 'rejected')}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=200, help='Simulated hosts, not counting the seed.')
+    parser.add_argument('--users', type=int, default=1000, help='User states held by the seed at start.')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between anti-entropy rounds.')
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--rotations', type=int, default=5, help='Rotations measured one after another.')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    seed = GossipNode(secret=SECRET, node_id='seed', fanout=args.fanout, interval=args.interval)
+    now = time.time()
+    for i in range(args.users):
+        seed.update(f'user-{i:05d}', f'AKIA{i:016d}', now - random.uniform(0, 60 * 86400))
+    nodes = [GossipNode(secret=SECRET, seeds=[seed.address], node_id=f'host-{i}', fanout=args.fanout,
+                        interval=args.interval)
+             for i in range(args.nodes)]
+    everyone = [seed] + nodes
+
+    started = time.perf_counter()
+    for node in everyone:
+        node.start()
+    membership_seconds = wait_until(lambda: all(len(node.peers) >= min(args.fanout, args.nodes) for node in nodes),
+                                    args.timeout)
+    sync_seconds = wait_until(lambda: all(len(node.states) == args.users for node in nodes), args.timeout)
+    sync_totals = totals(everyone)
+
+    rotations = []
+    for r in range(args.rotations):
+        before = totals(everyone)
+        origin = random.choice(nodes)
+        user_name = f'user-{random.randrange(args.users):05d}'
+        access_key_id = f'AKIAROTATED{r:09d}'
+        rotated_at = time.perf_counter()
+        origin.update(user_name, access_key_id, time.time())
+        seconds = wait_until(
+            lambda: all((node.get(user_name) or {}).get('access_key_id') == access_key_id for node in everyone),
+            args.timeout, poll=0.001, started=rotated_at)
+        after = totals(everyone)
+        rotations.append({'seconds': seconds, 'messages': after['sent'] - before['sent'],
+                          'bytes': after['bytes_sent'] - before['bytes_sent']})
+
+    for node in everyone:
+        node.stop_event.set()
+    for node in everyone:
+        node.stop()
+
+    converged = [rotation['seconds'] for rotation in rotations if rotation['seconds'] is not None]
+    print(json.dumps({
+        'nodes': args.nodes,
+        'users': args.users,
+        'fanout': args.fanout,
+        'interval': args.interval,
+        'membership_seconds': membership_seconds,
+        'initial_sync_seconds': sync_seconds,
+        'initial_sync_messages': sync_totals['sent'],
+        'initial_sync_mb': sync_totals['bytes_sent'] / 2 ** 20,
+        'rotations': len(rotations),
+        'rotations_converged': len(converged),
+        'rotation_p50_seconds': sorted(converged)[len(converged) // 2] if converged else None,
+        'rotation_max_seconds': max(converged) if converged else None,
+        'rotation_messages_mean': sum(rotation['messages'] for rotation in rotations) / max(len(rotations), 1),
+        'total_seconds': time.perf_counter() - started,
+        'total_messages': totals(everyone)['sent'],
+        'total_mb': totals(everyone)['bytes_sent'] / 2 ** 20
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Cold-start and warm-start latency of 'credential_manager.lambda_handler' against local moto KMS/IAM/STS.
+
+Cold start runs in a fresh interpreter per sample: import of credential_manager plus the first invocation.
+moto imports boto3 before the timer starts, so the boto3 import itself is excluded from the cold-start import time.
+
+usage: python benchmark/lambda_handler.py --cold 5 --warm 200 --request-type check_credential
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_stand_in():
+    import boto3
+    iam = boto3.client('iam', region_name='us-east-1')
+    iam.create_user(UserName='iam-manager')
+    key = iam.create_access_key(UserName='iam-manager')['AccessKey']
+    kms = boto3.client('kms', region_name='us-east-1')
+    key_id = kms.create_key()['KeyMetadata']['KeyId']
+    blob = kms.encrypt(KeyId=key_id, Plaintext=json.dumps({
+        'aws_access_key_id': key['AccessKeyId'],
+        'aws_secret_access_key': key['SecretAccessKey']
+    }))['CiphertextBlob']
+    return types.SimpleNamespace(client_context=types.SimpleNamespace(custom={
+        'key': base64.b64encode(blob).decode(),
+        'key_alias': key_id,
+        'request_type': 'check_credential',
+        'user_name': 'iam-manager'
+    }))
+
+
+def run_child(request_type: str, warm: int):
+    try:
+        from moto import mock_aws
+    except ImportError:  # moto < 5
+        from moto import mock_iam, mock_kms, mock_sts
+
+        def mock_aws():
+            import contextlib
+            stack = contextlib.ExitStack()
+            for mock in (mock_iam(), mock_kms(), mock_sts()):
+                stack.enter_context(mock)
+            return stack
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'groot'), os.path.join(ROOT, 'server')]
+    with mock_aws():
+        context = setup_stand_in()
+        context.client_context.custom['request_type'] = request_type
+
+        started = time.perf_counter()
+        import credential_manager
+        imported = time.perf_counter()
+        credential_manager.lambda_handler({}, context)
+        first = time.perf_counter()
+
+        samples = []
+        for _ in range(warm):
+            t = time.perf_counter()
+            credential_manager.lambda_handler({}, context)
+            samples.append(time.perf_counter() - t)
+    print(json.dumps({'import': imported - started, 'first_invocation': first - imported, 'warm': samples}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cold', type=int, default=5, help='Number of fresh interpreters.')
+    parser.add_argument('--warm', type=int, default=200, help='Invocations per warm container.')
+    parser.add_argument('--request-type', default='check_credential')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(request_type=args.request_type, warm=args.warm)
+        return
+
+    runs = []
+    for _ in range(args.cold):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', '--warm', str(args.warm), '--request-type', args.request_type],
+            check=True, capture_output=True, text=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    warm = sorted(s for run in runs for s in run['warm'])
+    ms = 1000
+    print(f"request_type     : {args.request_type}")
+    print(f"cold import      : {statistics.median(r['import'] for r in runs) * ms:.1f} ms (median of {len(runs)})")
+    print(f"cold invocation  : {statistics.median(r['first_invocation'] for r in runs) * ms:.1f} ms (median of {len(runs)})")
+    if warm:
+        print(f"warm invocation  : p50 {warm[len(warm) // 2] * ms:.2f} ms, p99 {warm[int(len(warm) * 0.99)] * ms:.2f} ms "
+              f"({len(warm)} samples)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Multi-account rotation (groot/organization.py) against local moto STS/IAM, where every assumed role is its own
+account.
+
+Each account gets '--users' IAM Users with one old key. AWS calls pass the suite's 'before-call' hook for latency,
+and calls of the first account ('--hot-throttle-rate') can be answered with 'Throttling' to show that a throttled
+account backs off alone. Runs once with '--max-accounts' and once serially (1) for comparison.
+
+usage: python benchmark/organization.py --accounts 60 --users 5 --latency-ms 20 --hot-throttle-rate 0.3
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'groot')]
+
+from suite import Injector, mock_aws
+
+ROLE_NAME = 'groot-rotation'
+
+
+class AccountInjector(Injector):
+    """
+    Injector that throttles only calls signed with the credentials of 'hot_keys()', and keeps the time of the last
+    call of the other accounts, which is when they were done.
+    """
+
+    def __init__(self, hot_keys, hot_throttle_rate: float, **kwargs):
+        super().__init__(**kwargs)
+        self.hot_keys = hot_keys
+        self.hot_throttle_rate = hot_throttle_rate
+        self.others_done_at = None
+
+    def before_call(self, model, params, request_signer=None, **kwargs):
+        if not self.enabled:
+            return None
+        credentials = request_signer._credentials if request_signer is not None else None
+        hot = credentials is not None and credentials.access_key in self.hot_keys()
+        with self.lock:
+            self.calls[model.name] = self.calls.get(model.name, 0) + 1
+            throttle = hot and self.random.random() < self.hot_throttle_rate
+            if throttle:
+                self.throttled += 1
+            if not hot:
+                self.others_done_at = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            from botocore.awsrequest import AWSResponse
+            return AWSResponse('https://localhost', 400, {}, None), {
+                'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'},
+                'ResponseMetadata': {'HTTPStatusCode': 400, 'RetryAttempts': 0}
+            }
+        return None
+
+def create_accounts(accounts: int, users: int):
+    """
+    Create users with an old access key in every account, through an assumed role of the account.
+
+    :return: Account ids.
+    """
+    import boto3
+    sts = boto3.client('sts', region_name='us-east-1')
+    account_ids = [f'{100000000000 + i:012d}' for i in range(accounts)]
+    for account_id in account_ids:
+        credentials = sts.assume_role(RoleArn=f'arn:aws:iam::{account_id}:role/{ROLE_NAME}',
+                                      RoleSessionName='setup')['Credentials']
+        iam = boto3.client('iam', region_name='us-east-1', aws_access_key_id=credentials['AccessKeyId'],
+                           aws_secret_access_key=credentials['SecretAccessKey'],
+                           aws_session_token=credentials['SessionToken'])
+        for i in range(users):
+            iam.create_user(UserName=f'user-{i:03d}', Path='/bench/')
+            iam.create_access_key(UserName=f'user-{i:03d}')
+    return account_ids
+
+
+def run(account_ids: list, max_accounts: int, account_workers: int, latency: float, hot_throttle_rate: float,
+        seed: int):
+    import boto3
+    from groot import Organization, RoleCredentialCache
+    from pool import ClientPool
+
+    role_cache = RoleCredentialCache()
+    organization = Organization(account_ids=account_ids, role_name=ROLE_NAME, max_accounts=max_accounts,
+                                account_workers=account_workers, role_cache=role_cache)
+    hot_role = organization.role_arn(account_ids[0])
+    injector = AccountInjector(
+        hot_keys=lambda: {credentials['AccessKeyId'] for key, credentials in list(role_cache.entries.items())
+                          if key[1] == hot_role},
+        hot_throttle_rate=hot_throttle_rate, latency=latency, seed=seed)
+    session = boto3.session.Session()
+    session.events.register('before-call', injector.before_call)
+    organization.pool.session = session
+    organization.session.pool = ClientPool()
+    organization.session.pool.session = session
+
+    injector.enabled = True
+    started = time.perf_counter()
+    result = organization.rotate(path_prefix='/bench/', force=True)
+    wall_seconds = time.perf_counter() - started
+    injector.enabled = False
+
+    metrics = organization.metrics()
+    return {
+        'accounts': len(account_ids),
+        'max_accounts': max_accounts,
+        'account_workers': account_workers,
+        'wall_seconds': wall_seconds,
+        'other_accounts_seconds': injector.others_done_at - started if injector.others_done_at else None,
+        'rotated': result['Rotated'],
+        'failed_users': result['FailedUsers'],
+        'failed_accounts': len(result['Failed']),
+        'assume_role_calls': injector.calls.get('AssumeRole', 0),
+        'api_calls': sum(injector.calls.values()),
+        'throttled': injector.throttled,
+        'hot_account_retries': sum(m['Retries'] for m in metrics['Accounts'].get(account_ids[0], {}).values()),
+        'other_account_retries': sum(m['Retries'] for account_id, limiter in metrics['Accounts'].items()
+                                     if account_id != account_ids[0] for m in limiter.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=60)
+    parser.add_argument('--users', type=int, default=5, help='IAM Users per account.')
+    parser.add_argument('--max-accounts', type=int, default=16)
+    parser.add_argument('--account-workers', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--hot-throttle-rate', type=float, default=0.3,
+                        help="Fraction of calls of the first account answered with 'Throttling'.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GROOT_TRACE', '0')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        os.environ.setdefault(name, 'testing')
+    for max_accounts in (args.max_accounts, 1):
+        with mock_aws():
+            account_ids = create_accounts(args.accounts, args.users)
+            print(json.dumps(run(account_ids, max_accounts=max_accounts, account_workers=args.account_workers,
+                                 latency=args.latency_ms / 1000, hot_throttle_rate=args.hot_throttle_rate,
+                                 seed=args.seed)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
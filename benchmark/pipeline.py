@@ -0,0 +1,127 @@
+"""
+Pipelined rotation (groot/pipeline.py) against local moto IAM/STS with simulated IAM propagation delay.
+
+A new access key answers 'InvalidClientTokenId' to 'GetCallerIdentity' until '--propagation-seconds' after its
+creation, like IAM does for a few seconds. Users are rotated once one by one through the same stages (serial),
+and once through the pipeline, where their propagation waits overlap.
+
+usage: python benchmark/pipeline.py --users 200 --propagation-seconds 2 --latency-ms 20
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'groot')]
+
+from suite import Injector, mock_aws, create_users, USER_PATH
+
+
+class PropagationInjector(Injector):
+    """
+    Injector that also answers 'GetCallerIdentity' of keys younger than 'propagation' with 'InvalidClientTokenId'.
+    """
+
+    def __init__(self, propagation: float, **kwargs):
+        super().__init__(**kwargs)
+        self.propagation = propagation
+        self.created = {}  # access key id -> perf_counter
+        self.rejected = 0
+        self.created_lock = threading.Lock()
+
+    def after_call(self, model, parsed, **kwargs):
+        if model.name == 'CreateAccessKey' and 'AccessKey' in parsed:
+            with self.created_lock:
+                self.created[parsed['AccessKey']['AccessKeyId']] = time.perf_counter()
+
+    def before_call(self, model, params, request_signer=None, **kwargs):
+        response = super().before_call(model=model, params=params, **kwargs)
+        if response is not None or model.name != 'GetCallerIdentity' or request_signer is None:
+            return response
+        with self.created_lock:
+            created = self.created.get(request_signer._credentials.access_key)
+            young = created is not None and time.perf_counter() - created < self.propagation
+            if young:
+                self.rejected += 1
+        if young:
+            from botocore.awsrequest import AWSResponse
+            return AWSResponse('https://localhost', 403, {}, None), {
+                'Error': {'Code': 'InvalidClientTokenId', 'Message': 'The security token included is invalid.'},
+                'ResponseMetadata': {'HTTPStatusCode': 403, 'RetryAttempts': 0}
+            }
+        return None
+
+
+def run(mode: str, users: int, propagation: float, latency: float, workers: int, seed: int):
+    import boto3
+    from groot import ClientPool, RateLimiter, RotationPipeline, Service
+
+    with mock_aws():
+        admin_key, _, _, user_names = create_users(users)
+        injector = PropagationInjector(propagation=propagation, latency=latency, seed=seed)
+        session = boto3.session.Session()
+        session.events.register('before-call', injector.before_call)
+        session.events.register('after-call', injector.after_call)
+        pool = ClientPool(max_size=256)
+        pool.session = session
+        service = Service(access_key_id=admin_key['AccessKeyId'], secret_access_key=admin_key['SecretAccessKey'],
+                          pool=pool, limiter=RateLimiter(default_rate=1e6))
+        stage_workers = {stage: workers for stage in ('create', 'verify', 'deactivate', 'delete')}
+
+        injector.enabled = True
+        started = time.perf_counter()
+        if mode == 'serial':
+            result = {'Rotated': {}, 'Skipped': [], 'Failed': {}}
+            for user_name in user_names:
+                one = RotationPipeline(service=service, force=True, workers={stage: 1 for stage in stage_workers})
+                for key, value in one.run([user_name]).items():
+                    if key != 'Stages':
+                        result[key].update(value) if isinstance(value, dict) else result[key].extend(value)
+            stages = None
+        else:
+            result = service.rotate_pipeline(user_names=user_names, path_prefix=USER_PATH, force=True,
+                                             workers=stage_workers)
+            stages = result['Stages']
+        wall_seconds = time.perf_counter() - started
+        injector.enabled = False
+
+    return {
+        'mode': mode,
+        'users': users,
+        'propagation_seconds': propagation,
+        'latency_ms': latency * 1000,
+        'workers_per_stage': 1 if mode == 'serial' else workers,
+        'wall_seconds': wall_seconds,
+        'users_per_second': users / wall_seconds,
+        'rotated': len(result['Rotated']),
+        'failed': len(result['Failed']),
+        'api_calls': sum(injector.calls.values()),
+        'not_propagated_answers': injector.rejected,
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--propagation-seconds', type=float, default=2.0)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--workers', type=int, default=4, help='Workers per stage of the pipeline.')
+    parser.add_argument('--modes', nargs='+', default=['pipeline', 'serial'], choices=['pipeline', 'serial'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GROOT_TRACE', '0')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        os.environ.setdefault(name, 'testing')
+    for mode in args.modes:
+        print(json.dumps(run(mode, users=args.users, propagation=args.propagation_seconds,
+                             latency=args.latency_ms / 1000, workers=args.workers, seed=args.seed)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
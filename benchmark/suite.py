@@ -0,0 +1,276 @@
+"""
+Offline benchmark suite of the rotation paths against local moto IAM/STS/KMS.
+
+Scenarios :
+    publish          'Service.publish_new_credential' for every user.
+    need_to_publish  'Service.need_to_publish_new_credential' for every user.
+    lambda_handler   'credential_manager.lambda_handler' with 'check_credential' for every user.
+
+Every (scenario, users) runs in a fresh interpreter, so import time and peak memory are its own.
+AWS calls of the measured phase pass a 'before-call' hook that counts them per API, adds latency and answers
+a fraction of them with 'Throttling' instead of calling moto. Rate limit is off unless '--rate' is given.
+
+Each run is a JSON line on stdout (and '--output'). '--compare' reads an earlier output and reports changes
+beyond '--tolerance', exiting with 1 if any metric regressed.
+
+usage: python benchmark/suite.py --users 1 100 10000 --latency-ms 20 --throttle-rate 0.02 --output base.jsonl
+       python benchmark/suite.py --users 100 --compare base.jsonl
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('publish', 'need_to_publish', 'lambda_handler')
+ADMIN_USER = 'iam-manager'
+USER_PATH = '/bench/'
+COMPARED = ('wall_seconds', 'p50_ms', 'p99_ms', 'api_calls_per_op', 'peak_rss_mb', 'import_ms')
+
+
+class Injector:
+    """
+    'before-call' hook. Count calls per API, sleep 'latency' seconds and answer 'throttle_rate' of calls with
+    'Throttling'. Answered calls never reach moto, like a throttle after botocore retries ran out.
+    """
+
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.calls = {}
+        self.throttled = 0
+
+    def before_call(self, model, params, **kwargs):
+        if not self.enabled:
+            return None
+        with self.lock:
+            self.calls[model.name] = self.calls.get(model.name, 0) + 1
+            throttle = self.random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            from botocore.awsrequest import AWSResponse
+            return AWSResponse('https://localhost', 400, {}, None), {
+                'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'},
+                'ResponseMetadata': {'HTTPStatusCode': 400, 'RetryAttempts': 0}
+            }
+        return None
+
+
+def mock_aws():
+    try:
+        from moto import mock_aws as mock
+        return mock()
+    except ImportError:  # moto < 5
+        import contextlib
+        from moto import mock_iam, mock_kms, mock_sts
+        stack = contextlib.ExitStack()
+        for mock in (mock_iam(), mock_kms(), mock_sts()):
+            stack.enter_context(mock)
+        return stack
+
+
+def create_users(amount: int):
+    """
+    :return: (admin access key, KMS key id, KMS encrypted admin credential, IAM User names)
+    """
+    import boto3
+    iam = boto3.client('iam', region_name='us-east-1')
+    iam.create_user(UserName=ADMIN_USER)
+    admin_key = iam.create_access_key(UserName=ADMIN_USER)['AccessKey']
+    user_names = [f'user-{i:05d}' for i in range(amount)]
+    for user_name in user_names:
+        iam.create_user(UserName=user_name, Path=USER_PATH)
+        iam.create_access_key(UserName=user_name)
+    kms = boto3.client('kms', region_name='us-east-1')
+    key_id = kms.create_key()['KeyMetadata']['KeyId']
+    blob = kms.encrypt(KeyId=key_id, Plaintext=json.dumps({
+        'aws_access_key_id': admin_key['AccessKeyId'],
+        'aws_secret_access_key': admin_key['SecretAccessKey']
+    }))['CiphertextBlob']
+    return admin_key, key_id, blob, user_names
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def run_child(scenario: str, users: int, latency: float, throttle_rate: float, rate: float, seed: int):
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'groot'), os.path.join(ROOT, 'server')]
+    started = time.perf_counter()
+    if scenario == 'lambda_handler':
+        import credential_manager
+    else:
+        import groot
+    import_seconds = time.perf_counter() - started
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        import boto3
+        from groot import ClientPool, RateLimiter, Service
+        admin_key, key_id, blob, user_names = create_users(users)
+
+        injector = Injector(latency=latency, throttle_rate=throttle_rate, seed=seed)
+        session = boto3.session.Session()
+        session.events.register('before-call', injector.before_call)
+        if scenario == 'lambda_handler':
+            credential_manager.client_pool.session = session
+            limiter = sys.modules['throttle'].default_limiter  # The one Service of the handler uses.
+            limiter.default_rate = rate
+            limiter.buckets.clear()
+            custom = {'key': base64.b64encode(blob).decode(), 'key_alias': key_id,
+                      'request_type': 'check_credential'}
+
+            def operation(user_name):
+                context = types.SimpleNamespace(client_context=types.SimpleNamespace(
+                    custom=dict(custom, user_name=user_name)))
+                credential_manager.lambda_handler({}, context)
+        else:
+            pool = ClientPool()
+            pool.session = session
+            limiter = RateLimiter(default_rate=rate)
+            service = Service(access_key_id=admin_key['AccessKeyId'], secret_access_key=admin_key['SecretAccessKey'],
+                              pool=pool, limiter=limiter)
+            if scenario == 'publish':
+                def operation(user_name):
+                    service.publish_new_credential(user_name=user_name, switch_session=False)
+            else:
+                def operation(user_name):
+                    service.need_to_publish_new_credential(user_name=user_name)
+
+        rss_before = peak_rss_mb()
+        injector.enabled = True
+        samples, failed = [], 0
+        started = time.perf_counter()
+        for user_name in user_names:
+            t = time.perf_counter()
+            try:
+                operation(user_name)
+            except Exception:
+                failed += 1
+            samples.append(time.perf_counter() - t)
+        wall_seconds = time.perf_counter() - started
+        injector.enabled = False
+        rss_after = peak_rss_mb()
+
+    samples.sort()
+    rate_metrics = limiter.metrics()
+    api_calls = sum(injector.calls.values())
+    return {
+        'scenario': scenario,
+        'users': users,
+        'latency_ms': latency * 1000,
+        'throttle_rate': throttle_rate,
+        'rate': rate,
+        'wall_seconds': wall_seconds,
+        'ops_per_second': len(samples) / wall_seconds if wall_seconds else None,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'failed': failed,
+        'api_calls': api_calls,
+        'api_calls_per_op': api_calls / len(samples),
+        'api_calls_by_name': dict(sorted(injector.calls.items())),
+        'throttled': injector.throttled,
+        'retries': sum(m['Retries'] for m in rate_metrics.values()),
+        'peak_rss_mb': rss_after,
+        'rss_growth_mb': rss_after - rss_before if rss_after is not None else None,
+        'import_ms': import_seconds * 1000,
+        'python': platform.python_version(),
+    }
+
+
+def run_key(record: dict):
+    return record['scenario'], record['users'], record['latency_ms'], record['throttle_rate'], record['rate']
+
+
+def compare(records: list, baseline_path: str, tolerance: float):
+    """
+    Print changes of 'COMPARED' metrics against the baseline runs with the same parameters.
+
+    :return: True if any metric is worse than the baseline by more than 'tolerance'.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {run_key(record): record for record in map(json.loads, filter(str.strip, f))}
+    regressed = False
+    print(f"{'scenario':<16} {'users':>6} {'metric':<17} {'baseline':>12} {'current':>12} {'change':>8}",
+          file=sys.stderr)
+    for record in records:
+        base = baseline.get(run_key(record))
+        if base is None:
+            print(f"{record['scenario']:<16} {record['users']:>6} no baseline", file=sys.stderr)
+            continue
+        for metric in COMPARED:
+            old, new = base.get(metric), record.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            worse = change > tolerance
+            regressed = regressed or worse
+            print(f"{record['scenario']:<16} {record['users']:>6} {metric:<17} {old:>12.3f} {new:>12.3f} "
+                  f"{change:>+7.1%}{' !' if worse else ''}", file=sys.stderr)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark suite of groot rotation paths.')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Latency added to every AWS call.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Fraction of AWS calls answered with 'Throttling'.")
+    parser.add_argument('--rate', type=float, default=1e6,
+                        help='Requests per second per API of the rate limiter. Unlimited by default.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Append JSON lines of the runs to the file.')
+    parser.add_argument('--compare', help='JSON lines of an earlier run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression.')
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'USERS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        record = run_child(scenario=args.child[0], users=int(args.child[1]), latency=args.latency_ms / 1000,
+                           throttle_rate=args.throttle_rate, rate=args.rate, seed=args.seed)
+        print(json.dumps(record))
+        return
+
+    env = dict(os.environ, GROOT_TRACE=os.environ.get('GROOT_TRACE', '0'))
+    records = []
+    for scenario in args.scenarios:
+        for users in args.users:
+            output = subprocess.run(
+                [sys.executable, __file__, '--child', scenario, str(users), '--latency-ms', str(args.latency_ms),
+                 '--throttle-rate', str(args.throttle_rate), '--rate', str(args.rate), '--seed', str(args.seed)],
+                check=True, capture_output=True, text=True, env=env
+            ).stdout
+            record = json.loads(output.strip().splitlines()[-1])
+            records.append(record)
+            print(json.dumps(record), flush=True)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    if args.compare and compare(records, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from shared import tracer
+
+
+def isoformat(ts: float):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+class Agent:
+    """
+    Run 'tick' over and over in one process, so interpreter start, boto import and clients are paid once per host.
+
+    'tick' returns a dict with optional 'next_due' (POSIX timestamp of the next deadline). The agent sleeps until
+    'next_due' or 'interval' seconds, whichever comes first, stretched or shrunk by up to 'jitter' of it, so hosts
+    started together don't call IAM at the same moment. A failed tick is tried again after 'retry_seconds'.
+    """
+
+    def __init__(self, tick, interval: float = 3600, jitter: float = 0.1, retry_seconds: float = 300,
+                 min_sleep: float = 1):
+        self.tick = tick
+        self.interval = interval
+        self.jitter = jitter
+        self.retry_seconds = retry_seconds
+        self.min_sleep = min_sleep
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.state = {
+            'state': 'starting',
+            'started_at': time.time(),
+            'ticks': 0,
+            'failures': 0,
+            'last_tick_at': None,
+            'last_tick_seconds': None,
+            'last_error': None,
+            'last_result': None,
+            'next_tick_at': None,
+        }
+
+    def next_delay(self, next_due: float = None):
+        delay = self.interval if next_due is None else min(self.interval, next_due - time.time())
+        return max(self.min_sleep, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def run_once(self):
+        """
+        :return: Seconds to sleep before the next tick.
+        """
+        self.update(state='running')
+        started = time.time()
+        try:
+            result = self.tick() or {}
+        except Exception as e:
+            tracer.event('agent.failed', error=str(e))
+            with self.lock:
+                self.state['failures'] += 1
+            self.update(last_error=str(e), last_tick_at=started, last_tick_seconds=time.time() - started)
+            return max(self.min_sleep, self.retry_seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+        with self.lock:
+            self.state['ticks'] += 1
+        self.update(last_error=None, last_result=result, last_tick_at=started,
+                    last_tick_seconds=time.time() - started)
+        return self.next_delay(result.get('next_due'))
+
+    def run(self):
+        """
+        Tick until 'stop'.
+        """
+        tracer.event('agent.started', interval=self.interval, jitter=self.jitter)
+        while not self.stop_event.is_set():
+            delay = self.run_once()
+            self.update(state='sleeping', next_tick_at=time.time() + delay)
+            self.stop_event.wait(delay)
+        self.update(state='stopped', next_tick_at=None)
+        tracer.event('agent.stopped')
+
+    def stop(self):
+        self.stop_event.set()
+
+    def update(self, **state):
+        with self.lock:
+            self.state.update(state)
+
+    def status(self):
+        """
+        :return: JSON serializable state. Times are ISO 8601 in UTC.
+        """
+        with self.lock:
+            state = dict(self.state)
+        for key in ('started_at', 'last_tick_at', 'next_tick_at'):
+            state[key] = isoformat(state[key])
+        state['uptime_seconds'] = time.time() - self.state['started_at']
+        return state
+
+
+class StatusServer:
+    """
+    Local HTTP endpoint of an agent. Bind to loopback only, it tells key ids and rotation state.
+
+    GET /status  : Agent.status() as JSON
+    GET /metrics : Latency histograms and call counters in Prometheus text format
+    GET /healthz : 200 while the last tick succeeded, 503 after a failure
+    """
+
+    def __init__(self, agent: Agent, host: str = '127.0.0.1', port: int = 0, extra_status=None):
+        """
+        :param port: 0 for any free port. The bound port is 'self.port'.
+        :param extra_status: Function returning a dict merged into /status. e.g. current access key id
+        """
+        self.agent = agent
+        self.extra_status = extra_status
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def handler_class(self):
+        status_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/status':
+                    status = status_server.agent.status()
+                    if status_server.extra_status is not None:
+                        status.update(status_server.extra_status())
+                    self.reply(200, 'application/json', json.dumps(status, default=str))
+                elif self.path == '/metrics':
+                    self.reply(200, 'text/plain; version=0.0.4', tracer.prometheus())
+                elif self.path == '/healthz':
+                    healthy = status_server.agent.status()['last_error'] is None
+                    self.reply(200 if healthy else 503, 'text/plain', 'ok\n' if healthy else 'failing\n')
+                else:
+                    self.reply(404, 'text/plain', 'not found\n')
+
+            def reply(self, code: int, content_type: str, body: str):
+                data = body.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):  # Keep stderr quiet, requests are local polls.
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='agent-status', daemon=True)
+        self.thread.start()
+        tracer.event('agent.status_server', address=f'{self.server.server_address[0]}:{self.port}')
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,122 @@
+import os
+import re
+import tempfile
+from shared import tracer
+
+section_pattern = re.compile(r'^\s*\[([^\]]+)\]\s*$')
+key_pattern = re.compile(r'^([^=#;\s][^=]*?)\s*=')
+
+
+def default_credentials_path():
+    return os.path.expanduser(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'))
+
+
+class CredentialsFile:
+    """
+    In-process writer of the aws cli shared credentials file. Replacement of 'aws configure set'.
+
+    The file is read once, any number of profiles are updated in memory, and 'commit' writes them with a single
+    atomic rename. Readers never see a profile with a new access key id but an old secret access key.
+    Comments and unrelated lines are kept as they are.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or default_credentials_path()
+        self.lines = []
+        self.changed = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.lines = f.read().splitlines()
+        else:
+            self.lines = []
+        self.changed = False
+
+    def section_range(self, profile_name: str):
+        """
+        :return: (index of section header, index after the last line of section). None if there isn't the section.
+        """
+        start = None
+        for i, line in enumerate(self.lines):
+            match = section_pattern.match(line)
+            if not match:
+                continue
+            if start is not None:
+                return start, i
+            if match.group(1).strip() == profile_name:
+                start = i
+        return (start, len(self.lines)) if start is not None else None
+
+    def get(self, profile_name: str, key: str):
+        section = self.section_range(profile_name)
+        if section is None:
+            return None
+        for line in self.lines[section[0] + 1:section[1]]:
+            match = key_pattern.match(line)
+            if match and match.group(1) == key:
+                return line.split('=', 1)[1].strip()
+        return None
+
+    def set(self, profile_name: str, key: str, value: str):
+        section = self.section_range(profile_name)
+        if section is None:
+            if self.lines and self.lines[-1].strip():
+                self.lines.append('')
+            self.lines += [f'[{profile_name}]', f'{key} = {value}']
+            self.changed = True
+            return
+        start, end = section
+        for i in range(start + 1, end):
+            match = key_pattern.match(self.lines[i])
+            if match and match.group(1) == key:
+                self.lines[i] = f'{key} = {value}'
+                self.changed = True
+                return
+        # Put the new key after the last non blank line of the section.
+        while end > start + 1 and not self.lines[end - 1].strip():
+            end -= 1
+        self.lines.insert(end, f'{key} = {value}')
+        self.changed = True
+
+    def set_credential(self, profile_name: str, access_key_id: str, secret_access_key: str):
+        self.set(profile_name, 'aws_access_key_id', access_key_id)
+        self.set(profile_name, 'aws_secret_access_key', secret_access_key)
+
+    def commit(self):
+        """
+        Write to a temporary file in the same directory, then rename it over the credentials file.
+        """
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.credentials-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(self.lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.changed = False
+        tracer.event('aws_config.saved', path=self.path)
+
+
+def set_credentials(credentials: dict, path: str = None):
+    """
+    Update credentials of many profiles with one read and one atomic write.
+
+    :param credentials: {'{PROFILE_NAME}': ('{ACCESS_KEY_ID}', '{SECRET_ACCESS_KEY}')}
+    :param path: Credentials file path. '~/.aws/credentials' or $AWS_SHARED_CREDENTIALS_FILE for None.
+    :return: None
+    """
+    credentials_file = CredentialsFile(path=path)
+    for profile_name, (access_key_id, secret_access_key) in credentials.items():
+        credentials_file.set_credential(profile_name, access_key_id, secret_access_key)
+    credentials_file.commit()
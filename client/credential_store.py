@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+import json
+import os
+import tempfile
+import threading
+from shared import tracer
+
+
+class CredentialStore:
+    """
+    Local credential store in a single append-only file (JSON lines), indexed by user name and access key id.
+
+    Every record is appended, and the latest record of a user is its current credential.
+    The file is read once when the store is opened, then lookups are dictionary lookups.
+    When superseded records are more than 'compact_threshold' and than current ones, the file is rewritten
+    with current credentials only.
+    """
+
+    def __init__(self, path: str, compact_threshold: int = 1000):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.current = {}  # user_name -> record
+        self.access_keys = {}  # access_key_id -> record
+        self.records = 0
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        self.current.clear()
+        self.access_keys.clear()
+        self.records = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Last line can be torn by a crash during append.
+                    continue
+                self.apply(record)
+
+    def apply(self, record: dict):
+        self.records += 1
+        if record.get('op') == 'delete':
+            deleted = self.access_keys.pop(record['access_key_id'], None)
+            if deleted is not None and self.current.get(deleted['user_name']) is deleted:
+                del self.current[deleted['user_name']]
+            return
+        self.current[record['user_name']] = record
+        self.access_keys[record['access_key_id']] = record
+
+    def append(self, record: dict):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.apply(record)
+
+    def put(self, user_name: str, access_key_id: str, secret_access_key: str, profile_name: str = None):
+        """
+        Save a new credential of IAM User. It becomes the current credential of the user.
+        """
+        record = {
+            'user_name': user_name,
+            'access_key_id': access_key_id,
+            'secret_access_key': secret_access_key,
+            'profile_name': profile_name,
+            'saved_at': datetime.now(timezone.utc).isoformat()
+        }
+        with self.lock:
+            self.append(record)
+            if self.records - len(self.current) > max(self.compact_threshold, len(self.current)):
+                self.compact()
+        tracer.event('credential_store.saved', user=user_name, access_key_id=access_key_id, path=self.path)
+        return record
+
+    def remove(self, access_key_id: str):
+        with self.lock:
+            if access_key_id in self.access_keys:
+                self.append({'op': 'delete', 'access_key_id': access_key_id})
+
+    def get_current(self, user_name: str):
+        """
+        :return: {'user_name', 'access_key_id', 'secret_access_key', 'profile_name', 'saved_at'} or None
+        """
+        return self.current.get(user_name)
+
+    def get(self, access_key_id: str):
+        return self.access_keys.get(access_key_id)
+
+    def compact(self):
+        """
+        Rewrite the file with the current credential of each user only. Written to a temporary file,
+        then renamed over the store, so a crash never leaves a half written store.
+        """
+        with self.lock:
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.store-', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    for record in self.current.values():
+                        f.write(json.dumps(record) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(temp_path, 0o600)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            superseded = self.records - len(self.current)
+            self.access_keys = {record['access_key_id']: record for record in self.current.values()}
+            self.records = len(self.current)
+        tracer.event('credential_store.compacted', path=self.path, removed=superseded)
+
+    def export(self, directory: str, user_name: str = None):
+        """
+        Export current credentials as the per key file layout. '{directory}/credentials-{user}-{key}'
+
+        :param directory: Directory to export to.
+        :param user_name: Export only this IAM User. All users for None.
+        :return: list of exported file paths.
+        """
+        if user_name is None:
+            records = list(self.current.values())
+        else:
+            records = [self.current[user_name]] if user_name in self.current else []
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for record in records:
+            path = f"{directory}/credentials-{record['user_name']}-{record['access_key_id']}"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"[{record['profile_name']}]\n")
+                f.write(f"access_key_id = {record['access_key_id']}\n")
+                f.write(f"secret_access_key = {record['secret_access_key']}\n")
+            paths.append(path)
+        return paths
@@ -0,0 +1,120 @@
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+
+DAY = 86400
+
+
+class DeadlineIndex:
+    """
+    Persistent min-heap of (next action time, user name, access key id). One deadline per IAM User.
+
+    A deadline is the creation time of the user's active key plus 'max_age_days', so only due users are checked.
+    Updating a user pushes a new entry and leaves the old one in the heap, which is skipped when it comes up.
+    """
+
+    def __init__(self, path: str, max_age_days: float):
+        self.path = path
+        self.max_age = max_age_days * DAY
+        self.heap = []  # [due_ts, user_name, access_key_id]
+        self.current = {}  # user_name -> entry in heap
+        self.lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.current)
+
+    def __contains__(self, user_name: str):
+        return user_name in self.current
+
+    def load(self):
+        self.heap = []
+        self.current = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('max_age') != self.max_age:  # Rule changed, deadlines must be built again.
+            return
+        for due_ts, user_name, access_key_id in data['entries']:
+            entry = [due_ts, user_name, access_key_id]
+            self.current[user_name] = entry
+            self.heap.append(entry)
+        heapq.heapify(self.heap)
+
+    def save(self):
+        """
+        Write live entries with a temporary file and an atomic rename.
+        """
+        with self.lock:
+            data = {'max_age': self.max_age, 'entries': sorted(self.current.values())}
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.deadlines-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def update(self, user_name: str, access_key_id: str, created_ts: float):
+        """
+        Set the deadline of IAM User from the creation time of its active key.
+
+        :return: due POSIX timestamp
+        """
+        return self.schedule(user_name, access_key_id, created_ts + self.max_age)
+
+    def schedule(self, user_name: str, access_key_id: str, due_ts: float):
+        """
+        Set the deadline of IAM User. e.g. Retry time after a failure.
+
+        :return: due POSIX timestamp
+        """
+        entry = [due_ts, user_name, access_key_id]
+        with self.lock:
+            self.current[user_name] = entry
+            heapq.heappush(self.heap, entry)
+            if len(self.heap) > 2 * len(self.current) + 64:  # Too many stale entries, rebuild the heap.
+                self.heap = list(self.current.values())
+                heapq.heapify(self.heap)
+        return entry[0]
+
+    def remove(self, user_name: str):
+        with self.lock:
+            self.current.pop(user_name, None)
+
+    def next_due(self):
+        """
+        :return: POSIX timestamp of the earliest deadline. None for empty index.
+        """
+        with self.lock:
+            self.drop_stale()
+            return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now_ts: float = None):
+        """
+        Take out deadlines that have come. They must be put back with 'update' after processing.
+
+        :return: list of (user_name, access_key_id)
+        """
+        now_ts = time.time() if now_ts is None else now_ts
+        due = []
+        with self.lock:
+            self.drop_stale()
+            while self.heap and self.heap[0][0] <= now_ts:
+                entry = heapq.heappop(self.heap)
+                del self.current[entry[1]]
+                due.append((entry[1], entry[2]))
+                self.drop_stale()
+        return due
+
+    def drop_stale(self):
+        while self.heap and self.current.get(self.heap[0][1]) is not self.heap[0]:
+            heapq.heappop(self.heap)
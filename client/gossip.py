@@ -0,0 +1,326 @@
+"""
+Gossip of per-user access key state between clients and the server seed node, over UDP.
+
+Every datagram is signed with HMAC-SHA256 of a secret shared by all nodes, and unsigned, forged or old
+datagrams are dropped. The secret is read from environment variable IAM_MANAGER_GOSSIP_SECRET.
+
+Run the seed node of the server side :
+    IAM_MANAGER_GOSSIP_SECRET=... python client/gossip.py --host 0.0.0.0 --port 7946
+"""
+import argparse
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+DEFAULT_PORT = 7946
+DEFAULT_FANOUT = 3
+DEFAULT_INTERVAL = 1.0
+MAX_DIGEST_ENTRIES = 500  # Users per range of the digest, keeps a datagram well below 64 KiB.
+MAX_UPDATES = 200  # States per ACK, ACK2 and PUSH message.
+PEER_SAMPLE = 5  # Known peers piggybacked on every message, so membership spreads from the seed.
+ROTATION_TIMEOUT = 600  # A rotation announced longer ago than this is considered abandoned.
+MAX_CLOCK_SKEW = 300  # Datagrams sent longer ago than this are dropped, so a captured one can't be replayed later.
+MAC_SIZE = 32  # HMAC-SHA256 in front of every datagram
+SECRET_ENV = 'IAM_MANAGER_GOSSIP_SECRET'
+
+
+def newer(state: dict, version: list):
+    """
+    :return: True if 'state' wins over the version [version, origin]. Ties of version are broken by origin.
+    """
+    return version is None or (state['version'], state['origin']) > (version[0], version[1])
+
+
+class GossipNode:
+    """
+    Versioned key state per IAM User, spread by push-pull anti-entropy and rumor mongering.
+
+    State : {'user', 'access_key_id', 'created_at', 'rotating', 'updated_at', 'version', 'origin'}
+    A state replaces the one held when its (version, origin) is higher. Secrets are never gossiped.
+
+    Every 'interval' seconds the node sends a hash per range of its sorted users to 'fanout' random peers (SYN).
+    For a range that hashes differently, the peer sends its digest ({user: [version, origin]}) of it (DIGEST),
+    which is answered with the states that are newer and the users that are behind (ACK), and those are sent
+    back (ACK2). Hosts in sync exchange only the hashes. A local update, and every state first heard from a PUSH,
+    is pushed on to 'fanout' peers at once, so a rotation reaches N hosts in about log(N) hops instead of waiting
+    for rounds.
+
+    Datagrams carry an HMAC of 'secret' and the send time. Anything without the right HMAC, or sent more than
+    'MAX_CLOCK_SKEW' seconds away from now, is dropped before it is read.
+    """
+
+    def __init__(self, secret: str, host: str = '127.0.0.1', port: int = 0, seeds: list = (), node_id: str = None,
+                 fanout: int = DEFAULT_FANOUT, interval: float = DEFAULT_INTERVAL):
+        if not secret:
+            raise ValueError("Error, Gossip needs a shared secret.")
+        self.secret = secret.encode('utf-8')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.node_id = node_id or f'{socket.gethostname()}:{self.address[1]}'
+        self.fanout = fanout
+        self.interval = interval
+        self.states = {}  # user_name -> state
+        self.users = []  # Sorted user names of 'states'
+        self.hashes = {}  # (low, high) -> hash of the range, cleared on every change
+        self.peers = {}  # (host, port) -> node_id or None for seeds not heard from yet
+        self.lock = threading.Lock()
+        for seed in seeds:
+            self.add_peer(tuple(seed))
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'sent': 0, 'received': 0, 'bytes_sent': 0, 'bytes_received': 0, 'applied': 0, 'rejected': 0}
+
+    def add_peer(self, address: tuple, node_id: str = None):
+        if address == self.address or node_id == self.node_id:
+            return
+        with self.lock:
+            if node_id is not None or address not in self.peers:
+                self.peers[address] = node_id
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f'gossip-{self.node_id}', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        try:  # Wake the receive loop now instead of at its timeout.
+            self.sock.sendto(b'', ('127.0.0.1' if self.address[0] == '0.0.0.0' else self.address[0], self.address[1]))
+        except OSError:
+            pass
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
+
+    def get(self, user_name: str):
+        """
+        :return: Copy of the state of IAM User. None if not known.
+        """
+        with self.lock:
+            state = self.states.get(user_name)
+            return dict(state) if state else None
+
+    def update(self, user_name: str, access_key_id: str, created_at: float, rotating: bool = False):
+        """
+        Set state of IAM User as seen by this host and push it to peers. Nothing happens if it is already known,
+        so hosts that observe the same key don't bump the version over each other.
+
+        :return: New state, None if unchanged.
+        """
+        with self.lock:
+            current = self.states.get(user_name)
+            if current is not None and (current['access_key_id'], current['created_at'], current['rotating']) == \
+                    (access_key_id, created_at, rotating):
+                return None
+            state = {
+                'user': user_name,
+                'access_key_id': access_key_id,
+                'created_at': created_at,
+                'rotating': rotating,
+                'updated_at': time.time(),
+                'version': current['version'] + 1 if current else 1,
+                'origin': self.node_id
+            }
+            if current is None:
+                bisect.insort(self.users, user_name)
+            self.states[user_name] = state
+            self.hashes.clear()
+        self.push([state])
+        return dict(state)
+
+    def apply(self, states: list):
+        """
+        :return: States that were newer than the ones held.
+        """
+        applied = []
+        with self.lock:
+            for state in states:
+                current = self.states.get(state['user'])
+                if newer(state, None if current is None else [current['version'], current['origin']]):
+                    if current is None:
+                        bisect.insort(self.users, state['user'])
+                    self.states[state['user']] = state
+                    applied.append(state)
+            if applied:
+                self.hashes.clear()
+            self.stats['applied'] += len(applied)
+        return applied
+
+    def range_users(self, low: str = None, high: str = None):
+        """
+        :return: Sorted user names in [low, high). None for no bound. Call with the lock held.
+        """
+        start = 0 if low is None else bisect.bisect_left(self.users, low)
+        end = len(self.users) if high is None else bisect.bisect_left(self.users, high)
+        return self.users[start:end]
+
+    def range_hash(self, low: str = None, high: str = None):
+        """
+        :return: Hash of versions of users in [low, high). Cached until the next change, peers in sync ask for
+                 the same ranges. Call with the lock held.
+        """
+        key = (low, high)
+        if key not in self.hashes:
+            h = hashlib.blake2b(digest_size=8)
+            for user in self.range_users(low, high):
+                state = self.states[user]
+                h.update(f"{user}\0{state['version']}\0{state['origin']}\n".encode('utf-8'))
+            self.hashes[key] = h.hexdigest()
+        return self.hashes[key]
+
+    def digest(self, low: str = None, high: str = None):
+        with self.lock:
+            return {user: [self.states[user]['version'], self.states[user]['origin']]
+                    for user in self.range_users(low, high)}
+
+    def send(self, address: tuple, message: dict):
+        with self.lock:
+            peers = random.sample(list(self.peers.items()), min(PEER_SAMPLE, len(self.peers)))
+        message = dict(message, sender=self.node_id, time=time.time(),
+                       peers=[[host, port, node_id] for (host, port), node_id in peers if node_id])
+        payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        data = hmac.new(self.secret, payload, hashlib.sha256).digest() + payload
+        try:
+            self.sock.sendto(data, address)
+        except OSError:
+            return
+        with self.lock:
+            self.stats['sent'] += 1
+            self.stats['bytes_sent'] += len(data)
+
+    def open(self, data: bytes):
+        """
+        :return: Message of a signed datagram. None if the HMAC doesn't match or it was sent too far from now.
+        """
+        mac, payload = data[:MAC_SIZE], data[MAC_SIZE:]
+        if not hmac.compare_digest(mac, hmac.new(self.secret, payload, hashlib.sha256).digest()):
+            return None
+        message = json.loads(payload)
+        if abs(time.time() - float(message['time'])) > MAX_CLOCK_SKEW:
+            return None
+        return message
+
+    def choose_peers(self, exclude: tuple = None):
+        with self.lock:
+            candidates = [address for address in self.peers if address != exclude]
+        return random.sample(candidates, min(self.fanout, len(candidates)))
+
+    def push(self, states: list, exclude: tuple = None):
+        for address in self.choose_peers(exclude=exclude):
+            for i in range(0, len(states), MAX_UPDATES):
+                self.send(address, {'type': 'PUSH', 'updates': states[i:i + MAX_UPDATES]})
+
+    def gossip_round(self):
+        """
+        Send hashes of sorted user ranges [low, high) of up to 'MAX_DIGEST_ENTRIES' users to 'fanout' peers.
+        The ranges cover every name, so users missing on either side are found too.
+        """
+        peers = self.choose_peers()
+        if not peers:
+            return
+        with self.lock:
+            bounds = self.users[MAX_DIGEST_ENTRIES::MAX_DIGEST_ENTRIES]
+            ranges = [[low, high, self.range_hash(low, high)]
+                      for low, high in zip([None] + bounds, bounds + [None])]
+        for address in peers:
+            self.send(address, {'type': 'SYN', 'ranges': ranges})
+
+    def handle(self, message: dict, address: tuple):
+        self.add_peer(address, message.get('sender'))
+        for host, port, node_id in message.get('peers', []):
+            self.add_peer((host, port), node_id)
+        kind = message.get('type')
+        if kind == 'SYN':
+            with self.lock:
+                stale = [[low, high] for low, high, range_hash in message['ranges']
+                         if self.range_hash(low, high) != range_hash]
+            for low, high in stale:  # Split again here, the range can hold many more users on this side.
+                with self.lock:
+                    bounds = self.range_users(low, high)[MAX_DIGEST_ENTRIES::MAX_DIGEST_ENTRIES]
+                for sub_low, sub_high in zip([low] + bounds, bounds + [high]):
+                    self.send(address, {'type': 'DIGEST', 'low': sub_low, 'high': sub_high,
+                                        'digest': self.digest(sub_low, sub_high)})
+        elif kind == 'DIGEST':
+            digest, low, high = message['digest'], message['low'], message['high']
+            with self.lock:
+                updates = [dict(self.states[user]) for user in self.range_users(low, high)
+                           if newer(self.states[user], digest.get(user))]
+                request = [user for user, version in digest.items()
+                           if user not in self.states or newer({'version': version[0], 'origin': version[1]},
+                                                               [self.states[user]['version'],
+                                                                self.states[user]['origin']])]
+            for i in range(0, max(len(updates), 1), MAX_UPDATES):
+                self.send(address, {'type': 'ACK', 'updates': updates[i:i + MAX_UPDATES],
+                                    'request': request if i == 0 else []})
+        elif kind == 'ACK':
+            self.apply(message['updates'])
+            with self.lock:
+                updates = [dict(self.states[user]) for user in message['request'] if user in self.states]
+            for i in range(0, len(updates), MAX_UPDATES):
+                self.send(address, {'type': 'ACK2', 'updates': updates[i:i + MAX_UPDATES]})
+        elif kind == 'ACK2':
+            self.apply(message['updates'])
+        elif kind == 'PUSH':
+            applied = self.apply(message['updates'])
+            if applied:
+                self.push(applied, exclude=address)
+
+    def run(self):
+        next_round = time.monotonic() + random.uniform(0, self.interval)
+        while not self.stop_event.is_set():
+            self.sock.settimeout(max(0.001, next_round - time.monotonic()))
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                data = None
+            except OSError:
+                if self.stop_event.is_set():
+                    return
+                continue
+            if data:  # Empty for the wake up of 'stop'.
+                with self.lock:
+                    self.stats['received'] += 1
+                    self.stats['bytes_received'] += len(data)
+                try:
+                    message = self.open(data)
+                    if message is None:
+                        with self.lock:
+                            self.stats['rejected'] += 1
+                    else:
+                        self.handle(message, address)
+                except (ValueError, KeyError, TypeError):
+                    pass  # Malformed datagram, ignore.
+            if time.monotonic() >= next_round:
+                self.gossip_round()
+                next_round = time.monotonic() + self.interval
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, users=len(self.states), peers=len(self.peers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gossip seed node of rotation state.')
+    parser.add_argument('--host', default='127.0.0.1', help="Address to bind. e.g. '0.0.0.0' for other hosts.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL)
+    args = parser.parse_args()
+    node = GossipNode(secret=os.environ.get(SECRET_ENV), host=args.host, port=args.port, node_id=f'seed:{args.port}',
+                      interval=args.interval).start()
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps({'event': 'gossip.seed', **node.metrics()}), flush=True)
+    except KeyboardInterrupt:
+        node.stop()
+
+
+if __name__ == '__main__':
+    main()
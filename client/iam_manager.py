@@ -1,24 +1,65 @@
 from datetime import datetime, timezone
+import argparse
+import json
 import os
-import subprocess
+import signal
+import tempfile
+import threading
+import time
 import boto3
 import botocore.client
-import re
+from agent import Agent, StatusServer
+from aws_config import set_credentials
+from credential_store import CredentialStore
+from deadline_index import DeadlineIndex
+from gossip import GossipNode, ROTATION_TIMEOUT, SECRET_ENV as GOSSIP_SECRET_ENV
+from log_shipper import LogShipper
+from shared import ClientPool, Fleet, IdentityCache, MAX_CREDENTIAL_AGE_DAYS, USER_ARN_PREFIX, default_limiter, \
+    parse_user_name, tracer, wait_for_credential
 
 profile_name_val = 'iam-manager'
 session = boto3.Session(profile_name=profile_name_val)
-sts_client = session.client('sts')
-iam_client = session.client('iam')
-date_format = '%Y-%m-%d %H:%M:%S:%f %Z'
+sts_client = tracer.instrument(session.client('sts'))
+iam_client = tracer.instrument(session.client('iam'))
 credential_saved_path = './credentials'
+credential_store_path = f'{credential_saved_path}/store.jsonl'
+credential_export_files = False  # True for also write per key files 'credentials-{user}-{key}'
+credential_store = None
+singleton_lock = threading.Lock()  # Fleet worker threads ask for the store and the identity cache at once.
+fleet_max_workers = 8
+credential_max_age_days = MAX_CREDENTIAL_AGE_DAYS
+deadline_index_path = f'{credential_saved_path}/deadlines.json'
+schedule_retry_seconds = 3600
+schedule_max_sleep_seconds = 86400
+identity_cache_path = f'{credential_saved_path}/identities.json'  # Caller identity per access key id and secret
+identity_cache = None
+agent_interval_seconds = 3600
+agent_jitter = 0.1  # Fraction of the interval added or removed at random
+agent_status_host = '127.0.0.1'
+agent_status_port = 8765
+log_server_url = None  # Trace events and 'report_log_to_server' lines are shipped here when set.
+log_server_secret = os.environ.get('IAM_MANAGER_LOG_SECRET')  # Signs batches. LOG_INGEST_SECRET of the server
+log_spill_dir = f'{credential_saved_path}/log-spill'
+log_shipper = None
+gossip_bind_host = '127.0.0.1'  # '--gossip-bind' to reach a seed on another host.
+gossip_bind_port = 0  # 0 for any free port. Peers learn it from the messages.
+gossip_secret = os.environ.get(GOSSIP_SECRET_ENV)  # Shared by every node, signs each datagram.
+gossip_recheck_seconds = 86400  # A deadline known only from gossip is at most this far, then IAM is read.
+gossip_node = None  # Rotation state shared with other hosts and the server seed node, when started.
+credential_propagation_timeout = 60  # Seconds to wait for a new key of own credential to work
+client_pool = None  # Clients signed with a new key while waiting for it to work
+metrics_path = None  # Latency histograms and call counters are written here after each run.
+metrics_format = 'prometheus'
 
 
-def publish_new_credential(client: botocore.client, user_name: str):
+def publish_new_credential(client: botocore.client, user_name: str, change_profile: bool = True):
     """
     Publish a new Credential for IAM User. After creation, Remove older credential.
 
     :param client: AWS iam client.
     :param user_name: IAM User name
+    :param change_profile: True for apply the new credential to local aws cli profile and swap the session of
+                           this process to it. (Rotating own credential)
     :return:
     {
         'AccessKey': {
@@ -30,13 +71,36 @@ def publish_new_credential(client: botocore.client, user_name: str):
         }
     }
     """
-    access_key = client.create_access_key(UserName=user_name)
-    write_credential_file(user_name=user_name, access_key_id=access_key['AccessKey']['AccessKeyId'], secret_access_key=access_key['AccessKey']['SecretAccessKey'])
-    print(f"[{datetime.now().strftime(date_format)}] PUBLISH a new credential for User : {user_name}, AccessKeyId : {access_key['AccessKey']['AccessKeyId']}")
+    with tracer.span('client.publish_new_credential', user=user_name):
+        previous = gossip_node.get(user_name) if gossip_node is not None else None
+        announce(user_name, previous['access_key_id'] if previous else '',
+                 previous['created_at'] if previous else 0, rotating=True)
+        try:
+            access_key = client.create_access_key(UserName=user_name)
+        except Exception:
+            if previous is not None:
+                announce(user_name, previous['access_key_id'], previous['created_at'])
+            raise
+        announce(user_name, access_key['AccessKey']['AccessKeyId'], access_key['AccessKey']['CreateDate'].timestamp())
+        write_credential_file(user_name=user_name, access_key_id=access_key['AccessKey']['AccessKeyId'], secret_access_key=access_key['AccessKey']['SecretAccessKey'])
+        tracer.event('client.publish', user=user_name, access_key_id=access_key['AccessKey']['AccessKeyId'])
 
-    mark_inactive_older_credential(client=client, user_name=user_name)
-    change_aws_configure(access_key_id=access_key['AccessKey']['AccessKeyId'], secret_access_key=access_key['AccessKey']['SecretAccessKey'], profile_name=profile_name_val)
-    remove_inactive_credential(client=client, user_name=user_name)
+        if change_profile:  # Old key of this process is deactivated next, so the new one must work first.
+            try:
+                with tracer.span('client.wait_for_credential', access_key_id=access_key['AccessKey']['AccessKeyId']):
+                    wait_for_credential(access_key['AccessKey'], pool=get_client_pool(), limiter=default_limiter,
+                                        timeout=credential_propagation_timeout)
+            except Exception:  # The old key stays, so the new one is deleted. Two keys would block the next run.
+                delete_credential(client=client, user_name=user_name,
+                                  access_key_id=access_key['AccessKey']['AccessKeyId'])
+                if previous is not None:
+                    announce(user_name, previous['access_key_id'], previous['created_at'])
+                raise
+        mark_inactive_older_credential(client=client, user_name=user_name)
+        if change_profile:
+            change_aws_configure(access_key_id=access_key['AccessKey']['AccessKeyId'], secret_access_key=access_key['AccessKey']['SecretAccessKey'], profile_name=profile_name_val)
+            client = swap_session(access_key_id=access_key['AccessKey']['AccessKeyId'], secret_access_key=access_key['AccessKey']['SecretAccessKey'])
+        remove_inactive_credential(client=client, user_name=user_name)
     return access_key
 
 
@@ -49,18 +113,23 @@ def delete_credential(client: botocore.client, user_name: str, access_key_id: st
     :param access_key_id: Access key id related to iam user.
     :return: None
     """
-    print(f"[{datetime.now().strftime(date_format)}] DELETE Credential : {user_name}, AccessKeyId : {access_key_id}")
+    tracer.event('client.delete', user=user_name, access_key_id=access_key_id)
     client.delete_access_key(
         UserName=user_name,
         AccessKeyId=access_key_id
     )
+    get_credential_store().remove(access_key_id=access_key_id)
+    get_identity_cache().invalidate(access_key_id=access_key_id)
 
 
-def get_aws_account_info(client: botocore.client):
+def get_aws_account_info(client: botocore.client, access_key_id: str = None, secret_access_key: str = None):
     """
-    Get AWS Account information
+    Get AWS Account information. With 'access_key_id', the answer is cached on disk per access key id and secret,
+    so later runs with the same credential don't call STS.
 
     :param client: AWS sts client.
+    :param access_key_id: Access key id of the client. None for always calling STS.
+    :param secret_access_key: Secret access key of the client.
     :return:
     {
         'Account': {AWS_ACCOUNT_ID},
@@ -68,16 +137,44 @@ def get_aws_account_info(client: botocore.client):
         'UserName': '{IAM_USER_NAME}'
     }
     """
+    if access_key_id is not None:
+        result = get_identity_cache().get(access_key_id, secret_access_key)
+        if result is not None:
+            return result
     result = {}
     aws_account_info = client.get_caller_identity()
     result['UserArn'] = aws_account_info['Arn']
-    user_name = re.sub(r'arn:aws:iam::+[0-9]*:user', '', result['UserArn'])  # Delete 'arn:aws:iam::{ACCOUNT_ID}:user'
-    user_name = user_name.split('/')[-1]  # Remove path, get user name only
-    result['UserName'] = user_name
+    result['UserName'] = parse_user_name(result['UserArn'])
     result['Account'] = aws_account_info['Account']
+    if access_key_id is not None:
+        get_identity_cache().put(access_key_id, result, secret_access_key)
     return result
 
 
+def current_access_key_id():
+    credentials = session.get_credentials()
+    return credentials.access_key if credentials else None
+
+
+def current_account_info():
+    """
+    :return: 'get_aws_account_info' of the profile owner, cached per its access key id and secret.
+    """
+    credentials = session.get_credentials()
+    if credentials is None:
+        return get_aws_account_info(client=sts_client)
+    return get_aws_account_info(client=sts_client, access_key_id=credentials.access_key,
+                                secret_access_key=credentials.secret_key)
+
+
+def profile_owner():
+    """
+    :return: IAM User name of the profile owner. None if the profile is not an IAM User. (e.g. assumed role)
+    """
+    account_info = current_account_info()
+    return account_info['UserName'] if USER_ARN_PREFIX.match(account_info['UserArn']) else None
+
+
 def need_to_publish_new_credential(client: botocore.client, user_name: str):
     credentials = client.list_access_keys(UserName=user_name)['AccessKeyMetadata']
     amt_credentials = len(credentials)
@@ -90,12 +187,12 @@ def need_to_publish_new_credential(client: botocore.client, user_name: str):
         raise Exception("Error, IAM user doesn't have any credential. "
                         "It might IAM User name was wrong or All credentials are Inactive.")
     elif amt_credentials == 1:
-        duration = credentials[0]['CreateDate']-datetime.now(timezone.utc)
-        if duration.days >= 75:  # 생성한지 75일 지난 경우 credential 재발행.
-            print(f'[{datetime.now().strftime(date_format)}] REPORT iam user \'{user_name}\' need to publish a new credential.')
+        duration = datetime.now(timezone.utc)-credentials[0]['CreateDate']
+        if duration.days >= credential_max_age_days:  # 생성한지 75일 지난 경우 credential 재발행.
+            tracer.event('client.need_to_publish', user=user_name, need=True)
             return True
         else:
-            print(f'[{datetime.now().strftime(date_format)}] REPORT iam user \'{user_name}\' don\'t need to publish a new credential.')
+            tracer.event('client.need_to_publish', user=user_name, need=False)
             return False
     elif amt_credentials == 2:
         mark_inactive_older_credential(client=client, user_name=user_name)
@@ -112,7 +209,7 @@ def remove_inactive_credential(client: botocore.client, user_name: str):
     :param user_name: IAM User name.
     :return: None
     """
-    print(f'[{datetime.now().strftime(date_format)}] REMOVE Inactive credentials for \'{user_name}\'')
+    tracer.event('client.remove_inactive', user=user_name)
     credentials = client.list_access_keys(UserName=user_name)['AccessKeyMetadata']
     for credential in credentials:
         if credential['Status'] == 'Inactive':
@@ -128,42 +225,436 @@ def mark_inactive_older_credential(client: botocore.client, user_name: str):
         inactive_target_access_key = credentials[1]['AccessKeyId']
     else:
         inactive_target_access_key = credentials[0]['AccessKeyId']
-    print(f"[{datetime.now().strftime(date_format)}] MARK credential Inactive. User : {user_name}, "
-          f"AccessKeyId : {inactive_target_access_key}")
+    tracer.event('client.mark_inactive', user=user_name, access_key_id=inactive_target_access_key)
     client.update_access_key(
         UserName=user_name,
         AccessKeyId=inactive_target_access_key,
         Status='Inactive'
     )
+    get_identity_cache().invalidate(access_key_id=inactive_target_access_key)
+
+
+def list_user_names(client: botocore.client, path_prefix: str = '/'):
+    """
+    List IAM User names. Follow 'list_users' pagination until every page is read.
+
+    :param client: AWS IAM client.
+    :param path_prefix: IAM path prefix to filter users. '/' for all users.
+    :return: generator of IAM User names.
+    """
+    paginator = client.get_paginator('list_users')
+    for page in paginator.paginate(PathPrefix=path_prefix):
+        for user in page['Users']:
+            yield user['UserName']
+
+
+def check_and_rotate(client: botocore.client, user_name: str, force: bool = False, change_profile: bool = False):
+    if force or need_to_publish_new_credential(client=client, user_name=user_name):
+        return publish_new_credential(client=client, user_name=user_name, change_profile=change_profile)
+    return None
+
+
+class FleetService:
+    """
+    Functions of this module in the shape 'Fleet' calls them on 'Service'.
+    """
+
+    def __init__(self, client: botocore.client):
+        self.client = client
+
+    @property
+    def max_age_days(self):
+        return credential_max_age_days
+
+    def caller_user_name(self):
+        return profile_owner()
+
+    def list_user_names(self, path_prefix: str = '/'):
+        return list_user_names(client=self.client, path_prefix=path_prefix)
+
+    def rotate_credential(self, user_name: str, force: bool = False, switch_session: bool = False):
+        access_key = check_and_rotate(client=self.client, user_name=user_name, force=force,
+                                      change_profile=switch_session)
+        return access_key if access_key is not None else {'AccessKey': None}
+
+
+def rotate_fleet(client: botocore.client, path_prefix: str = '/', max_workers: int = fleet_max_workers, force: bool = False):
+    """
+    Check and publish a new credential for every IAM User in parallel with groot's 'Fleet'. A failure of one user
+    never aborts the run. The profile owner is rotated last with 'change_profile', since its old key signs every
+    call of the run.
+
+    :param client: AWS IAM client.
+    :param path_prefix: IAM path prefix to filter users. '/' for all users.
+    :param max_workers: Maximum number of users processed concurrently.
+    :param force: True for publish regardless of the credential age.
+    :return:
+    {
+        'Rotated': {'{IAM_USER_NAME}': '{ACCESS_KEY_ID}'},
+        'Skipped': ['{IAM_USER_NAME}'],
+        'Failed': {'{IAM_USER_NAME}': 'error message'}
+    }
+    """
+    result = Fleet(FleetService(client), max_workers=max_workers).run(path_prefix=path_prefix, force=force)
+    result['Rotated'] = {user_name: rotated['AccessKey']['AccessKeyId']
+                         for user_name, rotated in result['Rotated'].items()}
+    for user_name, error in result['Failed'].items():
+        tracer.event('fleet.failed', user=user_name, error=error)
+    return result
+
+
+def get_credential_store():
+    global credential_store
+    with singleton_lock:
+        if credential_store is None:
+            credential_store = CredentialStore(credential_store_path)
+        return credential_store
+
+
+def get_identity_cache():
+    global identity_cache
+    with singleton_lock:
+        if identity_cache is None:
+            identity_cache = IdentityCache(path=identity_cache_path)
+        return identity_cache
+
+
+def get_client_pool():
+    global client_pool
+    with singleton_lock:
+        if client_pool is None:
+            client_pool = ClientPool()
+            client_pool.session = boto3.Session(region_name=session.region_name)
+        return client_pool
+
+
+def swap_session(access_key_id: str, secret_access_key: str):
+    """
+    Switch session and clients of this process to the new credential of the profile owner, without reading
+    the profile again. The old credential is inactive by then, so clients of it can't be used any more.
+
+    :return: New IAM client.
+    """
+    global session, sts_client, iam_client
+    session = boto3.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+                            region_name=session.region_name)
+    sts_client = tracer.instrument(session.client('sts'))
+    iam_client = tracer.instrument(session.client('iam'))
+    tracer.event('client.swap_session', access_key_id=access_key_id)
+    return iam_client
+
+
+def refresh_deadline(client: botocore.client, index: DeadlineIndex, user_name: str):
+    """
+    Set the deadline of IAM User from its active credential. A user without exactly one active credential is
+    due now, so the next run reports it. State read from IAM is gossiped to the other hosts.
+
+    State known from gossip is only a hint of when to look again. It sets the deadline without calling IAM, but
+    never later than 'gossip_recheck_seconds' from now, and a due user is always checked with IAM.
+    """
+    state = gossip_node.get(user_name) if gossip_node is not None else None
+    if state is not None and state['access_key_id']:
+        recheck_at = time.time() + gossip_recheck_seconds
+        if not state['rotating']:
+            return index.schedule(user_name, state['access_key_id'],
+                                  min(state['created_at'] + index.max_age, recheck_at))
+        if time.time() - state['updated_at'] < ROTATION_TIMEOUT:  # Look again once the other host should be done.
+            return index.schedule(user_name, state['access_key_id'],
+                                  min(state['updated_at'] + ROTATION_TIMEOUT, recheck_at))
+    credentials = client.list_access_keys(UserName=user_name)['AccessKeyMetadata']
+    active = [credential for credential in credentials if credential['Status'] == 'Active']
+    if len(active) == 1:
+        announce(user_name, active[0]['AccessKeyId'], active[0]['CreateDate'].timestamp())
+        return index.update(user_name, active[0]['AccessKeyId'], active[0]['CreateDate'].timestamp())
+    return index.schedule(user_name, '', time.time())
+
+
+def sync_deadlines(client: botocore.client, index: DeadlineIndex, user_names: list):
+    """
+    Add deadlines of users not in the index yet, and drop users that are gone. Known users cost no API call.
+    """
+    for user_name in user_names:
+        if user_name not in index:
+            refresh_deadline(client=client, index=index, user_name=user_name)
+    for user_name in set(index.current) - set(user_names):
+        index.remove(user_name)
+
+
+def process_due(client: botocore.client, index: DeadlineIndex, owner: str = None):
+    """
+    Check and rotate only users whose deadline has come, then put their next deadlines back.
+
+    :param owner: IAM User name of the profile owner. It is processed last and rotated with 'change_profile'.
+    :return: list of processed IAM User names.
+    """
+    due = sorted(index.pop_due(), key=lambda item: item[0] == owner)
+    for user_name, access_key_id in due:
+        try:
+            access_key = check_and_rotate(client=client, user_name=user_name, change_profile=user_name == owner)
+            if access_key is None:
+                refresh_deadline(client=client, index=index, user_name=user_name)
+            else:
+                index.update(user_name, access_key['AccessKey']['AccessKeyId'],
+                             access_key['AccessKey']['CreateDate'].timestamp())
+        except Exception as e:
+            tracer.event('schedule.failed', user=user_name, error=str(e))
+            index.schedule(user_name, access_key_id, time.time() + schedule_retry_seconds)
+    index.save()
+    return [user_name for user_name, _ in due]
+
+
+def schedule_tick(index: DeadlineIndex, fleet: bool = False, path_prefix: str = '/'):
+    """
+    One pass of the schedule. Sync the users of the index and process only due users.
+    Clients are read from the module on every pass, since a rotation of own credential swaps them.
+
+    :return: {'processed': [IAM User names], 'users': 123, 'next_due': POSIX timestamp or None}
+    """
+    owner = profile_owner()
+    if fleet:
+        user_names = list(list_user_names(client=iam_client, path_prefix=path_prefix))
+    else:
+        user_names = [current_account_info()['UserName']]
+    sync_deadlines(client=iam_client, index=index, user_names=user_names)
+    processed = process_due(client=iam_client, index=index, owner=owner)
+    next_due = index.next_due()
+    tracer.event('schedule.processed', processed=len(processed), users=len(index),
+                 next_due=datetime.fromtimestamp(next_due, timezone.utc) if next_due else None)
+    write_metrics()
+    return {'processed': processed, 'users': len(index), 'next_due': next_due}
+
+
+def run_schedule(fleet: bool = False, path_prefix: str = '/', once: bool = False):
+    """
+    Keep a deadline index of the profile owner (or every IAM User for fleet), sleep until the earliest deadline,
+    and process only due users. With 'once', process what is due now and return. (For cron)
+    """
+    index = DeadlineIndex(deadline_index_path, max_age_days=credential_max_age_days)
+    while True:
+        next_due = schedule_tick(index=index, fleet=fleet, path_prefix=path_prefix)['next_due']
+        if once:
+            return
+        sleep_seconds = schedule_max_sleep_seconds if next_due is None else next_due - time.time()
+        time.sleep(min(max(sleep_seconds, 1), schedule_max_sleep_seconds))
+
+
+def run_agent(fleet: bool = False, path_prefix: str = '/', interval: float = None, jitter: float = None,
+              status_port: int = None):
+    """
+    Stay resident and run the schedule every 'interval' seconds (or at the next deadline if sooner) with jitter.
+    Session, clients and caches stay warm between checks, and rotation of own credential swaps the session in
+    process. State is served on a local status endpoint until SIGTERM or SIGINT.
+    """
+    index = DeadlineIndex(deadline_index_path, max_age_days=credential_max_age_days)
+    agent = Agent(
+        tick=lambda: schedule_tick(index=index, fleet=fleet, path_prefix=path_prefix),
+        interval=agent_interval_seconds if interval is None else interval,
+        jitter=agent_jitter if jitter is None else jitter,
+        retry_seconds=schedule_retry_seconds
+    )
+    status_server = None
+    if (agent_status_port if status_port is None else status_port) >= 0:
+        status_server = StatusServer(
+            agent,
+            host=agent_status_host,
+            port=agent_status_port if status_port is None else status_port,
+            extra_status=lambda: {'access_key_id': current_access_key_id(), 'fleet': fleet,
+                                  'log_shipper': log_shipper.metrics() if log_shipper else None,
+                                  'gossip': gossip_node.metrics() if gossip_node else None}
+        ).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: agent.stop())
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop()
+    finally:
+        if status_server is not None:
+            status_server.close()
 
 
 def write_credential_file(user_name: str, access_key_id: str, secret_access_key: str, profile_name=profile_name_val):
-    if not os.path.exists(credential_saved_path):
-        os.makedirs(credential_saved_path)
-    with open(f"{credential_saved_path}/credentials-{user_name}-{access_key_id}", 'w', encoding='utf-8') as f:
-        f.write(f"[{profile_name}]\n")
-        f.write(f"access_key_id = {access_key_id}\n")
-        f.write(f"secret_access_key = {secret_access_key}\n")
-    print(f"[{datetime.now().strftime(date_format)}] SAVED Credential at \'{credential_saved_path}/credentials-{user_name}-{access_key_id}\'")
+    """
+    Save credential to the local credential store. Per key file is exported too if 'credential_export_files'.
+    """
+    store = get_credential_store()
+    store.put(user_name=user_name, access_key_id=access_key_id, secret_access_key=secret_access_key,
+              profile_name=profile_name)
+    if credential_export_files:
+        for path in store.export(credential_saved_path, user_name=user_name):
+            tracer.event('client.export', user=user_name, path=path)
 
 
 def change_aws_configure(access_key_id: str, secret_access_key: str, profile_name=profile_name_val):
-    print(f"[{datetime.now().strftime(date_format)}] CHANGE AWS cli configure using \'{access_key_id}\' with profile name : \'{profile_name}\'")
-    subprocess.run(["aws", "configure", "set", "aws_access_key_id", access_key_id, f"--profile={profile_name}"])
-    subprocess.run(["aws", "configure", "set", "aws_secret_access_key", secret_access_key, f"--profile={profile_name}"])
+    """
+    Apply credential to aws cli profile. Written in process with one atomic rename instead of 'aws configure set',
+    so access key id and secret access key of the profile are always changed together.
+    """
+    tracer.event('client.change_aws_configure', access_key_id=access_key_id, profile_name=profile_name)
+    set_credentials({profile_name: (access_key_id, secret_access_key)})
+
+
+def write_metrics(path: str = None, output_format: str = None):
+    """
+    Write latency histograms and call counters of the run. Written to a temporary file and renamed,
+    so a scraper (e.g. node_exporter textfile collector) never reads a half written file.
+
+    :param path: Output file. 'metrics_path' for None, nothing is written if both are None.
+    :param output_format: 'prometheus' or 'jsonl'. 'metrics_format' for None.
+    """
+    path = path or metrics_path
+    if path is None:
+        return
+    output_format = output_format or metrics_format
+    content = tracer.metrics_jsonl() if output_format == 'jsonl' else tracer.prometheus()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.metrics-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 
+def get_log_shipper():
+    """
+    :return: LogShipper to 'log_server_url', also attached to the tracer so every trace event is shipped.
+             None if 'log_server_url' is not set.
+    :raise ValueError: 'log_server_url' is set without the secret in IAM_MANAGER_LOG_SECRET.
+    """
+    global log_shipper
+    with singleton_lock:
+        if log_shipper is None and log_server_url:
+            log_shipper = LogShipper(log_server_url, secret=log_server_secret, spill_dir=log_spill_dir)
+            tracer.add_exporter(log_shipper)
+        return log_shipper
+
+
+def close_log_shipper(timeout: float = 10):
+    global log_shipper
+    with singleton_lock:
+        shipper, log_shipper = log_shipper, None
+    if shipper is not None:
+        tracer.remove_exporter(shipper)
+        shipper.close(timeout=timeout)
 
-def report_log_to_server(msg: str):
-    pass
+
+def report_log_to_server(msg: str, **fields):
+    """
+    Queue a log line for the log server. Returns at once, the line is sent in a compressed batch later.
+
+    :return: False if no log server is set or the line was dropped under backpressure.
+    """
+    shipper = get_log_shipper()
+    if shipper is None:
+        return False
+    return shipper.write(json.dumps({
+        'time': datetime.now(timezone.utc).isoformat(),
+        'event': 'client.log',
+        'msg': msg,
+        **fields
+    }, default=str))
 
 
 def gossip_to_server(server_host: str, server_port: int):
-    pass
+    """
+    Start gossip of rotation state with the server seed node (client/gossip.py) and, through it, other hosts.
+    Hosts sharing IAM Users then learn key state and rotations of each other, and call ListAccessKeys less often.
+    Needs the shared secret in IAM_MANAGER_GOSSIP_SECRET.
+
+    :return: GossipNode of this process.
+    """
+    global gossip_node
+    if gossip_node is None:
+        gossip_node = GossipNode(secret=gossip_secret, host=gossip_bind_host, port=gossip_bind_port,
+                                 seeds=[(server_host, server_port)]).start()
+        tracer.event('gossip.started', address=f'{gossip_node.address[0]}:{gossip_node.address[1]}',
+                     seed=f'{server_host}:{server_port}')
+    return gossip_node
+
+
+def stop_gossip():
+    global gossip_node
+    if gossip_node is not None:
+        tracer.event('gossip.stopped', **gossip_node.metrics())
+        gossip_node.stop()
+        gossip_node = None
+
+
+def announce(user_name: str, access_key_id: str, created_at: float, rotating: bool = False):
+    """
+    Gossip key state of IAM User as seen by this host. Nothing happens without gossip.
+    """
+    if gossip_node is not None:
+        gossip_node.update(user_name, access_key_id, created_at, rotating=rotating)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='AWS IAM manager')
+    parser.add_argument('mode', nargs='?', default='self', choices=['self', 'fleet', 'schedule', 'agent'],
+                        help="'self' rotates the credential of profile owner. 'fleet' rotates every IAM User. "
+                             "'schedule' sleeps until the next deadline and rotates only due users. "
+                             "'agent' stays resident, checks on a jittered interval and serves a status endpoint.")
+    parser.add_argument('--path-prefix', default='/', help='IAM path prefix to filter users in fleet mode.')
+    parser.add_argument('--max-workers', type=int, default=fleet_max_workers,
+                        help='Maximum number of users processed concurrently in fleet mode.')
+    parser.add_argument('--force', action='store_true', help='Publish regardless of the credential age in fleet mode.')
+    parser.add_argument('--fleet', action='store_true', help='Schedule every IAM User in schedule and agent mode.')
+    parser.add_argument('--once', action='store_true', help='Process due users and exit in schedule mode. (For cron)')
+    parser.add_argument('--interval', type=float, default=agent_interval_seconds,
+                        help='Seconds between checks in agent mode.')
+    parser.add_argument('--jitter', type=float, default=agent_jitter,
+                        help='Fraction of the interval added or removed at random in agent mode.')
+    parser.add_argument('--status-port', type=int, default=agent_status_port,
+                        help='Port of the local status endpoint in agent mode. -1 for none.')
+    parser.add_argument('--export-files', action='store_true',
+                        help="Also write per key credential files 'credentials-{user}-{key}'.")
+    parser.add_argument('--no-trace', action='store_true', help='Disable structured trace output and metrics.')
+    parser.add_argument('--gossip', metavar='HOST:PORT',
+                        help='Seed node to gossip rotation state with, so hosts sharing users call IAM less often.')
+    parser.add_argument('--gossip-bind', metavar='HOST[:PORT]',
+                        help="Address of this host's gossip node. Loopback by default, so set it to gossip with "
+                             "other hosts.")
+    parser.add_argument('--log-server', help='URL that trace events are shipped to in compressed batches. '
+                                             'Needs the shared secret in IAM_MANAGER_LOG_SECRET.')
+    parser.add_argument('--metrics-file', help='Write latency histograms and call counters to the file after a run.')
+    parser.add_argument('--metrics-format', default='prometheus', choices=['prometheus', 'jsonl'],
+                        help='Format of --metrics-file.')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    credential_export_files = args.export_files
+    tracer.enabled = not args.no_trace
+    metrics_path = args.metrics_file
+    metrics_format = args.metrics_format
+    log_server_url = args.log_server
+    get_log_shipper()
+    if args.gossip_bind:
+        bind_host, _, bind_port = args.gossip_bind.partition(':')
+        gossip_bind_host, gossip_bind_port = bind_host, int(bind_port or 0)
+    if args.gossip:
+        gossip_host, _, gossip_port = args.gossip.rpartition(':')
+        gossip_to_server(gossip_host, int(gossip_port))
 
-    account_info = get_aws_account_info(client=sts_client)
+    try:
+        if args.mode == 'agent':
+            run_agent(fleet=args.fleet, path_prefix=args.path_prefix, interval=args.interval, jitter=args.jitter,
+                      status_port=args.status_port)
+        elif args.mode == 'schedule':
+            run_schedule(fleet=args.fleet, path_prefix=args.path_prefix, once=args.once)
+        elif args.mode == 'fleet':
+            rotate_fleet(client=iam_client, path_prefix=args.path_prefix, max_workers=args.max_workers, force=args.force)
+            write_metrics()
+        else:
+            account_info = current_account_info()
 
-    if need_to_publish_new_credential(iam_client, account_info['UserName']):
-        publish_new_credential(client=iam_client, user_name=account_info['UserName'])
+            check_and_rotate(client=iam_client, user_name=account_info['UserName'], change_profile=True)
+            write_metrics()
+    finally:
+        stop_gossip()
+        close_log_shipper()
@@ -0,0 +1,235 @@
+from collections import deque
+import gzip
+import hashlib
+import hmac
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_MAX_BUFFER = 10000
+DEFAULT_SPILL_MAX_BYTES = 64 * 2 ** 20
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MAX_BACKOFF = 300.0
+REPLAY_BATCHES = 8  # Spilled batches sent again per round, so new lines are not held back by a long backlog.
+RETRY_STATUSES = {408, 429}  # Client errors worth sending again. Any other 4xx is a batch the server never takes.
+SIGNATURE_HEADER = 'X-Groot-Signature'  # Checked by server/log_ingest.py
+TIMESTAMP_HEADER = 'X-Groot-Timestamp'
+
+
+def sign_batch(secret: str, timestamp: str, payload: bytes):
+    """
+    :return: Hex HMAC-SHA256 of '{timestamp}.{payload}'. Same as 'sign_batch' of server/log_ingest.py.
+    """
+    return hmac.new(secret.encode('utf-8'), timestamp.encode('utf-8') + b'.' + payload, hashlib.sha256).hexdigest()
+
+
+class LogShipper:
+    """
+    Ship JSON lines to the log server in gzip compressed batches, from a background thread.
+
+    'write' only appends to an in-memory buffer, so logging never waits for the server. A batch is sent when
+    'batch_size' lines are buffered or 'flush_interval' seconds have passed. When the buffer holds 'max_buffer'
+    lines, new lines are dropped and counted instead of blocking the caller. (Backpressure)
+
+    A batch the server can't take now is spilled to 'spill_dir' as it is (compressed), and the server is left alone
+    with exponential backoff. Batches keep going to disk while the server is down, and spilled batches are sent
+    again, oldest first, once it answers. The spill is bounded by 'spill_max_bytes', the oldest batches are
+    dropped beyond it. A batch the server refuses with a 4xx (e.g. 401 for a bad signature, 400 for a malformed
+    batch) would be refused again, so it is dropped and counted in 'rejected' instead of spilled.
+
+    Every post carries an HMAC-SHA256 signature of the time and the compressed batch, which the
+    server checks with the same shared secret. Spilled batches are signed again when they are sent.
+    """
+
+    def __init__(self, url: str, secret: str, spill_dir: str = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_buffer: int = DEFAULT_MAX_BUFFER,
+                 spill_max_bytes: int = DEFAULT_SPILL_MAX_BYTES, timeout: float = DEFAULT_TIMEOUT,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, headers: dict = None):
+        if not secret:  # server/log_ingest.py refuses every unsigned batch.
+            raise ValueError("Error, Log shipping needs the shared secret of the log server.")
+        self.url = url
+        self.secret = secret
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_max_bytes = spill_max_bytes
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.headers = headers or {}
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.spill_seq = 0
+        self.stats = {'written': 0, 'dropped': 0, 'shipped': 0, 'batches': 0, 'failures': 0,
+                      'spilled': 0, 'replayed': 0, 'spill_dropped': 0, 'rejected': 0}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name='log-shipper', daemon=True)
+        self.thread.start()
+
+    def write(self, line: str):
+        """
+        Buffer a JSON line. Never blocks.
+
+        :return: False if the line was dropped because the buffer is full.
+        """
+        with self.condition:
+            if self.closed or len(self.buffer) >= self.max_buffer:
+                self.stats['dropped'] += 1
+                return False
+            self.buffer.append(line.rstrip('\n'))
+            self.stats['written'] += 1
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+        return True
+
+    def run(self):
+        backlog = False
+        while True:
+            with self.condition:
+                if not self.closed and not backlog and len(self.buffer) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                lines = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+                closed = self.closed and not self.buffer
+            if lines:
+                self.ship(gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=6), len(lines))
+            backlog = not closed and self.replay()
+            if closed and not lines:
+                return
+
+    def ship(self, payload: bytes, count: int):
+        sent = False if time.monotonic() < self.retry_at else self.post(payload)
+        if sent is None:
+            self.reject(count)
+        elif not sent:
+            self.spill(payload, count)
+        else:
+            with self.condition:
+                self.stats['shipped'] += count
+                self.stats['batches'] += 1
+
+    def post(self, payload: bytes):
+        """
+        :return: True if the server took the batch, None if it refused the batch for good (4xx), False for send
+                 it again later.
+        """
+        timestamp = str(int(time.time()))
+        headers = {**self.headers, 'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip',
+                   TIMESTAMP_HEADER: timestamp, SIGNATURE_HEADER: sign_batch(self.secret, timestamp, payload)}
+        request = urllib.request.Request(self.url, data=payload, method='POST', headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                ok = 200 <= response.status < 300
+        except urllib.error.HTTPError as e:
+            ok = None if 400 <= e.code < 500 and e.code not in RETRY_STATUSES else False
+        except Exception:
+            ok = False
+        if ok is None or ok:  # The server answered.
+            self.backoff = 0.0
+            self.retry_at = 0.0
+        else:
+            self.backoff = min(self.max_backoff, max(1.0, self.backoff * 2))
+            self.retry_at = time.monotonic() + self.backoff
+            with self.condition:
+                self.stats['failures'] += 1
+        return ok
+
+    def reject(self, count: int):
+        with self.condition:
+            self.stats['rejected'] += count
+
+    def spill(self, payload: bytes, count: int):
+        if not self.spill_dir:
+            with self.condition:
+                self.stats['dropped'] += count
+            return
+        self.spill_seq += 1
+        path = os.path.join(self.spill_dir, f'{time.time_ns():020d}-{self.spill_seq:06d}-{count}.ndjson.gz')
+        with open(path, 'wb') as f:
+            f.write(payload)
+        with self.condition:
+            self.stats['spilled'] += count
+        self.trim_spill()
+
+    def spill_files(self):
+        if not self.spill_dir:
+            return []
+        return sorted(name for name in os.listdir(self.spill_dir) if name.endswith('.ndjson.gz'))
+
+    def trim_spill(self):
+        files = self.spill_files()
+        sizes = {name: os.path.getsize(os.path.join(self.spill_dir, name)) for name in files}
+        total = sum(sizes.values())
+        for name in files:
+            if total <= self.spill_max_bytes:
+                break
+            os.remove(os.path.join(self.spill_dir, name))
+            total -= sizes[name]
+            with self.condition:
+                self.stats['spill_dropped'] += int(name.rsplit('-', 1)[1].split('.')[0])
+
+    def replay(self):
+        """
+        Send up to 'REPLAY_BATCHES' spilled batches again, oldest first, if the server is not in backoff.
+
+        :return: True if all were sent and more are left, so the next round shouldn't wait.
+        """
+        files = self.spill_files()
+        for name in files[:REPLAY_BATCHES]:
+            if time.monotonic() < self.retry_at:
+                return False
+            path = os.path.join(self.spill_dir, name)
+            with open(path, 'rb') as f:
+                payload = f.read()
+            sent = self.post(payload)
+            if sent is False:
+                return False
+            os.remove(path)
+            count = int(name.rsplit('-', 1)[1].split('.')[0])
+            if sent is None:
+                self.reject(count)
+                continue
+            with self.condition:
+                self.stats['replayed'] += count
+                self.stats['shipped'] += count
+                self.stats['batches'] += 1
+        return len(files) > REPLAY_BATCHES
+
+    def flush(self, timeout: float = None):
+        """
+        Wake the shipper and wait until the buffer is empty. Spilled batches are not waited for.
+
+        :return: True if the buffer got empty in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.condition.notify()
+        while True:
+            with self.condition:
+                if not self.buffer:
+                    return True
+                self.condition.notify()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def close(self, timeout: float = None):
+        """
+        Ship (or spill) what is buffered and stop the shipper thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def metrics(self):
+        spill_files = len(self.spill_files())
+        with self.condition:
+            return dict(self.stats, buffered=len(self.buffer), spill_files=spill_files)
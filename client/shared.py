@@ -0,0 +1,18 @@
+"""
+Modules of groot that the client uses as they are, instead of keeping copies that drift apart.
+The groot directory is appended to sys.path, so modules of the client directory keep precedence.
+"""
+import os
+import sys
+
+GROOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'groot')
+if GROOT_DIR not in sys.path:
+    sys.path.append(GROOT_DIR)
+
+from tracing import Tracer, tracer  # noqa: E402
+from account import IdentityCache, USER_ARN_PREFIX, parse_user_name  # noqa: E402
+from fleet import Fleet  # noqa: E402
+from pipeline import wait_for_credential  # noqa: E402
+from planner import MAX_CREDENTIAL_AGE_DAYS  # noqa: E402
+from pool import ClientPool  # noqa: E402
+from throttle import default_limiter  # noqa: E402
@@ -1,2 +1,10 @@
 from groot.groot import Service
-from groot.secure import Secure
+from groot.account import IdentityCache
+from groot.coalesce import KeyCache, UserLocks
+from groot.secure import Secure, DataKeyCache
+from groot.pool import ClientPool, PooledSession
+from groot.aio import AsyncService, AsyncRunner
+from groot.organization import Organization, RoleCredentialCache
+from groot.pipeline import RotationPipeline
+from groot.throttle import RateLimiter
+from groot.report import KeyReport
@@ -1,18 +1,163 @@
-import boto3
-import botocore.client
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import hashlib
+import json
+import os
 import re
+import tempfile
+import threading
+import time
+from throttle import RateLimiter, default_limiter
+
+if TYPE_CHECKING:  # boto3 is imported on first client creation. (groot/pool.py)
+    import boto3
+    import botocore.client
+
+USER_ARN_PREFIX = re.compile(r'arn:aws:iam::+[0-9]*:user')
+DEFAULT_IDENTITY_TTL_SECONDS = 86400
+
+
+def parse_user_name(arn: str):
+    """
+    :return: IAM User name of the ARN. Path is removed. e.g. 'arn:aws:iam::123:user/path/name' -> 'name'
+    """
+    return USER_ARN_PREFIX.sub('', arn).split('/')[-1]
+
+
+def session_access_key_id(session):
+    """
+    :return: Access key id of PooledSession or boto3.Session. None for the default credential chain of PooledSession.
+    """
+    if hasattr(session, 'access_key_id'):
+        return session.access_key_id
+    credentials = session.get_credentials()
+    return credentials.access_key if credentials else None
+
+
+def session_secret_access_key(session):
+    """
+    :return: Secret access key of PooledSession or boto3.Session. None for the default credential chain of
+             PooledSession.
+    """
+    if hasattr(session, 'secret_access_key'):
+        return session.secret_access_key
+    credentials = session.get_credentials()
+    return credentials.secret_key if credentials else None
+
+
+def secret_digest(secret_access_key: str):
+    """
+    :return: SHA-256 hex digest of the secret access key. '' for None.
+    """
+    return hashlib.sha256(secret_access_key.encode()).hexdigest() if secret_access_key else ''
+
+
+class IdentityCache:
+    """
+    Cache of 'get_aws_account_info' per access key id. The caller identity of an access key never changes,
+    so an entry is kept for 'ttl' seconds and dropped early by 'invalidate' when the key is deactivated or deleted.
+    An entry is returned only for the same secret access key it was put with, like clients of ClientPool, so
+    a wrong or revoked secret still gets the authentication error of STS.
+
+    With 'path', entries are also kept in a JSON file, so a new process starts with the identities of earlier runs.
+    The file holds account ids, ARNs and digests of secrets, no secret.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_IDENTITY_TTL_SECONDS, path: str = None):
+        self.ttl = ttl
+        self.path = path
+        # access_key_id ('' for default credential chain) -> (expires_at POSIX, secret_digest, identity)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.load()
+
+    def get(self, access_key_id: str, secret_access_key: str = None):
+        """
+        :return: Copy of the cached identity. None if not cached, expired or put with another secret access key.
+        """
+        with self.lock:
+            entry = self.entries.get(access_key_id or '')
+            if entry is not None and entry[0] > time.time() and entry[1] == secret_digest(secret_access_key):
+                self.hits += 1
+                return dict(entry[2])
+            self.misses += 1
+            return None
+
+    def put(self, access_key_id: str, identity: dict, secret_access_key: str = None):
+        with self.lock:
+            self.entries[access_key_id or ''] = (time.time() + self.ttl, secret_digest(secret_access_key),
+                                                 dict(identity))
+        if self.path:
+            self.save()
+
+    def invalidate(self, access_key_id: str):
+        """
+        :return: True if the access key id was cached.
+        """
+        with self.lock:
+            removed = self.entries.pop(access_key_id or '', None) is not None
+        if removed and self.path:
+            self.save()
+        return removed
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.path:
+            self.save()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        now = time.time()
+        with self.lock:
+            # Entries of older files have no digest and are read again from STS.
+            self.entries = {key: tuple(entry) for key, entry in entries.items() if len(entry) == 3 and entry[0] > now}
+
+    def save(self):
+        """
+        Write live entries with a temporary file and an atomic rename.
+        """
+        now = time.time()
+        with self.lock:
+            entries = {key: entry for key, entry in self.entries.items() if entry[0] > now}
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.identities-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+default_identity_cache = IdentityCache()
 
 
 class Account:
     session: boto3.Session
     client: botocore.client
+    limiter: RateLimiter
+    cache: IdentityCache
 
-    def __init__(self, session: boto3.Session):
-        self.client = session.client('sts')
+    def __init__(self, session: boto3.Session, limiter: RateLimiter = None, cache: IdentityCache = None):
+        self.session = session
+        self.client = None
+        self.limiter = limiter or default_limiter
+        self.cache = cache or default_identity_cache
 
     def get_aws_account_info(self):
         """
-        Get AWS Account information
+        Get AWS Account information. STS is called only on a cache miss, so STS client is created lazily.
 
         :return:
         {
@@ -21,11 +166,18 @@ class Account:
             'UserName': '{IAM_USER_NAME}'
         }
         """
-        result = {}
-        aws_account_info = self.client.get_caller_identity()
-        result['UserArn'] = aws_account_info['Arn']
-        user_name = re.sub(r'arn:aws:iam::+[0-9]*:user', '', result['UserArn'])  # Delete 'arn:aws:iam::{ACCOUNT_ID}:user'
-        user_name = user_name.split('/')[-1]  # Remove path, get user name only
-        result['UserName'] = user_name
-        result['Account'] = aws_account_info['Account']
+        access_key_id = session_access_key_id(self.session)
+        secret_access_key = session_secret_access_key(self.session)
+        result = self.cache.get(access_key_id, secret_access_key)
+        if result is not None:
+            return result
+        if self.client is None:
+            self.client = self.session.client('sts')
+        aws_account_info = self.limiter.call('GetCallerIdentity', self.client.get_caller_identity)
+        result = {
+            'UserArn': aws_account_info['Arn'],
+            'UserName': parse_user_name(aws_account_info['Arn']),
+            'Account': aws_account_info['Account']
+        }
+        self.cache.put(access_key_id, result, secret_access_key)
         return result
@@ -0,0 +1,212 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import asyncio
+import functools
+from credential import Credential, Status
+from account import Account, IdentityCache
+from coalesce import KeyCache, UserLocks
+from fleet import Fleet
+from secure import Secure, DataKeyCache
+from pool import ClientPool
+from throttle import RateLimiter
+from tracing import tracer
+
+if TYPE_CHECKING:
+    from groot import Service
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+class AsyncRunner:
+    """
+    Run blocking AWS calls as coroutines. At most 'max_concurrency' calls are in flight,
+    the rest wait on the semaphore without holding a thread.
+    One runner can be shared by AsyncService, AsyncCredential, AsyncAccount and AsyncSecure to share the limit.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        if max_concurrency < 1:
+            raise ValueError("Error, max_concurrency must be 1 or more.")
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='groot')
+        self.semaphore = None
+        self.loop = None
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:  # asyncio.Semaphore is bound to the loop it is first used in.
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncCredential:
+    credential_handler: Credential
+
+    def __init__(self, session, runner: AsyncRunner = None):
+        self.credential_handler = Credential(session=session)
+        self.runner = runner or AsyncRunner()
+
+    async def create(self, user_name: str):
+        return await self.runner.run(self.credential_handler.create, user_name=user_name)
+
+    async def delete(self, user_name: str, access_key_id: str):
+        return await self.runner.run(self.credential_handler.delete, user_name=user_name, access_key_id=access_key_id)
+
+    async def change_status(self, user_name: str, access_key_id: str, status: Status):
+        return await self.runner.run(self.credential_handler.change_status, user_name=user_name,
+                                     access_key_id=access_key_id, status=status)
+
+    async def make_inactive(self, user_name: str, access_key_id: str):
+        return await self.change_status(user_name=user_name, access_key_id=access_key_id, status=Status.Inactive)
+
+    async def make_active(self, user_name: str, access_key_id: str):
+        return await self.change_status(user_name=user_name, access_key_id=access_key_id, status=Status.Active)
+
+    async def list(self, user_name: str, fresh: bool = False):
+        return await self.runner.run(self.credential_handler.list, user_name=user_name, fresh=fresh)
+
+
+class AsyncAccount:
+    account_handler: Account
+
+    def __init__(self, session, runner: AsyncRunner = None):
+        self.account_handler = Account(session=session)
+        self.runner = runner or AsyncRunner()
+
+    async def get_aws_account_info(self):
+        return await self.runner.run(self.account_handler.get_aws_account_info)
+
+
+class AsyncSecure:
+    secure_handler: Secure
+
+    def __init__(self, session, runner: AsyncRunner = None, cache: DataKeyCache = None):
+        self.secure_handler = Secure(session=session, cache=cache)
+        self.runner = runner or AsyncRunner()
+
+    async def encrypt(self, plain_txt: str, key_id: str):
+        return await self.runner.run(self.secure_handler.encrypt, plain_txt, key_id)
+
+    async def decrypt(self, cipher_txt: bytes, key_id: str):
+        return await self.runner.run(self.secure_handler.decrypt, cipher_txt, key_id)
+
+    async def encrypt_envelope(self, plain_txt: str, key_id: str):
+        return await self.runner.run(self.secure_handler.encrypt_envelope, plain_txt, key_id)
+
+    async def decrypt_envelope(self, cipher_txt: bytes, key_id: str):
+        return await self.runner.run(self.secure_handler.decrypt_envelope, cipher_txt, key_id)
+
+
+class AsyncService:
+    """
+    Coroutine counterpart of Service. Every operation runs the same Service method, so results are identical.
+    """
+    service: Service
+    runner: AsyncRunner
+
+    def __init__(self, access_key_id: str, secret_access_key: str, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 pool: ClientPool = None, runner: AsyncRunner = None, limiter: RateLimiter = None,
+                 identity_cache: IdentityCache = None, key_cache: KeyCache = None, user_locks: UserLocks = None,
+                 session_token: str = None, policy=None):
+        from groot import Service  # Imported on use, when both the groot package and groot.py are loaded.
+        self.service = Service(access_key_id=access_key_id, secret_access_key=secret_access_key, pool=pool,
+                               limiter=limiter, identity_cache=identity_cache, key_cache=key_cache,
+                               user_locks=user_locks, session_token=session_token, policy=policy)
+        self.runner = runner or AsyncRunner(max_concurrency=max_concurrency)
+
+    async def publish_new_credential(self, user_name: str, switch_session: bool = True):
+        return await self.runner.run(self.service.publish_new_credential, user_name=user_name,
+                                     switch_session=switch_session)
+
+    async def rotate_credential(self, user_name: str, force: bool = False, keep_inactive: bool = False,
+                                switch_session: bool = False):
+        return await self.runner.run(self.service.rotate_credential, user_name=user_name, force=force,
+                                     keep_inactive=keep_inactive, switch_session=switch_session)
+
+    async def delete_credential(self, user_name: str, access_key_id: str):
+        return await self.runner.run(self.service.delete_credential, user_name=user_name, access_key_id=access_key_id)
+
+    async def get_account_info(self):
+        return await self.runner.run(self.service.get_account_info)
+
+    async def list_user_names(self, path_prefix: str = '/'):
+        """
+        :return: list of IAM User names. All pages are read in a worker thread.
+        """
+        return await self.runner.run(lambda: list(self.service.list_user_names(path_prefix=path_prefix)))
+
+    async def need_to_publish_new_credential(self, user_name: str):
+        return await self.runner.run(self.service.need_to_publish_new_credential, user_name=user_name)
+
+    async def remove_inactive_credential(self, user_name: str):
+        return await self.runner.run(self.service.remove_inactive_credential, user_name=user_name)
+
+    async def mark_inactive_older_credential(self, user_name: str):
+        return await self.runner.run(self.service.mark_inactive_older_credential, user_name=user_name)
+
+    async def rotate_fleet(self, path_prefix: str = '/', force: bool = False):
+        """
+        Check and publish a new credential for every IAM User concurrently, up to 'max_concurrency' at once.
+        The IAM User of the session is rotated last, switching the session to its new key.
+
+        :return: Same as 'Service.rotate_fleet'.
+        """
+        result = {'Rotated': {}, 'Skipped': [], 'Failed': {}}
+        with tracer.span('fleet.rotate', path_prefix=path_prefix,
+                         max_concurrency=self.runner.max_concurrency) as span:
+            owner = await self.runner.run(self.service.caller_user_name)
+            user_names = await self.list_user_names(path_prefix=path_prefix)
+            ordered = [user_name for user_name in user_names if user_name != owner]
+            results = await asyncio.gather(
+                *(self.rotate_credential(user_name=user_name, force=force) for user_name in ordered),
+                return_exceptions=True
+            )
+            if owner in user_names:
+                ordered.append(owner)
+                results.extend(await asyncio.gather(
+                    self.rotate_credential(user_name=owner, force=force, switch_session=True),
+                    return_exceptions=True
+                ))
+            for user_name, rotated in zip(ordered, results):
+                if isinstance(rotated, Exception):
+                    Fleet.record_error(result, user_name, rotated)
+                elif rotated['AccessKey'] is None:
+                    result['Skipped'].append(user_name)
+                else:
+                    result['Rotated'][user_name] = rotated
+            span.set(rotated=len(result['Rotated']), skipped=len(result['Skipped']), failed=len(result['Failed']))
+        return result
+
+    async def rotate_pipeline(self, user_names: list = None, path_prefix: str = '/', force: bool = False,
+                              keep_inactive: bool = False, workers: dict = None):
+        """
+        :return: Same as 'Service.rotate_pipeline'. Stages run on their own threads, not the runner.
+        """
+        return await self.runner.run(self.service.rotate_pipeline, user_names=user_names, path_prefix=path_prefix,
+                                     force=force, keep_inactive=keep_inactive, workers=workers)
+
+    async def rotate_organization(self, account_ids: list, role_name: str, path_prefix: str = '/',
+                                  force: bool = False, external_id: str = None):
+        """
+        :return: Same as 'Service.rotate_organization'. Accounts fan out on their own threads, not the runner.
+        """
+        return await self.runner.run(self.service.rotate_organization, account_ids=account_ids, role_name=role_name,
+                                     path_prefix=path_prefix, force=force, external_id=external_id)
+
+    def get_rate_metrics(self):
+        return self.service.get_rate_metrics()
+
+    def get_cache_metrics(self):
+        return self.service.get_cache_metrics()
+
+    def get_trace_metrics(self, output_format: str = 'dict'):
+        return self.service.get_trace_metrics(output_format=output_format)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.runner.close)
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import copy
+import threading
+import time
+from tracing import tracer
+
+DEFAULT_KEY_CACHE_TTL_SECONDS = 5.0
+DEFAULT_KEY_CACHE_MAX_USERS = 4096
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls of the same key. The first caller runs the function, callers arriving while it is
+    in flight wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self.flights = {}  # key -> Flight
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+
+class KeyCache:
+    """
+    Short-lived cache of 'ListAccessKeys' per (access key id of the caller, IAM User), shared by every Service of
+    the process. Entries are kept per caller, so a response is never served to a credential that didn't read it.
+
+    A miss is loaded once however many threads ask at the same time (single flight). Every create, update or delete
+    of a user's access key invalidates the user for all callers, and a load that was in flight across the
+    invalidation is not cached. Mutations read with 'fresh', the cache only spares repeated checks.
+
+    Invalidations are stamped from one counter and only the last stamp of at most 'max_users' users is kept. A
+    pruned stamp raises 'floor', the stamp of every user not kept, so pruning never lets a stale load be cached.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_KEY_CACHE_TTL_SECONDS, max_users: int = DEFAULT_KEY_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.entries = {}  # user_name -> {access_key_id of caller ('' for default chain): (expires_at, response)}
+        self.counter = 0  # Stamp of the last invalidation.
+        self.stamps = OrderedDict()  # user_name -> stamp of its last invalidation, oldest first
+        self.floor = 0  # Highest stamp pruned from 'stamps'.
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, scope: str, user_name: str, loader, fresh: bool = False):
+        """
+        :param scope: Access key id of the caller. None for default credential chain.
+        :param user_name: IAM User name
+        :param loader: Function calling 'ListAccessKeys' of the user.
+        :param fresh: True for skip the cache and the in-flight call. The response is still cached.
+        :return: Copy of the response of 'loader'.
+        """
+        scope = scope or ''
+        with self.lock:
+            started = self.counter
+            stamp = self.stamps.get(user_name, self.floor)
+            if not fresh:
+                entry = self.entries.get(user_name, {}).get(scope)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+            self.misses += 1
+        if fresh:
+            response = self.load(scope, user_name, started, loader)
+        else:
+            response = self.flight.do((scope, user_name, stamp),
+                                      lambda: self.load(scope, user_name, started, loader))
+        return copy.deepcopy(response)
+
+    def load(self, scope: str, user_name: str, started: int, loader):
+        """
+        :param started: 'counter' when the load started. The response is cached only if the user wasn't
+                        invalidated since.
+        """
+        response = loader()
+        with self.lock:
+            if self.stamps.get(user_name, self.floor) <= started:
+                self.entries.setdefault(user_name, {})[scope] = (time.monotonic() + self.ttl, response)
+                while len(self.entries) > self.max_users:
+                    evicted = next(iter(self.entries))
+                    del self.entries[evicted]
+                    self.prune(evicted)
+        return response
+
+    def prune(self, user_name: str):
+        """
+        Forget the stamp of the user. Called with the lock held.
+        """
+        stamp = self.stamps.pop(user_name, None)
+        if stamp is not None:
+            self.floor = max(self.floor, stamp)
+
+    def invalidate(self, user_name: str):
+        with self.lock:
+            self.counter += 1
+            self.stamps[user_name] = self.counter
+            self.stamps.move_to_end(user_name)
+            self.entries.pop(user_name, None)
+            self.invalidations += 1
+            while len(self.stamps) > self.max_users:
+                self.prune(next(iter(self.stamps)))
+
+    def clear(self):
+        with self.lock:
+            self.counter += 1
+            self.floor = self.counter
+            self.stamps.clear()
+            self.entries.clear()
+
+    def metrics(self):
+        """
+        :return: {'Hits': 123, 'Misses': 123, 'Coalesced': 123, 'Invalidations': 123, 'Users': 123}
+        """
+        with self.lock:
+            return {'Hits': self.hits, 'Misses': self.misses, 'Coalesced': self.flight.coalesced,
+                    'Invalidations': self.invalidations, 'Users': len(self.entries)}
+
+
+class UserLocks:
+    """
+    Lock per IAM User, so mutations of one user's access keys run one at a time in the process. Two concurrent
+    rotations would otherwise both see one key and both create one. Locks are re-entrant and removed when free.
+    """
+
+    def __init__(self):
+        self.locks = {}  # user_name -> [threading.RLock, holders and waiters]
+        self.lock = threading.Lock()
+        self.contended = 0
+
+    @contextmanager
+    def hold(self, user_name: str):
+        with self.lock:
+            entry = self.locks.setdefault(user_name, [threading.RLock(), 0])
+            entry[1] += 1
+        if not entry[0].acquire(blocking=False):
+            with self.lock:
+                self.contended += 1
+            tracer.event('locks.contended', user=user_name)
+            entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[user_name]
+
+
+default_key_cache = KeyCache()
+default_user_locks = UserLocks()
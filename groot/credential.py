@@ -1,9 +1,14 @@
-from datetime import datetime
-
-import boto3
-import botocore.client
+from __future__ import annotations
 from enum import Enum
-import date_format
+from typing import TYPE_CHECKING
+from account import session_access_key_id
+from coalesce import KeyCache, default_key_cache
+from throttle import RateLimiter, default_limiter, is_throttling
+from tracing import tracer
+
+if TYPE_CHECKING:  # boto3 is imported on first client creation. (groot/pool.py)
+    import boto3
+    import botocore.client
 
 
 class Status(Enum):
@@ -14,10 +19,14 @@ class Status(Enum):
 class Credential:
     session: boto3.Session
     client: botocore.client
-    df = date_format.basic
+    limiter: RateLimiter
+    cache: KeyCache
 
-    def __init__(self, session: boto3.Session):
+    def __init__(self, session: boto3.Session, limiter: RateLimiter = None, cache: KeyCache = None):
         self.client = session.client('iam')
+        self.limiter = limiter or default_limiter
+        self.cache = cache or default_key_cache
+        self.scope = session_access_key_id(session)
 
     def create(self, user_name: str):
         """
@@ -35,9 +44,11 @@ class Credential:
             }
         }
         """
-        print(f"[{datetime.now().strftime(self.df)}] CREATE a new credential started. User : {user_name}")
-        access_key = self.client.create_access_key(UserName=user_name)
-        print(f"[{datetime.now().strftime(self.df)}] CREATE a new credential done. User : {user_name}, AccessKeyId : {access_key['AccessKey']['AccessKeyId']}")
+        try:
+            access_key = self.limiter.call('CreateAccessKey', self.client.create_access_key, UserName=user_name)
+        finally:  # A failed call may still have changed the keys.
+            self.cache.invalidate(user_name=user_name)
+        tracer.event('credential.create', user=user_name, access_key_id=access_key['AccessKey']['AccessKeyId'])
         return access_key
 
     def delete(self, user_name: str, access_key_id: str):
@@ -48,12 +59,16 @@ class Credential:
         :param access_key_id: Access key id related to iam user.
         :return: None
         """
-        print(f"[{datetime.now().strftime(self.df)}] DELETE Credential started. User : {user_name}, AccessKeyId : {access_key_id}")
-        self.client.delete_access_key(
-            UserName=user_name,
-            AccessKeyId=access_key_id
-        )
-        print(f"[{datetime.now().strftime(self.df)}] DELETE Credential done. AccessKeyId : {access_key_id} deleted.")
+        try:
+            self.limiter.call(
+                'DeleteAccessKey',
+                self.client.delete_access_key,
+                UserName=user_name,
+                AccessKeyId=access_key_id
+            )
+        finally:
+            self.cache.invalidate(user_name=user_name)
+        tracer.event('credential.delete', user=user_name, access_key_id=access_key_id)
 
     def change_status(self, user_name: str, access_key_id: str, status: Status):
         """
@@ -64,20 +79,23 @@ class Credential:
         :param status: Status.Active or Status.Inactive
         :return: bool. True for success False for failed
         """
-        print(f"[{datetime.now().strftime(self.df)}] CHANGE credential status as {status} started. User : {user_name},"
-              f" AccessKeyId : {access_key_id}")
         try:
-            self.client.update_access_key(
+            self.limiter.call(
+                'UpdateAccessKey',
+                self.client.update_access_key,
                 UserName=user_name,
                 AccessKeyId=access_key_id,
-                Status=status
+                Status=status.value
             )
         except Exception as e:
-            print(f"[{datetime.now().strftime(self.df)}] Exception occur during change the credential status: {e}")
+            if is_throttling(e):  # Still throttled after retries of the limiter. Let the caller back off.
+                raise
+            tracer.event('credential.change_status', user=user_name, access_key_id=access_key_id,
+                         status=status.value, error=str(e))
             return False
         finally:
-            print(
-                f"[{datetime.now().strftime(self.df)}] CHANGE credential status as {status} done.")
+            self.cache.invalidate(user_name=user_name)
+        tracer.event('credential.change_status', user=user_name, access_key_id=access_key_id, status=status.value)
         return True
 
     def make_inactive(self, user_name: str, access_key_id: str):
@@ -100,10 +118,12 @@ class Credential:
         """
         return self.change_status(user_name=user_name, access_key_id=access_key_id, status=Status.Active)
 
-    def list(self, user_name: str):
+    def list(self, user_name: str, fresh: bool = False):
         """
-        List credentials related to IAM User.
+        List credentials related to IAM User. Answered from the short-lived key cache, and concurrent calls for
+        the same user share one 'ListAccessKeys'. (coalesce.KeyCache)
         :param user_name: IAM User name
+        :param fresh: True for always call 'ListAccessKeys'. Use it to decide a mutation.
         :return:
         {
             'AccessKeyMetadata': [
@@ -118,5 +138,9 @@ class Credential:
             'Marker': 'string'
         }
         """
-        print(f"[{datetime.now().strftime(self.df)}] LIST credentials for User : {user_name}")
-        return self.client.list_access_key(UserName=user_name)
+        return self.cache.get(
+            self.scope,
+            user_name,
+            lambda: self.limiter.call('ListAccessKeys', self.client.list_access_keys, UserName=user_name),
+            fresh=fresh
+        )
@@ -1 +0,0 @@
-basic = '%Y-%m-%d %H:%M:%S:%f %Z'
@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from planner import ApplyError
+from tracing import tracer
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class Fleet:
+    """
+    Run check-and-rotate over every IAM User with a bounded thread pool.
+    A failure of one user is recorded and never aborts the run.
+
+    The IAM User of the session itself is left out of the pool and rotated last, switching the session to its new
+    key. Deleting the key in the middle of the run would fail every later call.
+    """
+
+    def __init__(self, service, max_workers: int = DEFAULT_MAX_WORKERS):
+        if max_workers < 1:
+            raise ValueError("Error, max_workers must be 1 or more.")
+        self.service = service
+        self.max_workers = max_workers
+
+    def check_and_rotate(self, user_name: str, force: bool = False, switch_session: bool = False):
+        """
+        Publish a new credential for IAM User if it needs to.
+
+        :param user_name: IAM User name
+        :param force: True for publish regardless of the credential age.
+        :param switch_session: True for the IAM User of the session. See 'Service.rotate_credential'.
+        :return: Result of 'Service.rotate_credential' if rotated, None if not.
+        """
+        result = self.service.rotate_credential(user_name=user_name, force=force, switch_session=switch_session)
+        return result if result['AccessKey'] is not None else None
+
+    def run(self, path_prefix: str = '/', force: bool = False, use_report: bool = False):
+        """
+        Check and rotate credentials of all IAM Users under the path prefix.
+
+        :param path_prefix: IAM path prefix to filter users. '/' for all users.
+        :param force: True for publish regardless of the credential age.
+        :param use_report: True for read credential report once and skip users it proves young.
+                           Only the rest are checked with 'ListAccessKeys'.
+        :return:
+        {
+            'Rotated': {
+                '{IAM_USER_NAME}': {'AccessKey': {...}, 'Actions': [...], 'ApiCalls': 123}
+            },
+            'Skipped': ['{IAM_USER_NAME}'],
+            'Failed': {
+                '{IAM_USER_NAME}': 'error message'
+            }
+        }
+        A user that failed after its new key was created, and the key is still Active, is in 'Rotated' with
+        'Error'. (See 'record_error')
+        """
+        result = {'Rotated': {}, 'Skipped': [], 'Failed': {}}
+        with tracer.span('fleet.rotate', path_prefix=path_prefix, max_workers=self.max_workers) as span:
+            report = self.service.get_credential_report() if use_report and not force else None
+            owner = self.service.caller_user_name()
+            own = False
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {}
+                for user_name in self.service.list_user_names(path_prefix=path_prefix):
+                    if report is not None and not report.needs_check(user_name,
+                                                                     max_age_days=self.service.max_age_days):
+                        result['Skipped'].append(user_name)
+                    elif user_name == owner:
+                        own = True
+                    else:
+                        futures[executor.submit(self.check_and_rotate, user_name, force)] = user_name
+                for future in as_completed(futures):
+                    self.record(result, futures[future], future.result)
+            if own:
+                self.record(result, owner, lambda: self.check_and_rotate(owner, force=force, switch_session=True))
+            span.set(rotated=len(result['Rotated']), skipped=len(result['Skipped']), failed=len(result['Failed']))
+        return result
+
+    @staticmethod
+    def record(result: dict, user_name: str, outcome):
+        """
+        Put the outcome of a user into the result of 'run'.
+
+        :param outcome: Function returning the result of 'check_and_rotate' or raising its error.
+        """
+        try:
+            access_key = outcome()
+        except Exception as e:
+            Fleet.record_error(result, user_name, e)
+            return
+        if access_key is None:
+            result['Skipped'].append(user_name)
+        else:
+            result['Rotated'][user_name] = access_key
+
+    @staticmethod
+    def record_error(result: dict, user_name: str, error: Exception):
+        """
+        Put a failure of a user into the result of 'run'. A failure that left a new key Active (planner.ApplyError)
+        is put in 'Rotated' with 'Error', since its secret is only in the partial result.
+        """
+        if isinstance(error, ApplyError):
+            result['Rotated'][user_name] = dict(error.result, Error=str(error))
+        else:
+            result['Failed'][user_name] = str(error)
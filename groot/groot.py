@@ -1,53 +1,216 @@
 from datetime import datetime, timezone
-import boto3
+import threading
 from credential import Credential, Status
-from account import Account
-import date_format
-
-df = date_format.basic
+from account import Account, IdentityCache, default_identity_cache, USER_ARN_PREFIX
+from coalesce import KeyCache, UserLocks, default_key_cache, default_user_locks
+from user import User
+from fleet import Fleet, DEFAULT_MAX_WORKERS
+from planner import ApplyError, Snapshot, Action, Plan, plan_rotation, MAX_CREDENTIAL_AGE_DAYS
+from pipeline import RotationPipeline, wait_for_credential, DEFAULT_VERIFY_TIMEOUT
+from report import CredentialReport, KeyReport
+from pool import ClientPool, PooledSession, default_pool
+from throttle import RateLimiter, default_limiter
+from tracing import tracer
 
 
 class Service:
-    session: boto3.Session
-    credential_handler: Credential
-    account_handler: Account
-
-    def __init__(self, access_key_id: str, secret_access_key: str):
-        self.set_session_profile(access_key_id=access_key_id, secret_access_key=secret_access_key)
-
-    def set_session_profile(self, access_key_id: str, secret_access_key: str):
-        print(f"[{datetime.now().strftime(df)}] SERVICE:SET AWS session profile. AccessKeyId: \'{access_key_id}\'")
-        self.session = boto3.session.Session(
-            aws_access_key_id=access_key_id,
-            aws_secret_access_key=secret_access_key
+    session: PooledSession
+    pool: ClientPool
+    limiter: RateLimiter
+    identity_cache: IdentityCache
+    key_cache: KeyCache
+    user_locks: UserLocks
+    handlers: dict
+
+    def __init__(self, access_key_id: str, secret_access_key: str, pool: ClientPool = None,
+                 limiter: RateLimiter = None, identity_cache: IdentityCache = None, key_cache: KeyCache = None,
+                 user_locks: UserLocks = None, session_token: str = None, credentials=None, policy=None):
+        """
+        :param session_token: Session token of a temporary credential. e.g. assumed role
+        :param credentials: Function returning the current temporary credential ('Credentials' of 'AssumeRole'),
+                            asked again before every user so a long run moves to a refreshed one. None for a
+                            fixed credential.
+        :param key_cache: Short-lived 'ListAccessKeys' cache shared by Services of the process. (coalesce.KeyCache)
+        :param user_locks: Per IAM User locks that serialize mutations of access keys. (coalesce.UserLocks)
+        :param policy: groot.policy.RotationPolicy. Its 'max_age_days' decides when a key is rotated, and
+                       'evaluate_policy' uses it by default. MAX_CREDENTIAL_AGE_DAYS for None.
+        """
+        self.pool = pool or default_pool
+        self.limiter = limiter or default_limiter
+        self.identity_cache = identity_cache or default_identity_cache
+        self.key_cache = key_cache or default_key_cache
+        self.user_locks = user_locks or default_user_locks
+        self.credentials = credentials
+        self.policy = policy
+        self.session_lock = threading.Lock()
+        self.set_session_profile(access_key_id=access_key_id, secret_access_key=secret_access_key,
+                                 session_token=session_token)
+
+    def set_session_profile(self, access_key_id: str, secret_access_key: str, session_token: str = None):
+        """
+        Use the credential for later calls. Clients are checked out of the pool, so switching back and forth
+        or constructing Service again with the same credential doesn't create new clients.
+        """
+        tracer.event('service.set_session_profile', access_key_id=access_key_id)
+        self.session = PooledSession(
+            access_key_id=access_key_id,
+            secret_access_key=secret_access_key,
+            session_token=session_token,
+            pool=self.pool
         )
-        self.credential_handler = Credential(session=self.session)
-        self.account_handler = Account(session=self.session)
+        self.handlers = {}
+
+    def refresh_session(self):
+        """
+        Switch to the current credential of 'credentials' if it has changed. Calls already running keep the
+        replaced credential, which is still valid until shortly after the refresh.
+        """
+        if self.credentials is None:
+            return
+        credentials = self.credentials()
+        with self.session_lock:
+            if credentials['AccessKeyId'] != self.session.access_key_id:
+                self.set_session_profile(access_key_id=credentials['AccessKeyId'],
+                                         secret_access_key=credentials['SecretAccessKey'],
+                                         session_token=credentials['SessionToken'])
+
+    def handler(self, handler_class):
+        """
+        Get the handler of the current session. Handler and its client are created on first use,
+        so a request that only needs IAM never creates STS client.
+        """
+        handlers = self.handlers  # Replaced as a whole on a session switch, so read it once.
+        if handler_class not in handlers:
+            handlers[handler_class] = handler_class(session=self.session, limiter=self.limiter)
+        return handlers[handler_class]
 
-    def publish_new_credential(self, user_name: str):
+    @property
+    def max_age_days(self) -> float:
+        """
+        Age in days of an active key to publish a new one at. inf when the policy disables 'max_age_days'.
+        """
+        if self.policy is None:
+            return MAX_CREDENTIAL_AGE_DAYS
+        return float('inf') if self.policy.max_age_days is None else self.policy.max_age_days
+
+    @property
+    def credential_handler(self) -> Credential:
+        handlers = self.handlers
+        if Credential not in handlers:
+            handlers[Credential] = Credential(session=self.session, limiter=self.limiter, cache=self.key_cache)
+        return handlers[Credential]
+
+    @property
+    def account_handler(self) -> Account:
+        handlers = self.handlers
+        if Account not in handlers:
+            handlers[Account] = Account(session=self.session, limiter=self.limiter, cache=self.identity_cache)
+        return handlers[Account]
+
+    @property
+    def user_handler(self) -> User:
+        return self.handler(User)
+
+    @property
+    def report_handler(self) -> CredentialReport:
+        return self.handler(CredentialReport)
+
+    def publish_new_credential(self, user_name: str, switch_session: bool = True):
         """
         Publish a new Credential for IAM User. After creation, Remove older credential.
+        Access keys are listed once, then create and delete are applied on that snapshot.
 
         :param user_name: IAM User name
+        :param switch_session: True for use the new credential as session profile. (Rotating own credential)
+                               False for keep the current session. (Rotating other IAM User's credential)
         :return:
         {
+            'UserName': 'string',
             'AccessKey': {
                 'UserName': 'string',
                 'AccessKeyId': 'string',
                 'Status': 'Active'|'Inactive',
                 'SecretAccessKey': 'string',
                 'CreateDate': datetime(2015, 1, 1)
-            }
+            },
+            'Actions': [{'Action': 'Create'|'Deactivate'|'Delete', 'AccessKeyId': 'string'}],
+            'ApiCalls': 123
         }
         """
-        access_key = self.credential_handler.create(user_name=user_name)
-        print(f"[{datetime.now().strftime(df)}] SERVICE:PUBLISH a new credential for User : {user_name}, AccessKeyId : {access_key['AccessKey']['AccessKeyId']}")
+        return self.rotate_credential(user_name=user_name, force=True, switch_session=switch_session)
+
+    def rotate_credential(self, user_name: str, force: bool = False, keep_inactive: bool = False,
+                          switch_session: bool = False, verify_timeout: float = DEFAULT_VERIFY_TIMEOUT):
+        """
+        Check and publish a new credential for IAM User with a single read of its access keys.
+        Rotations of the same user are serialized, and the read is never from the cache, so concurrent calls
+        can't both create a key.
 
-        self.mark_inactive_older_credential(user_name=user_name)
-        self.set_session_profile(access_key_id=access_key['AccessKey']['AccessKeyId'],
-                                 secret_access_key=access_key['AccessKey']['SecretAccessKey'])
-        self.remove_inactive_credential(user_name=user_name)
-        return access_key
+        With 'switch_session' the replaced key signs the session, so it is deactivated or deleted only after the
+        new key works and the session uses it. A new key that never works is deleted again, and the replaced key
+        stays.
+
+        :param user_name: IAM User name
+        :param force: True for publish regardless of the credential age.
+        :param keep_inactive: True for leave the replaced credential as Inactive instead of deleting it.
+        :param switch_session: True for use the new credential as session profile, once IAM has propagated it.
+        :param verify_timeout: Seconds to wait for the new key to work with 'switch_session'.
+        :return: Same as 'publish_new_credential'. 'AccessKey' is None when it didn't need to publish.
+        :raise planner.ApplyError: The new key is Active but the rotation failed after it. It has the result.
+        """
+        self.refresh_session()
+        with self.user_locks.hold(user_name), \
+                tracer.span('service.rotate_credential', user=user_name, force=force) as span:
+            snapshot = Snapshot.read(credential_handler=self.credential_handler, user_name=user_name, fresh=True)
+            plan = plan_rotation(snapshot=snapshot, force=force, keep_inactive=keep_inactive,
+                                 max_age_days=self.max_age_days)
+            head, tail = plan.actions, []
+            if switch_session and plan.actions:
+                head, tail = plan.actions[:-1], plan.actions[-1:]  # Deactivate or Delete of the replaced key.
+            result = Plan(user_name=user_name, actions=head).apply(credential_handler=self.credential_handler)
+            self.invalidate_applied(result)
+            if result['AccessKey'] is not None:
+                tracer.event('service.publish', user=user_name, access_key_id=result['AccessKey']['AccessKeyId'])
+            if tail:
+                try:
+                    self.switch_to_new_credential(result['AccessKey'], timeout=verify_timeout)
+                except Exception as e:  # The session still uses the replaced key.
+                    self.pool.invalidate(access_key_id=result['AccessKey']['AccessKeyId'])
+                    raise plan.roll_back(self.credential_handler, result, error=e) from e
+                try:
+                    replaced = Plan(user_name=user_name, actions=tail).apply(
+                        credential_handler=self.credential_handler, read_calls=0)
+                except Exception as e:
+                    raise ApplyError(f"{e} The session uses the new credential "
+                                     f"{result['AccessKey']['AccessKeyId']}, the replaced one is still Active.",
+                                     result=result) from e
+                self.invalidate_applied(replaced)
+                result['Actions'].extend(replaced['Actions'])
+                result['ApiCalls'] += replaced['ApiCalls']
+            span.set(api_calls=result['ApiCalls'], outcome='skipped' if result['AccessKey'] is None else 'ok')
+        return result
+
+    def switch_to_new_credential(self, access_key: dict, timeout: float = DEFAULT_VERIFY_TIMEOUT):
+        """
+        Wait until IAM has propagated the new key and use it as session profile.
+
+        :param access_key: 'AccessKey' of 'create_access_key'.
+        :param timeout: Seconds to wait for the key to work.
+        """
+        identity = wait_for_credential(access_key, pool=self.pool, limiter=self.limiter, timeout=timeout)
+        self.identity_cache.put(access_key['AccessKeyId'], identity, access_key['SecretAccessKey'])
+        with self.session_lock:
+            self.credentials = None  # The new key is the session now, not the provider's credential.
+            self.set_session_profile(access_key_id=access_key['AccessKeyId'],
+                                     secret_access_key=access_key['SecretAccessKey'])
+
+    def invalidate_applied(self, result: dict):
+        """
+        Invalidate the credentials that actions of 'Plan.apply' deactivated or deleted.
+        """
+        for action in result['Actions']:
+            if action['Action'] != Action.Create.value:
+                self.invalidate_credential(access_key_id=action['AccessKeyId'])
 
     def delete_credential(self, user_name: str, access_key_id: str):
         """
@@ -57,24 +220,189 @@ class Service:
             :param access_key_id: Access key id related to iam user.
             :return: None
             """
-        print(f"[{datetime.now().strftime(df)}] SERVICE:DELETE Credential : {user_name}, AccessKeyId : {access_key_id}")
-        self.credential_handler.delete(user_name=user_name, access_key_id=access_key_id)
+        with self.user_locks.hold(user_name), \
+                tracer.span('service.delete_credential', user=user_name, access_key_id=access_key_id):
+            self.credential_handler.delete(user_name=user_name, access_key_id=access_key_id)
+            self.invalidate_credential(access_key_id=access_key_id)
+
+    def invalidate_credential(self, access_key_id: str):
+        """
+        Forget pooled clients and cached caller identity of a deactivated or deleted credential.
+        """
+        self.pool.invalidate(access_key_id=access_key_id)
+        self.identity_cache.invalidate(access_key_id=access_key_id)
 
     def get_account_info(self):
         """
-        Get AWS Account information
+        Get AWS Account information. Cached per access key id and secret. (account.IdentityCache)
 
         :return:
         """
         return self.account_handler.get_aws_account_info()
 
-    def need_to_publish_new_credential(self, user_name: str):
+    def caller_user_name(self):
+        """
+        :return: IAM User name of the session. None if the session is not an IAM User. (e.g. assumed role)
+        """
+        account_info = self.get_account_info()
+        return account_info['UserName'] if USER_ARN_PREFIX.match(account_info['UserArn']) else None
+
+    def get_rate_metrics(self):
+        """
+        Get effective request rate and throttling counters per AWS API.
+
+        :return:
+        {
+            '{API_NAME}': {'Rate': 10.0, 'MaxRate': 10.0, 'Calls': 123, 'Retries': 123, 'Throttled': 123}
+        }
+        """
+        return self.limiter.metrics()
+
+    def get_cache_metrics(self):
+        """
+        Get counters of the access key cache and per user locks.
+
+        :return: {'Hits': 123, 'Misses': 123, 'Coalesced': 123, 'Invalidations': 123, 'Users': 123, 'Contended': 123}
+        """
+        return dict(self.key_cache.metrics(), Contended=self.user_locks.contended)
+
+    def get_trace_metrics(self, output_format: str = 'dict'):
+        """
+        Get latency histograms and call counters of operations and AWS API calls.
+
+        :param output_format: 'dict', 'jsonl' for JSON lines or 'prometheus' for Prometheus text format.
+        :return: See 'tracing.Tracer.metrics'.
+        """
+        if output_format == 'jsonl':
+            return tracer.metrics_jsonl()
+        if output_format == 'prometheus':
+            return tracer.prometheus()
+        return tracer.metrics()
+
+    def list_user_names(self, path_prefix: str = '/'):
+        """
+        List IAM User names.
+
+        :param path_prefix: IAM path prefix to filter users. '/' for all users.
+        :return: generator of IAM User names.
+        """
+        return self.user_handler.list(path_prefix=path_prefix)
+
+    def get_credential_report(self):
+        """
+        Get access key state of every IAM User in the account from one credential report.
+
+        :return: KeyReport
+        """
+        return self.report_handler.get()
+
+    def evaluate_policy(self, policy=None, path_prefix: str = '/', report: KeyReport = None):
+        """
+        Evaluate rotation policy over every access key of the account at once.
+        Key state comes from one credential report and IAM paths from 'list_users', no per-user calls.
+        Keys are '{IAM_USER_NAME}#{1|2}' since credential report doesn't have access key ids.
+        Requires numpy.
+
+        :param policy: groot.policy.RotationPolicy. The policy of the Service for None.
+        :param path_prefix: IAM path prefix to filter users. '/' for all users.
+        :param report: Credential report from 'get_credential_report'. Read a new one for None.
+        :return: groot.policy.PolicyResult
+        """
+        from policy import KeyTable, PolicyEngine  # numpy is needed only here.
+        with tracer.span('service.evaluate_policy', path_prefix=path_prefix) as span:
+            paths = self.user_handler.paths(path_prefix=path_prefix)
+            table = KeyTable.from_report(report or self.get_credential_report(), paths=paths)
+            result = PolicyEngine(policy=policy or self.policy).evaluate(table)
+            span.set(keys=len(table), **result.counts())
+        return result
+
+    def rotate_fleet(self, path_prefix: str = '/', max_workers: int = DEFAULT_MAX_WORKERS, force: bool = False,
+                     use_report: bool = False):
         """
-        Check if it need to publish a new credential.
+        Check and publish a new credential for every IAM User in parallel.
+        The current session is kept, so the session must have permission to rotate other IAM Users.
+
+        :param path_prefix: IAM path prefix to filter users. '/' for all users.
+        :param max_workers: Maximum number of users processed concurrently.
+        :param force: True for publish regardless of the credential age.
+        :param use_report: True for skip users that credential report proves young, without 'ListAccessKeys'.
+        :return:
+        {
+            'Rotated': {'{IAM_USER_NAME}': {'AccessKey': {...}}},
+            'Skipped': ['{IAM_USER_NAME}'],
+            'Failed': {'{IAM_USER_NAME}': 'error message'}
+        }
+        """
+        return Fleet(service=self, max_workers=max_workers).run(path_prefix=path_prefix, force=force,
+                                                               use_report=use_report)
+
+    def rotate_pipeline(self, user_names: list = None, path_prefix: str = '/', force: bool = False,
+                        keep_inactive: bool = False, workers: dict = None, verify_timeout: float = None):
+        """
+        Rotate many IAM Users through the stages create, verify, deactivate and delete, each with its own workers.
+        The old key of a user is deactivated only after the new key works, and propagation waits of users overlap.
+        The IAM User of the session is rotated last, on its own with 'switch_session', since its old key signs
+        every call of the pipeline.
+
+        :param user_names: IAM User names. Every user under 'path_prefix' for None.
+        :param workers: Workers per stage. e.g. {'create': 4, 'verify': 4, 'deactivate': 4, 'delete': 4}
+        :param verify_timeout: Seconds to wait for a new key to work. A key that doesn't is deleted, the old one stays.
+        :return: See 'pipeline.RotationPipeline.run'.
+        """
+        verify_timeout = DEFAULT_VERIFY_TIMEOUT if verify_timeout is None else verify_timeout
+        pipeline = RotationPipeline(service=self, workers=workers, force=force, keep_inactive=keep_inactive,
+                                    verify_timeout=verify_timeout)
+        if user_names is None:
+            user_names = self.list_user_names(path_prefix=path_prefix)
+        owner = self.caller_user_name()
+        user_names = list(user_names)
+        result = pipeline.run(user_name for user_name in user_names if user_name != owner)
+        if owner in user_names:
+            def rotate_own():
+                rotated = self.rotate_credential(user_name=owner, force=force, keep_inactive=keep_inactive,
+                                                 switch_session=True, verify_timeout=verify_timeout)
+                return rotated if rotated['AccessKey'] is not None else None
+            Fleet.record(result, owner, rotate_own)
+        return result
+
+    def rotate_organization(self, account_ids: list, role_name: str, path_prefix: str = '/', force: bool = False,
+                            use_report: bool = False, external_id: str = None, max_accounts: int = None,
+                            account_workers: int = None):
+        """
+        Check and publish a new credential for every IAM User of every account, with the role assumed from
+        the current session. Role credentials are cached and assumed again shortly before they expire.
+
+        :param account_ids: AWS account ids.
+        :param role_name: Role to assume in every account. It needs the IAM permissions of 'rotate_fleet'.
+        :param max_accounts: Accounts processed concurrently.
+        :param account_workers: Users processed concurrently in each account.
+        :return: See 'organization.Organization.rotate'.
+        """
+        from organization import Organization, DEFAULT_MAX_ACCOUNTS, DEFAULT_ACCOUNT_WORKERS
+        organization = Organization(
+            account_ids=account_ids,
+            role_name=role_name,
+            session=self.session,
+            external_id=external_id,
+            max_accounts=max_accounts or DEFAULT_MAX_ACCOUNTS,
+            account_workers=account_workers or DEFAULT_ACCOUNT_WORKERS,
+            limiter=self.limiter,
+            policy=self.policy
+        )
+        return organization.rotate(path_prefix=path_prefix, force=force, use_report=use_report)
+
+    def need_to_publish_new_credential(self, user_name: str, report: KeyReport = None):
+        """
+        Check if it need to publish a new credential. Access keys may come from the short-lived cache.
 
         :param user_name: IAM User name
+        :param report: Credential report from 'get_credential_report'. 'ListAccessKeys' is called only when
+                       the report can't decide.
         :return: bool. True for need to publish a new credential, False for don't need to.
         """
+        if report is not None and not report.needs_check(user_name=user_name, max_age_days=self.max_age_days):
+            tracer.event('service.need_to_publish', user=user_name, need=False, source='report')
+            return False
         credentials = self.credential_handler.list(user_name=user_name)['AccessKeyMetadata']
         amt_credentials = len(credentials)
         # credential amount :
@@ -86,46 +414,53 @@ class Service:
             raise Exception("Error, IAM user doesn't have any credential. "
                             "It might IAM User name was wrong or All credentials are Inactive.")
         elif amt_credentials == 1:
-            duration = credentials[0]['CreateDate'] - datetime.now(timezone.utc)
-            if duration.days >= 75:  # 생성한지 75일 지난 경우 credential 재발행.
-                print(f'[{datetime.now().strftime(df)}] REPORT iam user \'{user_name}\' need to publish a new credential.')
+            duration = datetime.now(timezone.utc) - credentials[0]['CreateDate']
+            if duration.days >= self.max_age_days:  # 생성한지 75일 지난 경우 credential 재발행.
+                tracer.event('service.need_to_publish', user=user_name, need=True)
                 return True
             else:
-                print(f'[{datetime.now().strftime(df)}] REPORT iam user \'{user_name}\' don\'t need to publish a new credential.')
+                tracer.event('service.need_to_publish', user=user_name, need=False)
                 return False
         elif amt_credentials == 2:
-            self.mark_inactive_older_credential(user_name=user_name)
+            self.mark_inactive_older_credential(user_name=user_name)  # Reads again under the lock, not cached.
             raise Exception("Error, Can't determine which credential is correct.")
         else:
             raise Exception("Error, Maximum credentials related to IAM User is 2.")
 
-    def remove_inactive_credential(self, user_name: str):
+    def remove_inactive_credential(self, user_name: str, credentials: list = None):
         """
         Remove credential that status is inactive.
 
         :param user_name: IAM User name.
+        :param credentials: 'AccessKeyMetadata' already listed. List again for None.
         :return: None
         """
-        print(f'[{datetime.now().strftime(df)}] SERVICE:REMOVE Inactive credentials for \'{user_name}\'')
-        credentials = self.credential_handler.list(user_name=user_name)['AccessKeyMetadata']
-        for credential in credentials:
-            if credential['Status'] == Status.Inactive:
-                self.credential_handler.delete(user_name=user_name, access_key_id=credential['AccessKeyId'])
-            else:
-                pass
+        tracer.event('service.remove_inactive', user=user_name)
+        with self.user_locks.hold(user_name):
+            if credentials is None:
+                credentials = self.credential_handler.list(user_name=user_name, fresh=True)['AccessKeyMetadata']
+            for credential in credentials:
+                if credential['Status'] == Status.Inactive.value:
+                    self.credential_handler.delete(user_name=user_name, access_key_id=credential['AccessKeyId'])
+                    self.invalidate_credential(access_key_id=credential['AccessKeyId'])
+                else:
+                    pass
 
-    def mark_inactive_older_credential(self, user_name: str):
+    def mark_inactive_older_credential(self, user_name: str, credentials: list = None):
         """
         Compare 2 credentials creation date in a same IAM user. Then make older credential status as Inactive.
 
         :param user_name: IAM User name.
+        :param credentials: 'AccessKeyMetadata' already listed. List again for None.
         :return: None.
         """
-        credentials = self.credential_handler.list(user_name=user_name)['AccessKeyMetadata']
-        if credentials[0]['CreateDate'] > credentials[1]['CreateDate']:
-            inactive_target_access_key = credentials[1]['AccessKeyId']
-        else:
-            inactive_target_access_key = credentials[0]['AccessKeyId']
-        print(f"[{datetime.now().strftime(df)}] SERVICE:MARK credential Inactive. User : {user_name}, "
-              f"AccessKeyId : {inactive_target_access_key}")
-        self.credential_handler.make_inactive(user_name=user_name, access_key_id=inactive_target_access_key)
+        with self.user_locks.hold(user_name):
+            if credentials is None:
+                credentials = self.credential_handler.list(user_name=user_name, fresh=True)['AccessKeyMetadata']
+            if credentials[0]['CreateDate'] > credentials[1]['CreateDate']:
+                inactive_target_access_key = credentials[1]['AccessKeyId']
+            else:
+                inactive_target_access_key = credentials[0]['AccessKeyId']
+            tracer.event('service.mark_inactive', user=user_name, access_key_id=inactive_target_access_key)
+            if self.credential_handler.make_inactive(user_name=user_name, access_key_id=inactive_target_access_key):
+                self.invalidate_credential(access_key_id=inactive_target_access_key)
@@ -0,0 +1,231 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import threading
+from coalesce import SingleFlight, UserLocks
+from pool import ClientPool, PooledSession, DEFAULT_MAX_SIZE
+from throttle import RateLimiter, default_limiter
+from tracing import tracer
+
+DEFAULT_ROLE_SESSION_NAME = 'groot'
+DEFAULT_ROLE_DURATION_SECONDS = 3600
+DEFAULT_REFRESH_BEFORE_SECONDS = 300
+DEFAULT_MAX_ACCOUNTS = 8
+DEFAULT_ACCOUNT_WORKERS = 4
+
+
+class RoleCredentialCache:
+    """
+    Temporary credentials of 'AssumeRole' per (base access key id, role ARN, external id, session name), so callers
+    with another base credential or another session never share a credential. A credential is used until
+    'refresh_before' seconds before its expiration and then assumed again, so a long run never signs with an
+    expiring credential. Threads asking for the same key at once share one 'AssumeRole'.
+    """
+
+    def __init__(self, refresh_before: float = DEFAULT_REFRESH_BEFORE_SECONDS):
+        self.refresh_before = refresh_before
+        self.entries = {}  # key -> {'AccessKeyId', 'SecretAccessKey', 'SessionToken', 'Expiration'}
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.assumed = 0
+
+    def get(self, key: tuple, assume):
+        """
+        :param key: (base access key id, role ARN, external id, session name)
+        :param assume: Function calling 'AssumeRole' of the role, returning 'Credentials' of the response.
+        :return: (credentials, access key id of the credential it replaced or None)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.fresh(entry):
+                self.hits += 1
+                return entry, None
+        credentials = self.flight.do(key, lambda: self.load(key, assume))
+        return credentials, entry['AccessKeyId'] if entry is not None else None
+
+    def load(self, key: tuple, assume):
+        credentials = assume()
+        with self.lock:
+            self.entries[key] = credentials
+            self.assumed += 1
+        return credentials
+
+    def fresh(self, credentials: dict):
+        remaining = credentials['Expiration'] - datetime.now(timezone.utc)
+        return remaining.total_seconds() > self.refresh_before
+
+    def invalidate(self, key: tuple):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def metrics(self):
+        """
+        :return: {'Hits': 123, 'Assumed': 123, 'Roles': 123}
+        """
+        with self.lock:
+            return {'Hits': self.hits, 'Assumed': self.assumed, 'Roles': len(self.entries)}
+
+
+default_role_cache = RoleCredentialCache()
+
+
+class Organization:
+    """
+    Run rotation across accounts with a role assumed in each of them, from one base credential.
+
+    Accounts run in parallel, up to 'max_accounts' at once, and each account checks at most 'account_workers' users
+    at once. Every account has its own rate limiter and user locks, since IAM throttles per account, so a throttled
+    account backs off alone instead of stalling the others.
+    """
+
+    def __init__(self, account_ids: list, role_name: str, session: PooledSession = None, external_id: str = None,
+                 session_name: str = DEFAULT_ROLE_SESSION_NAME, duration_seconds: int = DEFAULT_ROLE_DURATION_SECONDS,
+                 max_accounts: int = DEFAULT_MAX_ACCOUNTS, account_workers: int = DEFAULT_ACCOUNT_WORKERS,
+                 limiter: RateLimiter = None, pool: ClientPool = None, role_cache: RoleCredentialCache = None,
+                 partition: str = 'aws', policy=None):
+        """
+        :param account_ids: AWS account ids.
+        :param role_name: Role name (with path if any) to assume in every account. e.g. 'groot' or 'ops/groot'
+        :param session: Base credential calling 'AssumeRole'. Default credential chain for None.
+        :param limiter: Rate limiter of 'AssumeRole' calls of the base credential.
+        :param pool: Pool of clients of the assumed roles. A pool with room for every account for None.
+        :param policy: groot.policy.RotationPolicy of the Service of every account. See 'Service'.
+        """
+        if max_accounts < 1 or account_workers < 1:
+            raise ValueError("Error, max_accounts and account_workers must be 1 or more.")
+        self.account_ids = list(dict.fromkeys(account_ids))
+        self.role_name = role_name.strip('/')
+        self.session = session or PooledSession()
+        self.external_id = external_id
+        self.session_name = session_name
+        self.duration_seconds = duration_seconds
+        self.max_accounts = max_accounts
+        self.account_workers = account_workers
+        self.limiter = limiter or default_limiter
+        self.pool = pool or ClientPool(max_size=max(DEFAULT_MAX_SIZE, 3 * len(self.account_ids)))
+        self.role_cache = role_cache or default_role_cache
+        self.partition = partition
+        self.policy = policy
+        self.limiters = {}  # account_id -> RateLimiter
+        self.user_locks = {}  # account_id -> UserLocks
+        self.lock = threading.Lock()
+
+    def role_arn(self, account_id: str):
+        return f'arn:{self.partition}:iam::{account_id}:role/{self.role_name}'
+
+    def base_access_key_id(self):
+        """
+        :return: Access key id of the base credential, read from the default credential chain for None.
+        """
+        if self.session.access_key_id is not None:
+            return self.session.access_key_id
+        self.session.client('sts')  # Loads the base session of the pool.
+        credentials = self.session.pool.session.get_credentials()
+        return credentials.access_key if credentials is not None else None
+
+    def role_key(self, account_id: str):
+        """
+        :return: Key of the role in the account in RoleCredentialCache.
+        """
+        return self.base_access_key_id(), self.role_arn(account_id), self.external_id, self.session_name
+
+    def credentials(self, account_id: str):
+        """
+        :return: Cached 'Credentials' of the role in the account. Assumed again shortly before expiration.
+        """
+        role_arn = self.role_arn(account_id)
+
+        def assume():
+            params = {'RoleArn': role_arn, 'RoleSessionName': self.session_name,
+                      'DurationSeconds': self.duration_seconds}
+            if self.external_id:
+                params['ExternalId'] = self.external_id
+            with tracer.span('organization.assume_role', account=account_id):
+                return self.limiter.call('AssumeRole', self.session.client('sts').assume_role, **params)['Credentials']
+
+        credentials, replaced = self.role_cache.get(self.role_key(account_id), assume)
+        if replaced is not None and replaced != credentials['AccessKeyId']:
+            self.pool.invalidate(access_key_id=replaced)
+        return credentials
+
+    def account_state(self, account_id: str):
+        with self.lock:
+            if account_id not in self.limiters:
+                self.limiters[account_id] = RateLimiter()
+                self.user_locks[account_id] = UserLocks()
+            return self.limiters[account_id], self.user_locks[account_id]
+
+    def service(self, account_id: str):
+        """
+        :return: Service of the account, signed with the assumed role. The Service asks for the credential again
+                 before every user, so it moves to the new credential once the cache assumes the role again.
+        """
+        from groot import Service  # Imported on use, when both the groot package and groot.py are loaded.
+        credentials = self.credentials(account_id)
+        limiter, user_locks = self.account_state(account_id)
+        return Service(
+            access_key_id=credentials['AccessKeyId'],
+            secret_access_key=credentials['SecretAccessKey'],
+            session_token=credentials['SessionToken'],
+            pool=self.pool,
+            limiter=limiter,
+            user_locks=user_locks,
+            credentials=lambda: self.credentials(account_id),
+            policy=self.policy
+        )
+
+    def run(self, func):
+        """
+        Call 'func(service)' for every account in parallel. A failure of one account never aborts the run.
+
+        :return: ({'{ACCOUNT_ID}': result}, {'{ACCOUNT_ID}': 'error message'})
+        """
+        results, failed = {}, {}
+        with ThreadPoolExecutor(max_workers=self.max_accounts) as executor:
+            futures = {executor.submit(lambda a: func(self.service(a)), account_id): account_id
+                       for account_id in self.account_ids}
+            for future in as_completed(futures):
+                account_id = futures[future]
+                try:
+                    results[account_id] = future.result()
+                except Exception as e:
+                    failed[account_id] = str(e)
+                    tracer.event('organization.failed', account=account_id, error=str(e))
+        return results, failed
+
+    def rotate(self, path_prefix: str = '/', force: bool = False, use_report: bool = False):
+        """
+        Check and publish a new credential for every IAM User of every account.
+
+        :return:
+        {
+            'Accounts': {'{ACCOUNT_ID}': result of 'Service.rotate_fleet'},
+            'Failed': {'{ACCOUNT_ID}': 'error message'},
+            'Rotated': 123,
+            'Skipped': 123,
+            'FailedUsers': 123
+        }
+        """
+        with tracer.span('organization.rotate', accounts=len(self.account_ids), max_accounts=self.max_accounts,
+                         account_workers=self.account_workers) as span:
+            accounts, failed = self.run(lambda service: service.rotate_fleet(
+                path_prefix=path_prefix, max_workers=self.account_workers, force=force, use_report=use_report))
+            result = {
+                'Accounts': accounts,
+                'Failed': failed,
+                'Rotated': sum(len(r['Rotated']) for r in accounts.values()),
+                'Skipped': sum(len(r['Skipped']) for r in accounts.values()),
+                'FailedUsers': sum(len(r['Failed']) for r in accounts.values())
+            }
+            span.set(rotated=result['Rotated'], skipped=result['Skipped'], failed_users=result['FailedUsers'],
+                     failed_accounts=len(failed))
+        return result
+
+    def metrics(self):
+        """
+        :return: {'Roles': RoleCredentialCache.metrics(), 'Accounts': {'{ACCOUNT_ID}': RateLimiter.metrics()}}
+        """
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {'Roles': self.role_cache.metrics(),
+                'Accounts': {account_id: limiter.metrics() for account_id, limiter in limiters.items()}}
@@ -0,0 +1,391 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from account import parse_user_name
+from planner import Action, Plan, Snapshot, plan_rotation
+from pool import PooledSession
+from tracing import Histogram, tracer
+
+DEFAULT_STAGE_WORKERS = {'create': 4, 'verify': 4, 'deactivate': 4, 'delete': 4}
+DEFAULT_VERIFY_TIMEOUT = 60.0
+DEFAULT_VERIFY_BASE_DELAY = 0.5
+DEFAULT_VERIFY_MAX_DELAY = 8.0
+# Answers of a new access key that IAM hasn't propagated yet. 'AccessDenied' is a real failure and isn't retried.
+NOT_PROPAGATED_ERROR_CODES = {'InvalidClientTokenId', 'SignatureDoesNotMatch', 'AuthFailure'}
+
+
+def check_credential(access_key: dict, pool, limiter):
+    """
+    Call 'GetCallerIdentity' signed with the new access key.
+
+    :param access_key: 'AccessKey' of 'create_access_key'.
+    :return: Identity of the key ({'UserArn', 'UserName', 'Account'}), None if IAM hasn't propagated it yet.
+    """
+    session = PooledSession(access_key_id=access_key['AccessKeyId'], secret_access_key=access_key['SecretAccessKey'],
+                            pool=pool)
+    try:
+        identity = limiter.call('GetCallerIdentity', session.client('sts').get_caller_identity)
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in NOT_PROPAGATED_ERROR_CODES:
+            return None
+        raise
+    if parse_user_name(identity['Arn']) != access_key['UserName']:
+        raise Exception(f"Error, Access key {access_key['AccessKeyId']} belongs to {identity['Arn']}.")
+    return {'UserArn': identity['Arn'], 'UserName': access_key['UserName'], 'Account': identity['Account']}
+
+
+def backoff_delay(attempt: int, base_delay: float = DEFAULT_VERIFY_BASE_DELAY,
+                  max_delay: float = DEFAULT_VERIFY_MAX_DELAY):
+    """
+    :return: Seconds before the next check. Exponential with equal jitter, so keys created together spread out.
+    """
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def wait_for_credential(access_key: dict, pool, limiter, timeout: float = DEFAULT_VERIFY_TIMEOUT,
+                        base_delay: float = DEFAULT_VERIFY_BASE_DELAY, max_delay: float = DEFAULT_VERIFY_MAX_DELAY):
+    """
+    Block until the new access key works, checking with backoff.
+
+    :return: Identity of the key. See 'check_credential'.
+    """
+    deadline = time.monotonic() + timeout
+    for attempt in itertools.count():
+        identity = check_credential(access_key, pool=pool, limiter=limiter)
+        if identity is not None:
+            return identity
+        delay = backoff_delay(attempt, base_delay=base_delay, max_delay=max_delay)
+        if time.monotonic() + delay > deadline:
+            raise Exception(f"Error, Access key {access_key['AccessKeyId']} isn't usable after {timeout} seconds.")
+        time.sleep(delay)
+
+
+class Job:
+    """
+    Rotation of one IAM User moving through the stages.
+    """
+
+    def __init__(self, user_name: str):
+        self.user_name = user_name
+        self.access_key = None
+        self.replaced = None
+        self.result = None
+        self.attempts = 0
+        self.verify_deadline = None
+        self.enqueued_at = 0.0
+
+
+class Stage:
+    """
+    Worker threads over a queue of jobs. A handler returns the next stage name, None when the job is done, or
+    seconds to wait before the job runs in this stage again. Waiting jobs hold no worker.
+    """
+
+    def __init__(self, name: str, handler, workers: int, pipeline):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.pipeline = pipeline
+        self.heap = []  # (ready_at monotonic, sequence, job)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.in_flight = 0
+        self.done = 0
+        self.failed = 0
+        self.requeued = 0
+        self.latency = Histogram()
+        self.wait = Histogram()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f'pipeline-{self.name}-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, job: Job, delay: float = 0.0):
+        with self.condition:
+            job.enqueued_at = time.perf_counter()
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.sequence), job))
+            self.condition.notify()
+        self.report()
+
+    def get(self):
+        """
+        :return: Next job that is ready, None once closed and empty.
+        """
+        with self.condition:
+            while True:
+                if self.heap:
+                    wait = self.heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        job = heapq.heappop(self.heap)[2]
+                        self.in_flight += 1
+                        return job
+                    self.condition.wait(wait)
+                elif self.closed:
+                    return None
+                else:
+                    self.condition.wait()
+
+    def work(self):
+        while True:
+            job = self.get()
+            if job is None:
+                return
+            self.report()
+            started = time.perf_counter()
+            outcome, error = None, None
+            try:
+                with tracer.span(f'pipeline.{self.name}', user=job.user_name):
+                    outcome = self.handler(job)
+            except Exception as e:
+                error = e
+            finished = time.perf_counter()
+            with self.condition:
+                self.in_flight -= 1
+                self.latency.observe(finished - started)
+                self.wait.observe(started - job.enqueued_at)
+                if error is not None:
+                    self.failed += 1
+                elif isinstance(outcome, (int, float)):
+                    self.requeued += 1
+                else:
+                    self.done += 1
+            if error is not None:
+                self.pipeline.finish(job, error=error)
+            elif isinstance(outcome, (int, float)):
+                self.put(job, delay=outcome)
+            elif outcome is None:
+                self.pipeline.finish(job)
+            else:
+                self.pipeline.stages[outcome].put(job)
+            self.report()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def report(self):
+        with self.condition:
+            depth, in_flight = len(self.heap), self.in_flight
+        tracer.gauge('pipeline.queue_depth', depth, stage=self.name)
+        tracer.gauge('pipeline.in_flight', in_flight, stage=self.name)
+
+    def metrics(self):
+        with self.condition:
+            return {
+                'Depth': len(self.heap),
+                'InFlight': self.in_flight,
+                'Done': self.done,
+                'Failed': self.failed,
+                'Requeued': self.requeued,
+                'LatencyMean': self.latency.sum / self.latency.count if self.latency.count else None,
+                'WaitMean': self.wait.sum / self.wait.count if self.wait.count else None,
+            }
+
+
+class RotationPipeline:
+    """
+    Rotation of many IAM Users as stages with their own worker queues.
+
+    create     : Read access keys, delete inactive keys and create the new key. (Planned as 'plan_rotation')
+    verify     : Call 'GetCallerIdentity' with the new key until IAM has propagated it, with backoff.
+                 A key that isn't ready goes back to the queue with a delay instead of holding a worker,
+                 so propagation waits of many users overlap. A key that fails or times out is deleted again,
+                 and the user keeps its replaced key.
+    deactivate : Make the replaced key Inactive, only after the new key is proven to work.
+    delete     : Delete the replaced key. Skipped with 'keep_inactive'.
+
+    Depth and in-flight jobs per stage are tracer gauges ('pipeline.queue_depth', 'pipeline.in_flight') and
+    latency per stage is the span 'pipeline.{stage}'.
+    """
+
+    def __init__(self, service, workers: dict = None, force: bool = False, keep_inactive: bool = False,
+                 verify_timeout: float = DEFAULT_VERIFY_TIMEOUT, verify_base_delay: float = DEFAULT_VERIFY_BASE_DELAY,
+                 verify_max_delay: float = DEFAULT_VERIFY_MAX_DELAY):
+        """
+        :param service: Service whose session rotates the users.
+        :param workers: Workers per stage. e.g. {'create': 4, 'verify': 4, 'deactivate': 4, 'delete': 4}
+        """
+        self.service = service
+        self.force = force
+        self.keep_inactive = keep_inactive
+        self.verify_timeout = verify_timeout
+        self.verify_base_delay = verify_base_delay
+        self.verify_max_delay = verify_max_delay
+        workers = dict(DEFAULT_STAGE_WORKERS, **(workers or {}))
+        if min(workers.values()) < 1:
+            raise ValueError("Error, workers of every stage must be 1 or more.")
+        self.stages = {
+            'create': Stage('create', self.create, workers['create'], self),
+            'verify': Stage('verify', self.verify, workers['verify'], self),
+            'deactivate': Stage('deactivate', self.deactivate, workers['deactivate'], self),
+            'delete': Stage('delete', self.delete, workers['delete'], self),
+        }
+        self.lock = threading.Lock()
+        self.pending = set()  # Users submitted and not finished, a user is never in the pipeline twice.
+        self.idle = threading.Condition(self.lock)
+        self.result = {'Rotated': {}, 'Skipped': [], 'Failed': {}}
+        self.started = False
+
+    def start(self):
+        for stage in self.stages.values():
+            stage.start()
+        self.started = True
+        return self
+
+    def submit(self, user_name: str):
+        """
+        :return: False if the user is already in the pipeline.
+        """
+        with self.lock:
+            if user_name in self.pending:
+                return False
+            self.pending.add(user_name)
+        self.stages['create'].put(Job(user_name))
+        return True
+
+    def finish(self, job: Job, error: Exception = None):
+        """
+        Put the outcome of a job into the result. A job that failed while its new key is Active is in 'Rotated'
+        with 'Error', since the secret of the key is only in its result.
+        """
+        with self.lock:
+            if error is not None:
+                if job.access_key is not None:
+                    self.result['Rotated'][job.user_name] = dict(job.result, Error=str(error))
+                else:
+                    self.result['Failed'][job.user_name] = str(error)
+                tracer.event('pipeline.failed', user=job.user_name, error=str(error))
+            elif job.access_key is None:
+                self.result['Skipped'].append(job.user_name)
+            else:
+                self.result['Rotated'][job.user_name] = job.result
+            self.pending.discard(job.user_name)
+            self.idle.notify_all()
+
+    def join(self, timeout: float = None):
+        """
+        Wait until every submitted user is finished.
+
+        :return: True if finished in time.
+        """
+        with self.lock:
+            return self.idle.wait_for(lambda: not self.pending, timeout=timeout)
+
+    def close(self):
+        for stage in self.stages.values():
+            stage.close()
+
+    def run(self, user_names):
+        """
+        Rotate the users and wait for all of them.
+
+        :return:
+        {
+            'Rotated': {'{IAM_USER_NAME}': {'AccessKey': {...}, 'Actions': [...], 'ApiCalls': 123}},
+            'Skipped': ['{IAM_USER_NAME}'],
+            'Failed': {'{IAM_USER_NAME}': 'error message'},
+            'Stages': metrics()
+        }
+        A user that failed while its new key is Active is in 'Rotated' with 'Error'. (See 'finish')
+        """
+        if not self.started:
+            self.start()
+        with tracer.span('pipeline.run') as span:
+            for user_name in user_names:
+                self.submit(user_name)
+            self.join()
+            self.close()
+            span.set(rotated=len(self.result['Rotated']), skipped=len(self.result['Skipped']),
+                     failed=len(self.result['Failed']))
+        return dict(self.result, Stages=self.metrics())
+
+    def metrics(self):
+        """
+        :return: {'{STAGE}': {'Depth', 'InFlight', 'Done', 'Failed', 'Requeued', 'LatencyMean', 'WaitMean'}}
+        """
+        return {name: stage.metrics() for name, stage in self.stages.items()}
+
+    def create(self, job: Job):
+        service = self.service
+        service.refresh_session()
+        with service.user_locks.hold(job.user_name):
+            snapshot = Snapshot.read(credential_handler=service.credential_handler, user_name=job.user_name,
+                                     fresh=True)
+            plan = plan_rotation(snapshot=snapshot, force=self.force, keep_inactive=True,
+                                 max_age_days=service.max_age_days)
+            if not plan.actions:
+                return None
+            head = [action for action in plan.actions if action[0] != Action.Deactivate]
+            job.replaced = next(access_key_id for action, access_key_id in plan.actions
+                                if action == Action.Deactivate)
+            job.result = Plan(user_name=job.user_name, actions=head).apply(
+                credential_handler=service.credential_handler)
+        for action in job.result['Actions']:
+            if action['Action'] == Action.Delete.value:
+                service.invalidate_credential(access_key_id=action['AccessKeyId'])
+        job.access_key = job.result['AccessKey']
+        job.verify_deadline = time.monotonic() + self.verify_timeout
+        return 'verify'
+
+    def verify(self, job: Job):
+        job.result['ApiCalls'] += 1
+        try:
+            identity = check_credential(job.access_key, pool=self.service.pool, limiter=self.service.limiter)
+        except Exception as e:
+            self.rollback(job, error=e)
+        if identity is not None:
+            self.service.identity_cache.put(job.access_key['AccessKeyId'], identity,
+                                            job.access_key['SecretAccessKey'])
+            self.service.pool.invalidate(access_key_id=job.access_key['AccessKeyId'])  # Its client isn't used again.
+            return 'deactivate'
+        delay = backoff_delay(job.attempts, base_delay=self.verify_base_delay, max_delay=self.verify_max_delay)
+        job.attempts += 1
+        if time.monotonic() + delay > job.verify_deadline:
+            self.rollback(job, error=Exception(f"Error, Access key {job.access_key['AccessKeyId']} isn't usable "
+                                               f"after {self.verify_timeout} seconds."))
+        return delay
+
+    def rollback(self, job: Job, error: Exception):
+        """
+        Delete the new key that failed verification, so it isn't left Active next to the replaced key, which is
+        still Active and in use. Always raises, with 'error' and the outcome of the rollback.
+        """
+        access_key_id = job.access_key['AccessKeyId']
+        try:
+            self.apply(job, Action.Delete, access_key_id=access_key_id)
+        except Exception as e:
+            raise Exception(f"{error} Deleting it failed, it is still Active. {e}") from error
+        job.access_key = None
+        tracer.event('pipeline.rolled_back', user=job.user_name, access_key_id=access_key_id, error=str(error))
+        raise Exception(f"{error} It was deleted, {job.replaced} is still Active.") from error
+
+    def deactivate(self, job: Job):
+        self.apply(job, Action.Deactivate)
+        return None if self.keep_inactive else 'delete'
+
+    def delete(self, job: Job):
+        self.apply(job, Action.Delete)
+        return None
+
+    def apply(self, job: Job, action: Action, access_key_id: str = None):
+        """
+        :param access_key_id: Access key to act on. The replaced key for None.
+        """
+        service = self.service
+        access_key_id = access_key_id or job.replaced
+        with service.user_locks.hold(job.user_name):
+            result = Plan(user_name=job.user_name, actions=[(action, access_key_id)]).apply(
+                credential_handler=service.credential_handler, read_calls=0)
+        service.invalidate_credential(access_key_id=access_key_id)
+        job.result['Actions'].extend(result['Actions'])
+        job.result['ApiCalls'] += result['ApiCalls']
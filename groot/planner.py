@@ -0,0 +1,160 @@
+from datetime import datetime, timezone
+from enum import Enum
+from credential import Credential, Status
+from tracing import tracer
+
+MAX_CREDENTIAL_AGE_DAYS = 75  # 생성한지 75일 지난 경우 credential 재발행.
+
+
+class Action(Enum):
+    Create = 'Create'
+    Deactivate = 'Deactivate'
+    Delete = 'Delete'
+
+
+class Snapshot:
+    """
+    Access keys of an IAM User, read once with a single 'list_access_keys' call.
+    Every decision of a rotation is made on this snapshot instead of listing again.
+    """
+    user_name: str
+    credentials: list
+
+    def __init__(self, user_name: str, credentials: list):
+        self.user_name = user_name
+        self.credentials = credentials
+
+    @classmethod
+    def read(cls, credential_handler: Credential, user_name: str, fresh: bool = False):
+        return cls(user_name=user_name,
+                   credentials=credential_handler.list(user_name=user_name, fresh=fresh)['AccessKeyMetadata'])
+
+    @property
+    def active(self):
+        """Active credentials, oldest first."""
+        return sorted((c for c in self.credentials if c['Status'] == Status.Active.value),
+                      key=lambda c: c['CreateDate'])
+
+    @property
+    def inactive(self):
+        return [c for c in self.credentials if c['Status'] == Status.Inactive.value]
+
+    def is_due(self, now: datetime = None, max_age_days: float = MAX_CREDENTIAL_AGE_DAYS):
+        """
+        Check the active credential is old enough to publish a new one.
+
+        :return: bool. True for need to publish a new credential, False for don't need to.
+        """
+        active = self.active
+        if len(self.credentials) == 0 or len(active) == 0:
+            raise Exception("Error, IAM user doesn't have any credential. "
+                            "It might IAM User name was wrong or All credentials are Inactive.")
+        if len(active) > 1:
+            raise Exception("Error, Can't determine which credential is correct.")
+        duration = (now or datetime.now(timezone.utc)) - active[0]['CreateDate']
+        return duration.days >= max_age_days
+
+
+class ApplyError(Exception):
+    """
+    A rotation failed after creating a key that is still Active. 'result' is the partial result of 'Plan.apply'
+    with the created 'AccessKey', since its secret can't be read again.
+    """
+
+    def __init__(self, message: str, result: dict):
+        super().__init__(message)
+        self.result = result
+
+
+class Plan:
+    """
+    Ordered create/deactivate/delete actions of a rotation. Inactive credentials are deleted before creation
+    so that the 2 credentials limit of IAM User is never hit, and the replaced credential is removed last.
+    """
+    user_name: str
+    actions: list
+
+    def __init__(self, user_name: str, actions: list):
+        self.user_name = user_name
+        self.actions = actions
+
+    def apply(self, credential_handler: Credential, read_calls: int = 1):
+        """
+        Apply actions in order.
+
+        :param credential_handler: Credential handler to call IAM with.
+        :param read_calls: API calls already used to read the snapshot.
+        :return:
+        {
+            'UserName': 'string',
+            'AccessKey': {...} | None,
+            'Actions': [{'Action': 'Create'|'Deactivate'|'Delete', 'AccessKeyId': 'string'}],
+            'ApiCalls': 123
+        }
+        :raise ApplyError: An action after 'Create' failed and deleting the created key failed too. When the created
+                           key is deleted, a plain Exception is raised.
+        """
+        result = {'UserName': self.user_name, 'AccessKey': None, 'Actions': [], 'ApiCalls': read_calls}
+        for action, access_key_id in self.actions:
+            try:
+                if action == Action.Create:
+                    result['AccessKey'] = credential_handler.create(user_name=self.user_name)['AccessKey']
+                    access_key_id = result['AccessKey']['AccessKeyId']
+                elif action == Action.Deactivate:
+                    if not credential_handler.make_inactive(user_name=self.user_name, access_key_id=access_key_id):
+                        raise Exception(f"Error, Can't make credential Inactive. AccessKeyId : {access_key_id}")
+                else:
+                    credential_handler.delete(user_name=self.user_name, access_key_id=access_key_id)
+            except Exception as e:
+                if result['AccessKey'] is None:
+                    raise
+                raise self.roll_back(credential_handler, result, error=e) from e
+            result['ApiCalls'] += 1
+            result['Actions'].append({'Action': action.value, 'AccessKeyId': access_key_id})
+        tracer.event('plan.applied', user=self.user_name, actions=[a['Action'] for a in result['Actions']],
+                     api_calls=result['ApiCalls'])
+        return result
+
+    def roll_back(self, credential_handler: Credential, result: dict, error: Exception):
+        """
+        Delete the key created by 'apply' after a later action failed, so the user isn't left with two Active keys.
+
+        :return: Exception to raise. ApplyError with the partial result if the created key is still Active.
+        """
+        access_key_id = result['AccessKey']['AccessKeyId']
+        try:
+            credential_handler.delete(user_name=self.user_name, access_key_id=access_key_id)
+        except Exception as e:
+            return ApplyError(f"{error} Deleting the new credential {access_key_id} failed, it is still Active. {e}",
+                              result=result)
+        result['ApiCalls'] += 1
+        result['Actions'].append({'Action': Action.Delete.value, 'AccessKeyId': access_key_id})
+        tracer.event('plan.rolled_back', user=self.user_name, access_key_id=access_key_id, error=str(error))
+        return Exception(f"{error} The new credential {access_key_id} was deleted.")
+
+
+def plan_rotation(snapshot: Snapshot, force: bool = False, keep_inactive: bool = False, now: datetime = None,
+                  max_age_days: float = MAX_CREDENTIAL_AGE_DAYS):
+    """
+    Compute the minimal actions to rotate the credential of IAM User.
+
+    :param snapshot: Access keys of IAM User.
+    :param force: True for publish regardless of the credential age.
+    :param keep_inactive: True for leave the replaced credential as Inactive instead of deleting it.
+    :param now: Time to evaluate the credential age at. Current time for None.
+    :param max_age_days: Publish a new credential when the active one is this old.
+    :return: Plan. Empty when IAM User don't need to publish a new credential.
+    """
+    if force:
+        if len(snapshot.active) == 0:
+            raise Exception("Error, IAM user doesn't have any active credential.")
+        if len(snapshot.active) > 1:
+            raise Exception("Error, Can't determine which credential is correct.")
+    elif not snapshot.is_due(now=now, max_age_days=max_age_days):
+        return Plan(user_name=snapshot.user_name, actions=[])
+
+    actions = [(Action.Delete, c['AccessKeyId']) for c in snapshot.inactive]
+    actions.append((Action.Create, None))
+    replaced = snapshot.active[0]['AccessKeyId']
+    actions.append((Action.Deactivate if keep_inactive else Action.Delete, replaced))
+    return Plan(user_name=snapshot.user_name, actions=actions)
@@ -0,0 +1,181 @@
+from datetime import datetime, timezone
+import numpy as np
+from planner import MAX_CREDENTIAL_AGE_DAYS
+from report import KeyReport
+
+DAY = 86400.0
+
+
+class RotationPolicy:
+    """
+    Rotation rules. Every rule is in days, None for disabled.
+
+    max_age_days : Rotate an active key older than this.
+    warn_age_days : Warn an active key older than this but not yet 'max_age_days'.
+    unused_days : Deactivate an active key not used for this long. (Creation date for never used key)
+    inactive_grace_days : Delete an inactive key not used for this long. IAM doesn't tell when a key was
+                          deactivated, so the last used date (creation date for never used key) stands in for it.
+    path_overrides : Rules per IAM path prefix. e.g. {'/service/': {'max_age_days': 30}}
+                     The longest matching prefix wins, rules not in the override come from the default.
+    """
+    rules = ('max_age_days', 'warn_age_days', 'unused_days', 'inactive_grace_days')
+
+    def __init__(self, max_age_days: float = MAX_CREDENTIAL_AGE_DAYS, warn_age_days: float = None,
+                 unused_days: float = None, inactive_grace_days: float = None, path_overrides: dict = None):
+        self.max_age_days = max_age_days
+        self.warn_age_days = warn_age_days
+        self.unused_days = unused_days
+        self.inactive_grace_days = inactive_grace_days
+        self.path_overrides = path_overrides or {}
+        for overrides in self.path_overrides.values():
+            unknown = set(overrides) - set(self.rules)
+            if unknown:
+                raise ValueError(f"Error, Unknown rules {sorted(unknown)}. Available : {list(self.rules)}")
+
+    def for_path(self, path: str):
+        """
+        :return: {rule: days} for IAM path. Disabled rule is inf.
+        """
+        rules = {rule: getattr(self, rule) for rule in self.rules}
+        for prefix in sorted(self.path_overrides, key=len):
+            if path.startswith(prefix):
+                rules.update(self.path_overrides[prefix])
+        return {rule: np.inf if days is None else float(days) for rule, days in rules.items()}
+
+
+class KeyTable:
+    """
+    Access key metadata of a fleet as columns. One row per access key.
+
+    user_names, paths, access_key_ids : str arrays. access_key_id is '{user}#{slot}' when it comes from
+                                        credential report, which doesn't have access key ids.
+    path_codes, path_names : paths as codes into distinct path names, so rules are resolved per distinct path.
+    active : bool array.
+    created, last_used : float64 POSIX timestamps. last_used is NaN for never used key.
+    """
+
+    def __init__(self, user_names, paths, access_key_ids, active, created, last_used):
+        self.user_names = np.asarray(user_names, dtype=object)
+        self.paths = np.asarray(paths, dtype=object)
+        names = {}
+        self.path_codes = np.fromiter((names.setdefault(path, len(names)) for path in self.paths),
+                                      dtype=np.intp, count=len(self.paths))
+        self.path_names = list(names)
+        self.access_key_ids = np.asarray(access_key_ids, dtype=object)
+        self.active = np.asarray(active, dtype=bool)
+        self.created = np.asarray(created, dtype=np.float64)
+        self.last_used = np.asarray(last_used, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.access_key_ids)
+
+    @classmethod
+    def from_metadata(cls, keys: list):
+        """
+        :param keys: 'AccessKeyMetadata' items of ListAccessKeys. Optional 'Path' and 'LastUsedDate' per item.
+        """
+        return cls(
+            user_names=[k['UserName'] for k in keys],
+            paths=[k.get('Path', '/') for k in keys],
+            access_key_ids=[k['AccessKeyId'] for k in keys],
+            active=[k['Status'] == 'Active' for k in keys],
+            created=[k['CreateDate'].timestamp() for k in keys],
+            last_used=[k['LastUsedDate'].timestamp() if k.get('LastUsedDate') else np.nan for k in keys]
+        )
+
+    @classmethod
+    def from_report(cls, report: KeyReport, paths: dict = None):
+        """
+        :param report: Credential report. Slots without a key (no rotation date) are left out.
+        :param paths: {user_name: IAM path}. Users not in it are left out. All users with path '/' for None.
+        """
+        user_names = np.asarray(report.users, dtype=object)
+        if paths is None:
+            user_paths = np.full(len(user_names), '/', dtype=object)
+            listed = np.ones(len(user_names), dtype=bool)
+        else:
+            user_paths = np.asarray([paths.get(u, '') for u in report.users], dtype=object)
+            listed = np.asarray([u in paths for u in report.users], dtype=bool)
+        columns = []
+        for slot, active, rotated, used in ((1, report.key1_active, report.key1_last_rotated, report.key1_last_used),
+                                            (2, report.key2_active, report.key2_last_rotated, report.key2_last_used)):
+            rotated = np.frombuffer(rotated, dtype=np.float64)
+            exists = ~np.isnan(rotated) & listed
+            columns.append((
+                user_names[exists],
+                user_paths[exists],
+                np.char.add(user_names[exists].astype(str), f'#{slot}').astype(object),
+                np.frombuffer(active, dtype=np.uint8)[exists].astype(bool),
+                rotated[exists],
+                np.frombuffer(used, dtype=np.float64)[exists]
+            ))
+        return cls(*(np.concatenate(parts) for parts in zip(*columns)))
+
+
+class PolicyResult:
+    """
+    Row indexes of KeyTable per decision. 'keys' turns them into (user_name, access_key_id) sets.
+    """
+    decisions = ('Rotate', 'Warn', 'Deactivate', 'Delete')
+
+    def __init__(self, table: KeyTable, rotate, warn, deactivate, delete):
+        self.table = table
+        self.indexes = {'Rotate': rotate, 'Warn': warn, 'Deactivate': deactivate, 'Delete': delete}
+
+    def keys(self, decision: str):
+        index = self.indexes[decision]
+        return set(zip(self.table.user_names[index], self.table.access_key_ids[index]))
+
+    def counts(self):
+        return {decision: len(index) for decision, index in self.indexes.items()}
+
+    def as_dict(self):
+        """
+        :return: {'Rotate': {(user_name, access_key_id)}, 'Warn': {...}, 'Deactivate': {...}, 'Delete': {...}}
+        """
+        return {decision: self.keys(decision) for decision in self.decisions}
+
+
+class PolicyEngine:
+    """
+    Evaluate RotationPolicy over a whole KeyTable in one vectorized pass.
+
+    An active key unused for 'unused_days' is deactivated rather than rotated. An active key older than
+    'max_age_days' is rotated, and one older than 'warn_age_days' but younger than 'max_age_days' is warned.
+    An inactive key idle for 'inactive_grace_days' is deleted.
+    """
+
+    def __init__(self, policy: RotationPolicy = None):
+        self.policy = policy or RotationPolicy()
+
+    def thresholds(self, table: KeyTable):
+        """
+        :return: {rule: float64 array of seconds per row}. Rules are resolved once per distinct path.
+        """
+        per_path = [self.policy.for_path(path) for path in table.path_names]
+        return {
+            rule: np.asarray([rules[rule] for rules in per_path], dtype=np.float64)[table.path_codes] * DAY
+            for rule in RotationPolicy.rules
+        }
+
+    def evaluate(self, table: KeyTable, now: datetime = None):
+        """
+        :return: PolicyResult
+        """
+        now_ts = (now or datetime.now(timezone.utc)).timestamp()
+        limits = self.thresholds(table)
+        age = now_ts - table.created
+        idle = now_ts - np.where(np.isnan(table.last_used), table.created, table.last_used)
+        active = table.active
+
+        deactivate = active & (idle >= limits['unused_days'])
+        rotate = active & ~deactivate & (age >= limits['max_age_days'])
+        warn = active & ~deactivate & ~rotate & (age >= limits['warn_age_days'])
+        delete = ~active & (idle >= limits['inactive_grace_days'])
+        return PolicyResult(
+            table=table,
+            rotate=np.flatnonzero(rotate),
+            warn=np.flatnonzero(warn),
+            deactivate=np.flatnonzero(deactivate),
+            delete=np.flatnonzero(delete)
+        )
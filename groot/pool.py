@@ -0,0 +1,117 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+import threading
+import time
+from tracing import tracer
+
+if TYPE_CHECKING:
+    import boto3
+    import botocore.client
+
+DEFAULT_MAX_SIZE = 64
+DEFAULT_TTL_SECONDS = 3600
+
+
+class ClientPool:
+    """
+    Process-wide pool of AWS clients keyed by (access key id, service, region).
+
+    Every client is created from one base session, so endpoint and service models are loaded once per process.
+    Clients are thread-safe and shared, the lock only guards the pool itself and client creation.
+    Least recently used clients are evicted over 'max_size', and clients older than 'ttl' are created again.
+    """
+    session: boto3.Session
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.session = None
+        self.clients = OrderedDict()  # (access_key_id, service_name, region_name) -> (client, secret, created_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def client(self, service_name: str, access_key_id: str = None, secret_access_key: str = None,
+               session_token: str = None, region_name: str = None) -> botocore.client:
+        """
+        Check out a client from the pool. Create it if there isn't a live one.
+
+        :param service_name: AWS service name. e.g. 'iam', 'sts', 'kms'
+        :param access_key_id: Access key id. None for default credential chain. (e.g. Lambda execution role)
+        :param secret_access_key: Secret access key of 'access_key_id'.
+        :param session_token: Session token for temporary credential.
+        :param region_name: AWS region name. None for default region.
+        :return: botocore client
+        """
+        key = (access_key_id, service_name, region_name)
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is not None and entry[1] == secret_access_key and time.monotonic() - entry[2] < self.ttl:
+                self.clients.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            if self.session is None:
+                import boto3  # Deferred, so importing groot doesn't pay for boto3 until the first client.
+                self.session = boto3.session.Session()
+            client = self.session.client(
+                service_name,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+                aws_session_token=session_token,
+                region_name=region_name
+            )
+            tracer.instrument(client)
+            self.clients[key] = (client, secret_access_key, time.monotonic())
+            self.clients.move_to_end(key)
+            while len(self.clients) > self.max_size:
+                self.clients.popitem(last=False)
+            return client
+
+    def invalidate(self, access_key_id: str):
+        """
+        Remove every client of the access key id. Call it when the credential is deactivated or deleted.
+
+        :param access_key_id: Access key id.
+        :return: Number of removed clients.
+        """
+        with self.lock:
+            keys = [key for key in self.clients if key[0] == access_key_id]
+            for key in keys:
+                del self.clients[key]
+        if keys:
+            tracer.event('pool.invalidate', access_key_id=access_key_id, clients=len(keys))
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+
+
+default_pool = ClientPool()
+
+
+class PooledSession:
+    """
+    Stand-in for boto3.Session in handlers. 'client' checks out clients of the credential from the pool.
+    """
+    pool: ClientPool
+
+    def __init__(self, access_key_id: str = None, secret_access_key: str = None, session_token: str = None,
+                 region_name: str = None, pool: ClientPool = None):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.session_token = session_token
+        self.region_name = region_name
+        self.pool = pool or default_pool
+
+    def client(self, service_name: str) -> botocore.client:
+        return self.pool.client(
+            service_name,
+            access_key_id=self.access_key_id,
+            secret_access_key=self.secret_access_key,
+            session_token=self.session_token,
+            region_name=self.region_name
+        )
@@ -0,0 +1,147 @@
+from __future__ import annotations
+from array import array
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+import csv
+import io
+import math
+import time
+from throttle import RateLimiter, default_limiter
+from tracing import tracer
+
+if TYPE_CHECKING:  # boto3 is imported on first client creation. (groot/pool.py)
+    import boto3
+    import botocore.client
+
+ROOT_ACCOUNT = '<root_account>'
+NOT_AVAILABLE = math.nan
+
+
+def parse_time(value: str):
+    """
+    :return: POSIX timestamp. NaN for 'N/A', 'no_information', 'not_supported' and so on.
+    """
+    if not value or not value[0].isdigit():
+        return NOT_AVAILABLE
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class KeyReport:
+    """
+    Access key columns of IAM credential report. One row per IAM User, root account excluded.
+
+    Flags are bytearray, times are array('d') of POSIX timestamps with NaN for not available,
+    so a report of thousands of users is a few flat buffers instead of a dict per user.
+    """
+
+    def __init__(self, generated_at: float = NOT_AVAILABLE):
+        self.generated_at = generated_at
+        self.users = []
+        self.index = {}
+        self.key1_active = bytearray()
+        self.key1_last_rotated = array('d')
+        self.key1_last_used = array('d')
+        self.key2_active = bytearray()
+        self.key2_last_rotated = array('d')
+        self.key2_last_used = array('d')
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_name: str):
+        return user_name in self.index
+
+    @classmethod
+    def parse(cls, content: bytes, generated_at: float = NOT_AVAILABLE):
+        """
+        Read the CSV row by row into columns.
+
+        :param content: 'Content' of GetCredentialReport.
+        :param generated_at: POSIX timestamp of the report.
+        """
+        report = cls(generated_at=generated_at)
+        reader = csv.reader(io.StringIO(content.decode('utf-8')))
+        header = next(reader)
+        column = {name: i for i, name in enumerate(header)}
+        user = column['user']
+        key1_active, key1_rotated, key1_used = (column['access_key_1_active'], column['access_key_1_last_rotated'],
+                                                column['access_key_1_last_used_date'])
+        key2_active, key2_rotated, key2_used = (column['access_key_2_active'], column['access_key_2_last_rotated'],
+                                                column['access_key_2_last_used_date'])
+        for row in reader:
+            if not row or row[user] == ROOT_ACCOUNT:
+                continue
+            report.index[row[user]] = len(report.users)
+            report.users.append(row[user])
+            report.key1_active.append(row[key1_active] == 'true')
+            report.key1_last_rotated.append(parse_time(row[key1_rotated]))
+            report.key1_last_used.append(parse_time(row[key1_used]))
+            report.key2_active.append(row[key2_active] == 'true')
+            report.key2_last_rotated.append(parse_time(row[key2_rotated]))
+            report.key2_last_used.append(parse_time(row[key2_used]))
+        return report
+
+    def needs_check(self, user_name: str, max_age_days: int, now: datetime = None):
+        """
+        Check if the report can't prove IAM User has a single active credential younger than 'max_age_days'.
+        Users not in the report (e.g. created after the report) need a check too.
+
+        :return: bool. False for sure not to publish a new credential, True for check with 'ListAccessKeys'.
+        """
+        if user_name not in self.index:
+            return True
+        now_ts = (now or datetime.now(timezone.utc)).timestamp()
+        return self.row_needs_check(self.index[user_name], now_ts, max_age_days * 86400)
+
+    def row_needs_check(self, i: int, now_ts: float, max_age: float):
+        if self.key1_active[i] + self.key2_active[i] != 1:
+            return True
+        rotated = self.key1_last_rotated[i] if self.key1_active[i] else self.key2_last_rotated[i]
+        return not now_ts - rotated < max_age  # NaN comparison is always False, so a missing date needs check.
+
+    def users_need_check(self, max_age_days: int, now: datetime = None):
+        """
+        :return: list of IAM User names that 'needs_check'.
+        """
+        now_ts = (now or datetime.now(timezone.utc)).timestamp()
+        max_age = max_age_days * 86400
+        return [user_name for i, user_name in enumerate(self.users) if self.row_needs_check(i, now_ts, max_age)]
+
+
+class CredentialReport:
+    session: boto3.Session
+    client: botocore.client
+    limiter: RateLimiter
+
+    def __init__(self, session: boto3.Session, limiter: RateLimiter = None):
+        self.client = session.client('iam')
+        self.limiter = limiter or default_limiter
+
+    def generate(self, poll_interval: float = 2, timeout: float = 120):
+        """
+        Request IAM to generate credential report, then poll until it is complete.
+        IAM reuses a report younger than 4 hours, so this returns immediately in that case.
+
+        :return: None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self.limiter.call('GenerateCredentialReport', self.client.generate_credential_report)['State']
+            if state == 'COMPLETE':
+                return
+            if time.monotonic() >= deadline:
+                raise Exception(f"Error, Credential report is not complete in {timeout} seconds. State : {state}")
+            time.sleep(poll_interval)
+
+    def get(self, poll_interval: float = 2, timeout: float = 120):
+        """
+        Generate and read credential report.
+
+        :return: KeyReport
+        """
+        with tracer.span('report.credential') as span:
+            self.generate(poll_interval=poll_interval, timeout=timeout)
+            response = self.limiter.call('GetCredentialReport', self.client.get_credential_report)
+            report = KeyReport.parse(response['Content'], generated_at=response['GeneratedTime'].timestamp())
+            span.set(users=len(report), generated_time=response['GeneratedTime'])
+        return report
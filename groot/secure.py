@@ -1,16 +1,124 @@
-import boto3
-import botocore.client
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+import os
+import threading
+import time
+from coalesce import SingleFlight
+
+if TYPE_CHECKING:  # boto3 is imported on first client creation. (groot/pool.py)
+    import boto3
+    import botocore.client
+
+# Envelope : MAGIC | VERSION | len(encrypted data key) (2 bytes) | encrypted data key | nonce | AES-GCM ciphertext
+# KMS ciphertext blob never starts with '\x00', so envelope and KMS ciphertext are told apart by MAGIC.
+ENVELOPE_MAGIC = b'\x00GRT'
+ENVELOPE_VERSION = 1
+NONCE_SIZE = 12
+TAG_SIZE = 16
+DATA_KEY_SPEC = 'AES_256'
+
+
+class DataKeyCache:
+    """
+    Cache of KMS data keys, like the caching materials manager of AWS Encryption SDK.
+
+    A data key for encryption is reused until it gets older than 'max_age' seconds, or encrypts more than
+    'max_messages' messages or 'max_bytes' bytes. Then a new data key is generated with KMS.
+    Decrypted data keys are kept up to 'max_age' seconds too, at most 'max_entries' keys.
+
+    KMS is called outside the lock, so a cache hit never waits for it. Threads missing the same key at once share
+    one call. (single flight)
+    """
+
+    def __init__(self, max_age: float = 300, max_messages: int = 10000, max_bytes: int = 2 ** 30,
+                 max_entries: int = 256):
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.encryption_keys = {}  # key_id -> [plaintext, ciphertext, created_at, messages, bytes]
+        self.decryption_keys = OrderedDict()  # ciphertext -> (plaintext, created_at)
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.kms_calls = 0
+
+    def encryption_key(self, key_id: str, size: int, generate):
+        """
+        Get a data key to encrypt 'size' bytes with.
+
+        :param key_id: KMS key id or alias.
+        :param size: Plaintext size in bytes.
+        :param generate: Function of key_id that returns (plaintext data key, encrypted data key).
+        :return: (plaintext data key, encrypted data key)
+        """
+        while True:
+            with self.lock:
+                entry = self.encryption_keys.get(key_id)
+                # A new key encrypts at least one message, even one larger than 'max_bytes'.
+                if entry is not None and (entry[3] == 0 or time.monotonic() - entry[2] < self.max_age
+                                          and entry[3] + 1 <= self.max_messages
+                                          and entry[4] + size <= self.max_bytes):
+                    entry[3] += 1
+                    entry[4] += size
+                    return entry[0], entry[1]
+            self.flight.do(('encryption', key_id), lambda: self.load_encryption_key(key_id, generate))
+
+    def load_encryption_key(self, key_id: str, generate):
+        plaintext, ciphertext = generate(key_id)
+        with self.lock:
+            self.kms_calls += 1
+            self.encryption_keys[key_id] = [plaintext, ciphertext, time.monotonic(), 0, 0]
+
+    def decryption_key(self, ciphertext: bytes, decrypt):
+        """
+        Get the plaintext of an encrypted data key.
+
+        :param ciphertext: Encrypted data key.
+        :param decrypt: Function of ciphertext that returns plaintext data key.
+        :return: plaintext data key
+        """
+        with self.lock:
+            entry = self.decryption_keys.get(ciphertext)
+            if entry is not None and time.monotonic() - entry[1] < self.max_age:
+                self.decryption_keys.move_to_end(ciphertext)
+                return entry[0]
+        return self.flight.do(('decryption', ciphertext), lambda: self.load_decryption_key(ciphertext, decrypt))
+
+    def load_decryption_key(self, ciphertext: bytes, decrypt):
+        plaintext = decrypt(ciphertext)
+        with self.lock:
+            self.kms_calls += 1
+            self.decryption_keys[ciphertext] = (plaintext, time.monotonic())
+            while len(self.decryption_keys) > self.max_entries:
+                self.decryption_keys.popitem(last=False)
+        return plaintext
+
+    def clear(self):
+        with self.lock:
+            self.encryption_keys.clear()
+            self.decryption_keys.clear()
+
+
+def aes_gcm(data_key: bytes):
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise Exception("Error, Envelope encryption requires 'cryptography' package. pip install cryptography")
+    return AESGCM(data_key)
 
 
 class Secure:
     session: boto3.Session
     client: botocore.client
+    cache: DataKeyCache
 
-    def __init__(self, session: boto3.session):
+    def __init__(self, session: boto3.session, cache: DataKeyCache = None):
         self.client = session.client('kms')
+        self.cache = cache or DataKeyCache()
 
     def encrypt(self, plain_txt: str, key_id: str):
-        return self.client.encryt(
+        return self.client.encrypt(
             KeyId=key_id,
             Plaintext=plain_txt
         )['CiphertextBlob']
@@ -20,3 +128,58 @@ class Secure:
             KeyId=key_id,
             CiphertextBlob=cipher_txt
         )['Plaintext'].decode()
+
+    def generate_data_key(self, key_id: str):
+        data_key = self.client.generate_data_key(KeyId=key_id, KeySpec=DATA_KEY_SPEC)
+        return data_key['Plaintext'], data_key['CiphertextBlob']
+
+    def decrypt_data_key(self, key_id: str, encrypted_data_key: bytes):
+        return self.client.decrypt(KeyId=key_id, CiphertextBlob=encrypted_data_key)['Plaintext']
+
+    def encrypt_envelope(self, plain_txt: str, key_id: str):
+        """
+        Encrypt locally with AES-GCM using a cached KMS data key. No size limit of KMS Encrypt (4 KB),
+        and KMS is called only when the cached data key expires.
+
+        :param plain_txt: Plain text.
+        :param key_id: KMS key id or alias.
+        :return: Envelope bytes.
+        """
+        data = plain_txt.encode()
+        data_key, encrypted_data_key = self.cache.encryption_key(key_id, len(data), self.generate_data_key)
+        header = ENVELOPE_MAGIC + bytes([ENVELOPE_VERSION]) + len(encrypted_data_key).to_bytes(2, 'big') \
+            + encrypted_data_key
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + aes_gcm(data_key).encrypt(nonce, data, header)
+
+    def decrypt_envelope(self, cipher_txt: bytes, key_id: str):
+        """
+        Decrypt envelope from 'encrypt_envelope'. Plain KMS ciphertext is decrypted with KMS as 'decrypt' does.
+
+        :param cipher_txt: Envelope bytes or KMS ciphertext blob.
+        :param key_id: KMS key id or alias.
+        :return: Plain text.
+        """
+        if not cipher_txt.startswith(ENVELOPE_MAGIC):
+            return self.decrypt(cipher_txt, key_id)
+        offset = len(ENVELOPE_MAGIC)
+        if len(cipher_txt) < offset + 3:
+            raise Exception("Error, Envelope is truncated.")
+        if cipher_txt[offset] != ENVELOPE_VERSION:
+            raise Exception(f"Error, Unknown envelope version {cipher_txt[offset]}.")
+        key_size = int.from_bytes(cipher_txt[offset + 1:offset + 3], 'big')
+        header_size = offset + 3 + key_size
+        if key_size == 0 or len(cipher_txt) < header_size + NONCE_SIZE + TAG_SIZE:
+            raise Exception("Error, Envelope is truncated.")
+        header = cipher_txt[:header_size]
+        data_key = self.cache.decryption_key(
+            header[offset + 3:],
+            lambda encrypted_data_key: self.decrypt_data_key(key_id, encrypted_data_key)
+        )
+        nonce = cipher_txt[header_size:header_size + NONCE_SIZE]
+        cipher = aes_gcm(data_key)
+        from cryptography.exceptions import InvalidTag
+        try:
+            return cipher.decrypt(nonce, cipher_txt[header_size + NONCE_SIZE:], header).decode()
+        except InvalidTag:
+            raise Exception("Error, Envelope is corrupted or wasn't encrypted with the data key.") from None
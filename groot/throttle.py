@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+from tracing import tracer
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'SlowDown',
+}
+DEFAULT_RATE = 10.0  # requests per second per API
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.2
+DEFAULT_MAX_DELAY = 10.0
+
+
+def is_throttling(error: Exception):
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Token bucket with adaptive rate. The rate is halved on throttling and raised by 'max_rate / 20' on success,
+    between 'min_rate' and 'max_rate'. (Additive increase, multiplicative decrease)
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = DEFAULT_MIN_RATE, burst: float = None):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = burst or max(max_rate, 1.0)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def acquire(self):
+        """
+        Take a token. Block until the token is available. A token is reserved before sleeping, so waiting threads
+        are released in order at the current rate.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.calls += 1
+        if wait > 0:
+            time.sleep(wait)
+
+    def decrease(self, retry: bool = False):
+        """
+        :param retry: True if the throttled call is retried.
+        """
+        with self.lock:
+            self.throttled += 1
+            if retry:
+                self.retries += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def increase(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """
+    Shared rate limiter of AWS API calls. Each API has its own token bucket, so a throttled API doesn't slow
+    the others. Throttling errors are retried with exponential backoff and full jitter.
+    A success that needed botocore retries ('RetryAttempts' > 0) also counts as a throttle signal.
+    """
+
+    def __init__(self, default_rate: float = DEFAULT_RATE, rates: dict = None, min_rate: float = DEFAULT_MIN_RATE,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        :param default_rate: Maximum requests per second of an API without its own rate.
+        :param rates: Maximum requests per second per API. e.g. {'CreateAccessKey': 5, 'ListAccessKeys': 20}
+        :param min_rate: Rate never goes below this on throttling.
+        :param max_attempts: Attempts of a call including the first one.
+        :param base_delay: First backoff in seconds. Doubled per attempt up to 'max_delay'.
+        """
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.min_rate = min_rate
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, api_name: str):
+        bucket = self.buckets.get(api_name)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(api_name)
+                if bucket is None:
+                    bucket = TokenBucket(max_rate=self.rates.get(api_name, self.default_rate), min_rate=self.min_rate)
+                    self.buckets[api_name] = bucket
+        return bucket
+
+    def call(self, api_name: str, func, **kwargs):
+        """
+        Call AWS API under the rate limit.
+
+        :param api_name: API name. e.g. 'CreateAccessKey'
+        :param func: Client method of the API.
+        :param kwargs: Parameters of the API.
+        :return: Response of the API.
+        """
+        bucket = self.bucket(api_name)
+        for attempt in range(1, self.max_attempts + 1):
+            bucket.acquire()
+            try:
+                response = func(**kwargs)
+            except Exception as e:
+                if not is_throttling(e):
+                    raise
+                if attempt == self.max_attempts:  # Still a throttle signal, even with no retry left.
+                    bucket.decrease()
+                    tracer.event('limiter.gave_up', api=api_name, attempt=attempt, rate=round(bucket.rate, 2))
+                    raise
+                bucket.decrease(retry=True)
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                tracer.event('limiter.throttled', api=api_name, attempt=attempt, rate=round(bucket.rate, 2),
+                             retry_in=round(delay, 2))
+                time.sleep(delay)
+                continue
+            if isinstance(response, dict) and response.get('ResponseMetadata', {}).get('RetryAttempts', 0) > 0:
+                bucket.decrease()
+            else:
+                bucket.increase()
+            return response
+
+    def metrics(self):
+        """
+        :return:
+        {
+            '{API_NAME}': {'Rate': effective requests per second, 'MaxRate': 10.0,
+                           'Calls': 123, 'Retries': 123, 'Throttled': 123}
+        }
+        """
+        return {
+            api_name: {
+                'Rate': bucket.rate,
+                'MaxRate': bucket.max_rate,
+                'Calls': bucket.calls,
+                'Retries': bucket.retries,
+                'Throttled': bucket.throttled
+            }
+            for api_name, bucket in list(self.buckets.items())
+        }
+
+
+default_limiter = RateLimiter()
@@ -0,0 +1,255 @@
+from bisect import bisect_left
+from datetime import datetime, timezone
+import json
+import os
+import sys
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Cumulative latency histogram in seconds, with Prometheus 'le' buckets.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """
+    Timed operation. Written to the sink with duration and outcome when it ends.
+    """
+    __slots__ = ('tracer', 'name', 'attrs', 'started')
+
+    def __init__(self, tracer, name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attrs['error'] = str(exc)
+        self.tracer.finish(self.name, time.perf_counter() - self.started,
+                           outcome='error' if exc is not None else self.attrs.pop('outcome', 'ok'),
+                           retries=self.attrs.pop('retries', 0), attrs=self.attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class NoopSpan:
+    """
+    Span of disabled tracer. Does nothing, so disabled tracing costs a flag check per operation.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer:
+    """
+    Structured events, spans per operation and per AWS API call, latency histograms, call counters and gauges.
+
+    Events and spans are written to 'sink' as JSON lines, and to every file-like object of 'exporters'
+    (e.g. a log shipper). Metrics are exported with 'metrics_jsonl' or 'prometheus'.
+    Enabled unless environment variable GROOT_TRACE is '0'.
+    """
+
+    def __init__(self, enabled: bool = None, sink=None):
+        self.enabled = os.environ.get('GROOT_TRACE', '1') != '0' if enabled is None else enabled
+        self.sink = sink
+        self.exporters = []
+        self.lock = threading.Lock()
+        self.histograms = {}  # span name -> Histogram
+        self.counters = {}  # (span name, outcome) -> count
+        self.retries = {}  # span name -> count
+        self.gauges = {}  # (gauge name, ((label, value), ...)) -> value
+
+    def span(self, name: str, **attrs):
+        """
+        :param name: Operation name. e.g. 'service.rotate_credential', 'aws.iam.CreateAccessKey'
+        :param attrs: Attributes of the span. e.g. user='...'
+        :return: Context manager. 'set(outcome=..., retries=..., key=value)' adds attributes before it ends.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def event(self, name: str, **attrs):
+        if not self.enabled:
+            return
+        self.emit({'time': datetime.now(timezone.utc).isoformat(), 'event': name, **attrs})
+
+    def finish(self, name: str, duration: float, outcome: str = 'ok', retries: int = 0, attrs: dict = None):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(duration)
+            self.counters[(name, outcome)] = self.counters.get((name, outcome), 0) + 1
+            if retries:
+                self.retries[name] = self.retries.get(name, 0) + retries
+        self.emit({
+            'time': datetime.now(timezone.utc).isoformat(),
+            'span': name,
+            'duration_ms': round(duration * 1000, 3),
+            'outcome': outcome,
+            'retries': retries,
+            **(attrs or {})
+        })
+
+    def gauge(self, name: str, value: float, **labels):
+        """
+        Set the current value of a gauge. e.g. gauge('pipeline.queue_depth', 3, stage='verify')
+        Gauges are only kept for export, nothing is written to the sink.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def emit(self, record: dict):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            (self.sink or sys.stdout).write(line)
+            exporters = list(self.exporters)
+        for exporter in exporters:
+            exporter.write(line)
+
+    def add_exporter(self, exporter):
+        with self.lock:
+            self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        with self.lock:
+            if exporter in self.exporters:
+                self.exporters.remove(exporter)
+
+    def instrument(self, client):
+        """
+        Trace every API call of a botocore client as a span 'aws.{service}.{operation}'.
+        Hooks check 'enabled' on each call, so a disabled tracer adds one function call per API call.
+        """
+        def before_call(model, params, context, **kwargs):
+            if self.enabled:
+                context['trace_started'] = time.perf_counter()
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            started = context.get('trace_started')
+            if started is None:
+                return
+            error = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+            attrs = {'api': model.name}
+            if error:
+                attrs['error'] = error
+            self.finish(f'aws.{model.service_model.service_name}.{model.name}', time.perf_counter() - started,
+                        outcome='error' if error else 'ok',
+                        retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0), attrs=attrs)
+
+        client.meta.events.register('before-call', before_call)
+        client.meta.events.register('after-call', after_call)
+        return client
+
+    def metrics(self):
+        """
+        :return:
+        {
+            '{SPAN_NAME}': {'Count': 123, 'Sum': seconds, 'Outcomes': {'ok': 123, 'error': 123}, 'Retries': 123,
+                            'Buckets': {'0.005': 123, ..., '+Inf': 123}}  # cumulative
+        }
+        """
+        with self.lock:
+            result = {}
+            for name, histogram in self.histograms.items():
+                cumulative, buckets = 0, {}
+                for le, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    buckets[str(le)] = cumulative
+                result[name] = {
+                    'Count': histogram.count,
+                    'Sum': histogram.sum,
+                    'Outcomes': {outcome: n for (span, outcome), n in self.counters.items() if span == name},
+                    'Retries': self.retries.get(name, 0),
+                    'Buckets': buckets
+                }
+            return result
+
+    def gauge_values(self):
+        """
+        :return: {'{GAUGE_NAME}': [{'Labels': {'stage': 'verify'}, 'Value': 3}]}
+        """
+        with self.lock:
+            result = {}
+            for (name, labels), value in self.gauges.items():
+                result.setdefault(name, []).append({'Labels': dict(labels), 'Value': value})
+            return result
+
+    def metrics_jsonl(self):
+        lines = [json.dumps({'metric': name, **values}) + '\n' for name, values in self.metrics().items()]
+        for name, values in self.gauge_values().items():
+            lines.extend(json.dumps({'gauge': name, 'labels': value['Labels'], 'value': value['Value']}) + '\n'
+                         for value in values)
+        return ''.join(lines)
+
+    def prometheus(self, prefix: str = 'groot'):
+        """
+        :return: Prometheus text exposition format.
+        """
+        metrics = {name.replace('\\', '\\\\').replace('"', '\\"'): values for name, values in self.metrics().items()}
+        lines = [f'# TYPE {prefix}_operation_duration_seconds histogram']
+        for label, values in metrics.items():
+            for le, count in values['Buckets'].items():
+                lines.append(f'{prefix}_operation_duration_seconds_bucket{{operation="{label}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_operation_duration_seconds_sum{{operation="{label}"}} {values["Sum"]}')
+            lines.append(f'{prefix}_operation_duration_seconds_count{{operation="{label}"}} {values["Count"]}')
+        lines.append(f'# TYPE {prefix}_operation_total counter')
+        for label, values in metrics.items():
+            for outcome, count in values['Outcomes'].items():
+                lines.append(f'{prefix}_operation_total{{operation="{label}",outcome="{outcome}"}} {count}')
+        lines.append(f'# TYPE {prefix}_operation_retries_total counter')
+        for label, values in metrics.items():
+            lines.append(f'{prefix}_operation_retries_total{{operation="{label}"}} {values["Retries"]}')
+        for name, values in self.gauge_values().items():
+            metric = f"{prefix}_{name.replace('.', '_')}"
+            lines.append(f'# TYPE {metric} gauge')
+            for value in values:
+                labels = ','.join(f'{k}="{v}"' for k, v in value['Labels'].items())
+                lines.append(f'{metric}{{{labels}}} {value["Value"]}' if labels else f'{metric} {value["Value"]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.retries.clear()
+            self.gauges.clear()
+
+
+tracer = Tracer()
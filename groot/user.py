@@ -0,0 +1,49 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from throttle import RateLimiter, default_limiter
+
+if TYPE_CHECKING:  # boto3 is imported on first client creation. (groot/pool.py)
+    import boto3
+    import botocore.client
+
+
+class User:
+    session: boto3.Session
+    client: botocore.client
+    limiter: RateLimiter
+
+    def __init__(self, session: boto3.Session, limiter: RateLimiter = None):
+        self.client = session.client('iam')
+        self.limiter = limiter or default_limiter
+
+    def list_users(self, path_prefix: str = '/'):
+        """
+        List IAM Users. Follow 'list_users' pagination until every page is read.
+        Pages are requested one by one under the rate limiter instead of botocore paginator.
+
+        :param path_prefix: IAM path prefix to filter users. '/' for all users.
+        :return: generator of 'Users' items of 'list_users'.
+        """
+        params = {'PathPrefix': path_prefix}
+        while True:
+            page = self.limiter.call('ListUsers', self.client.list_users, **params)
+            yield from page['Users']
+            if not page.get('IsTruncated'):
+                return
+            params['Marker'] = page['Marker']
+
+    def list(self, path_prefix: str = '/'):
+        """
+        List IAM User names.
+
+        :param path_prefix: IAM path prefix to filter users. '/' for all users.
+        :return: generator of IAM User names.
+        """
+        for user in self.list_users(path_prefix=path_prefix):
+            yield user['UserName']
+
+    def paths(self, path_prefix: str = '/'):
+        """
+        :return: {'{IAM_USER_NAME}': '{IAM_PATH}'}
+        """
+        return {user['UserName']: user['Path'] for user in self.list_users(path_prefix=path_prefix)}
@@ -1,31 +1,60 @@
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import base64
 
-import boto3
-
-from groot import Service
-from groot.secure import Secure
+from groot import Service, ClientPool, PooledSession, KeyCache, UserLocks
+from groot.secure import Secure, DataKeyCache
 import json
 
-lambda_profile = boto3.Session
-kms_key: str
+# Module scope outlives a single invocation, so warm Lambda containers reuse clients of the pool.
+client_pool = ClientPool()
+lambda_session = PooledSession(pool=client_pool)  # Lambda execution role
+data_key_cache = DataKeyCache()
+# Concurrent requests of a user share one ListAccessKeys, and rotations of a user run one at a time.
+key_cache = KeyCache()
+user_locks = UserLocks()
+
+# request_type -> (handler, names of required arguments in client_context.custom)
+functions = {}
+
+BATCH_REQUEST_TYPE = 'batch'
+BATCH_MAX_ITEMS = 500
+BATCH_MAX_WORKERS = 16
+BATCH_DEFAULT_WORKERS = 4
+
+
+class RequestError(ValueError):
+    pass
+
+
+def route(request_type: str, *required_args: str):
+    """
+    Register a handler for the request type. Handler is called only when the request type is requested.
+
+    :param request_type: 'request_type' value in client_context.custom
+    :param required_args: Argument names the handler takes from client_context.custom besides 'service'.
+    """
+    def register(handler):
+        functions[request_type] = (handler, required_args)
+        return handler
+    return register
 
 
 def response_value(msg: str, data):
-    response_payload = {
+    return {
         "msg": msg,
         "data": data
     }
-    encrypt_with_kms(json.dumps(response_payload), key_id=key_id)
-    return
 
 
+@route('publish_credential', 'user_name')
 def publish_credential(service: Service, user_name: str):
     return response_value(
         msg="Publish a new Credential",
-        data=service.publish_new_credential(user_name=user_name)
+        data=service.publish_new_credential(user_name=user_name, switch_session=False)
     )
 
 
+@route('delete_credential', 'user_name', 'access_key_id')
 def delete_credential(service: Service, user_name: str, access_key_id: str):
     return response_value(
         msg="",
@@ -33,6 +62,7 @@ def delete_credential(service: Service, user_name: str, access_key_id: str):
     )
 
 
+@route('check_credential', 'user_name')
 def check_credential(service: Service, user_name: str):
     return response_value(
         msg="",
@@ -40,6 +70,7 @@ def check_credential(service: Service, user_name: str):
     )
 
 
+@route('remove_inactive_credential', 'user_name')
 def remove_inactive_credential(service: Service, user_name: str):
     return response_value(
         msg="",
@@ -47,6 +78,7 @@ def remove_inactive_credential(service: Service, user_name: str):
     )
 
 
+@route('mark_inactive_older_credential', 'user_name')
 def mark_inactive_older_credential(service: Service, user_name: str):
     return response_value(
         msg="",
@@ -55,36 +87,151 @@ def mark_inactive_older_credential(service: Service, user_name: str):
 
 
 def decrypt_with_kms(client_data: bytes, key_id: str):
-    secure = Secure(lambda_profile)
-    return secure.decrypt(client_data, key_id)
+    """
+    Decrypt envelope or plain KMS ciphertext. Data keys are cached, so KMS is called once per data key.
+    """
+    secure = Secure(lambda_session, cache=data_key_cache)
+    return secure.decrypt_envelope(client_data, key_id)
 
 
 def encrypt_with_kms(server_data: str, key_id: str):
-    secure = Secure(lambda_profile)
-    return secure.encrypt(server_data, key_id)
+    """
+    Envelope encryption with a cached data key. No 4 KB limit of KMS Encrypt, so batch responses fit.
+    """
+    secure = Secure(lambda_session, cache=data_key_cache)
+    return secure.encrypt_envelope(server_data, key_id)
+
+
+def parse_item(item: dict):
+    """
+    Validate a request item. 'request_type' and the arguments of its handler.
+
+    :param item: client_context.custom or an item of batch request.
+    :return: (handler, keyword arguments of handler)
+    """
+    if not isinstance(item, dict) or not item.get('request_type'):
+        raise RequestError("Error, 'request_type' is required.")
+    if item['request_type'] not in functions:
+        raise RequestError(f"Error, Unknown request_type '{item['request_type']}'. "
+                           f"Available : {sorted(functions) + [BATCH_REQUEST_TYPE]}")
+    handler, required_args = functions[item['request_type']]
+    kwargs = {}
+    for name in required_args:
+        value = item.get(name)
+        if not isinstance(value, str) or not value:
+            raise RequestError(f"Error, '{name}' is required for '{item['request_type']}'.")
+        kwargs[name] = value
+    return handler, kwargs
+
+
+def parse_request(custom: dict):
+    """
+    Validate client_context.custom before any AWS call.
+
+    :param custom: client_context.custom
+    :return: (handler, keyword arguments of handler). handler is None for batch request.
+    """
+    if not custom:
+        raise RequestError("Error, client_context.custom is empty.")
+    for name in ('key', 'key_alias', 'request_type'):
+        if not custom.get(name):
+            raise RequestError(f"Error, '{name}' is required.")
+    if custom['request_type'] == BATCH_REQUEST_TYPE:
+        return None, {}
+    return parse_item(custom)
+
+
+def parse_batch(event: dict, custom: dict):
+    """
+    Validate batch request. Items are in the event payload, since client_context is limited to 3583 bytes.
+
+    :param event: {'items': [{'request_type': ..., 'user_name': ..., ...}], 'max_workers': 4}
+    :param custom: client_context.custom
+    :return: (items, max_workers)
+    """
+    items = event.get('items') if isinstance(event, dict) else None
+    if not isinstance(items, list) or not items:
+        raise RequestError("Error, 'items' is required for batch request.")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise RequestError(f"Error, Maximum items of batch request is {BATCH_MAX_ITEMS}.")
+    max_workers = event.get('max_workers', custom.get('max_workers', BATCH_DEFAULT_WORKERS))
+    try:
+        max_workers = int(max_workers)
+    except (TypeError, ValueError):
+        raise RequestError("Error, 'max_workers' must be an integer.")
+    return items, min(max(max_workers, 1), BATCH_MAX_WORKERS)
+
+
+def run_item(service: Service, item: dict):
+    """
+    Run an item of batch request. Error of the item is returned in its result instead of aborting the batch.
+
+    :return: {'request_type': ..., 'user_name': ..., 'msg': ..., 'data': ...} or {..., 'error': 'message'}
+    """
+    result = {
+        'request_type': item.get('request_type') if isinstance(item, dict) else None,
+        'user_name': item.get('user_name') if isinstance(item, dict) else None
+    }
+    try:
+        handler, kwargs = parse_item(item)
+        result.update(handler(service, **kwargs))
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def run_batch(service: Service, items: list, max_workers: int):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda item: run_item(service, item), items))
+    failed = sum(1 for result in results if 'error' in result)
+    return response_value(
+        msg=f"Batch done. Succeeded : {len(results) - failed}, Failed : {failed}",
+        data=results
+    )
 
 
 def lambda_handler(event, context):
+    """
+    client_context.custom :
+    {
+        'key': base64 of KMS or envelope encrypted '{"aws_access_key_id": ..., "aws_secret_access_key": ...}',
+        'key_alias': KMS key id or alias,
+        'request_type': one of registered request types or 'batch',
+        'user_name': IAM User name,
+        'access_key_id': Access key id. (delete_credential only)
+    }
+    event (batch only) :
+    {
+        'items': [{'request_type': ..., 'user_name': ..., 'access_key_id': ...}],
+        'max_workers': Number of items run concurrently. (Optional)
+    }
+
+    :return: base64 of envelope encrypted '{"msg": ..., "data": ...}'. (groot.secure.Secure.encrypt_envelope)
+             'data' of batch is a list of item results in the order of 'items'.
+    """
+    custom = context.client_context.custom if context.client_context else None
+    handler, kwargs = parse_request(custom)
+    if handler is None:
+        items, max_workers = parse_batch(event, custom)
+
     key = json.loads(
         decrypt_with_kms(
-            client_data=bytes(context.client_context.custom['key'], 'utf-8'),
-            key_id=context.client_context.custom['key_alias']  # kms key id
+            client_data=base64.b64decode(custom['key']),
+            key_id=custom['key_alias']  # kms key id
         )
     )
     service = Service(
         access_key_id=key['aws_access_key_id'],
-        secret_access_key=key['aws_secret_access_key']
+        secret_access_key=key['aws_secret_access_key'],
+        pool=client_pool,
+        key_cache=key_cache,
+        user_locks=user_locks
     )
 
-    request_type = context.client_context.custom['request_type']
-
-    functions = {
-        'publish_credential': publish_credential(service, user_name),
-        'delete_credential': delete_credential(service, user_name, access_key_id),
-        'check_credential': check_credential(service, user_name),
-        'remove_inactive_credential': remove_inactive_credential(service, user_name),
-        'mark_inactive_older_credential': mark_inactive_older_credential(service, user_name)
-    }
-
-    response = functions[request_type]
-    return response
+    if handler is None:
+        response = run_batch(service, items, max_workers)
+    else:
+        response = handler(service, **kwargs)
+    return base64.b64encode(
+        encrypt_with_kms(json.dumps(response, default=str), key_id=custom['key_alias'])
+    ).decode()
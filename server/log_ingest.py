@@ -0,0 +1,136 @@
+from datetime import datetime, timezone
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import zlib
+
+MAX_BATCH_BYTES = 8 * 2 ** 20  # Decompressed size limit of a batch
+MAX_LINE_BYTES = 64 * 2 ** 10
+SECRET_ENV = 'LOG_INGEST_SECRET'  # Shared with clients as IAM_MANAGER_LOG_SECRET (client/iam_manager.py)
+SIGNATURE_HEADER = 'x-groot-signature'
+TIMESTAMP_HEADER = 'x-groot-timestamp'
+MAX_CLOCK_SKEW_SECONDS = 300
+
+
+class BatchError(ValueError):
+    pass
+
+
+class AuthError(ValueError):
+    pass
+
+
+def sign_batch(secret: str, timestamp: str, body: bytes):
+    """
+    :return: Hex HMAC-SHA256 of '{timestamp}.{body}' with the shared secret. Body is as sent, compressed.
+    """
+    return hmac.new(secret.encode('utf-8'), timestamp.encode('utf-8') + b'.' + body, hashlib.sha256).hexdigest()
+
+
+def verify_batch(body: bytes, timestamp: str, signature: str, secret: str, now: float = None):
+    """
+    Check that the batch was signed by a client holding the shared secret within 'MAX_CLOCK_SKEW_SECONDS'.
+    Nothing is accepted without a secret configured.
+    """
+    if not secret:
+        raise AuthError(f"Error, {SECRET_ENV} is not set.")
+    if not timestamp or not signature:
+        raise AuthError("Error, Batch is not signed.")
+    try:
+        skew = abs((time.time() if now is None else now) - float(timestamp))
+    except ValueError:
+        raise AuthError("Error, Batch timestamp is not a number.")
+    if skew > MAX_CLOCK_SKEW_SECONDS:
+        raise AuthError("Error, Batch timestamp is out of range.")
+    if not hmac.compare_digest(sign_batch(secret, timestamp, body), signature):
+        raise AuthError("Error, Batch signature doesn't match.")
+
+
+def decode_body(body: bytes, content_encoding: str = None, max_bytes: int = MAX_BATCH_BYTES):
+    """
+    :return: Decompressed body. gzip is inflated up to 'max_bytes', so a small batch can't expand without limit.
+    """
+    if (content_encoding or '').lower() != 'gzip':
+        if len(body) > max_bytes:
+            raise BatchError(f"Error, Batch is larger than {max_bytes} bytes.")
+        return body
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, max_bytes)
+    except zlib.error as e:
+        raise BatchError(f"Error, Batch is not valid gzip. {e}")
+    if decompressor.unconsumed_tail:
+        raise BatchError(f"Error, Batch is larger than {max_bytes} bytes.")
+    if not decompressor.eof:
+        raise BatchError("Error, Batch is truncated gzip.")
+    return data
+
+
+def ingest_batch(body: bytes, content_encoding: str = None, source: str = None, sink=None):
+    """
+    Validate JSON lines of a batch and write the valid ones to 'sink' (stdout for None, which is CloudWatch Logs
+    in Lambda) with 'source' and 'ingested_at' added. The whole batch is written with one call.
+
+    :return: {'accepted': 123, 'rejected': 123}
+    """
+    data = decode_body(body, content_encoding=content_encoding)
+    ingested_at = datetime.now(timezone.utc).isoformat()
+    accepted, rejected = [], 0
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        if len(line) > MAX_LINE_BYTES:
+            rejected += 1
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            rejected += 1
+            continue
+        if not isinstance(record, dict):
+            rejected += 1
+            continue
+        record['ingested_at'] = ingested_at
+        if source:
+            record['source'] = source
+        accepted.append(json.dumps(record, default=str))
+    if accepted:
+        (sink or sys.stdout).write('\n'.join(accepted) + '\n')
+    return {'accepted': len(accepted), 'rejected': rejected}
+
+
+def lambda_handler(event, context):
+    """
+    Log batches of clients (client/log_shipper.py) through Lambda function URL or API Gateway proxy integration.
+
+    event :
+    {
+        'body': gzip compressed JSON lines, base64 encoded if 'isBase64Encoded',
+        'isBase64Encoded': True|False,
+        'headers': {'content-encoding': 'gzip', 'x-groot-timestamp': POSIX seconds, 'x-groot-signature': hex},
+        'requestContext': {'http': {'sourceIp': ...}}
+    }
+    Batches are signed with HMAC-SHA256 of the shared secret in environment variable 'LOG_INGEST_SECRET'.
+    (sign_batch)
+
+    :return: HTTP response. 200 with {'accepted', 'rejected'}, 400 for a batch that can't be read,
+             401 for a batch that isn't signed with the secret.
+    """
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    body = event.get('body') or ''
+    body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode('utf-8')
+    source = ((event.get('requestContext') or {}).get('http') or {}).get('sourceIp')
+    try:
+        verify_batch(body, timestamp=headers.get(TIMESTAMP_HEADER), signature=headers.get(SIGNATURE_HEADER),
+                     secret=os.environ.get(SECRET_ENV))
+    except AuthError as e:
+        return {'statusCode': 401, 'body': json.dumps({'error': str(e)})}
+    try:
+        result = ingest_batch(body, content_encoding=headers.get('content-encoding'), source=source)
+    except BatchError as e:
+        return {'statusCode': 400, 'body': json.dumps({'error': str(e)})}
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(result)}
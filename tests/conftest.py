@@ -0,0 +1,125 @@
+"""
+Fixtures of the test suite. AWS calls go to moto in process. 'answers' replaces chosen calls with an error before
+they reach moto, e.g. a new key that IAM hasn't propagated yet or a failing 'DeleteAccessKey'.
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'groot'), os.path.join(ROOT, 'client'), os.path.join(ROOT, 'server')]
+
+USER_PATH = '/test/'
+
+
+def mock_aws():
+    try:
+        from moto import mock_aws as mock
+        return mock()
+    except ImportError:  # moto < 5
+        import contextlib
+        from moto import mock_iam, mock_kms, mock_sts
+        stack = contextlib.ExitStack()
+        for mock in (mock_iam(), mock_kms(), mock_sts()):
+            stack.enter_context(mock)
+        return stack
+
+
+class Answers:
+    """
+    'before-call' hook answering calls that match a rule with an AWS error instead of calling moto.
+    """
+
+    def __init__(self):
+        self.rules = []  # (operation name, error code, predicate(access key id of the signer, request body))
+        self.answered = {}
+        self.lock = threading.Lock()
+
+    def add(self, operation: str, code: str, when=None):
+        self.rules.append((operation, code, when or (lambda access_key_id, body: True)))
+
+    def before_call(self, model, params, request_signer=None, **kwargs):
+        access_key_id = request_signer._credentials.access_key if request_signer is not None else None
+        for operation, code, when in self.rules:
+            if model.name == operation and when(access_key_id, params.get('body', {})):
+                with self.lock:
+                    self.answered[operation] = self.answered.get(operation, 0) + 1
+                from botocore.awsrequest import AWSResponse
+                return AWSResponse('https://localhost', 400, {}, None), {
+                    'Error': {'Code': code, 'Message': code},
+                    'ResponseMetadata': {'HTTPStatusCode': 400, 'RetryAttempts': 0}
+                }
+        return None
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """
+    Local moto IAM/STS/KMS for the test.
+    """
+    monkeypatch.setenv('GROOT_TRACE', '0')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def iam(aws):
+    import boto3
+    return boto3.client('iam')
+
+
+@pytest.fixture
+def admin_key(iam):
+    """
+    :return: 'AccessKey' of the IAM User 'admin', the session of 'service'.
+    """
+    iam.create_user(UserName='admin')
+    return iam.create_access_key(UserName='admin')['AccessKey']
+
+
+@pytest.fixture
+def users(iam):
+    """
+    :return: Function creating IAM Users under USER_PATH with one access key, returning {user name: access key id}.
+    """
+    def create(amount: int):
+        keys = {}
+        for i in range(amount):
+            iam.create_user(UserName=f'user-{i:03d}', Path=USER_PATH)
+            keys[f'user-{i:03d}'] = iam.create_access_key(UserName=f'user-{i:03d}')['AccessKey']['AccessKeyId']
+        return keys
+    return create
+
+
+@pytest.fixture
+def answers():
+    return Answers()
+
+
+@pytest.fixture
+def service(admin_key, answers):
+    """
+    Service signed with the admin key. Its clients pass 'answers'.
+    """
+    import boto3
+    from groot import ClientPool, IdentityCache, KeyCache, RateLimiter, Service, UserLocks
+    pool = ClientPool()
+    pool.session = boto3.session.Session()
+    pool.session.events.register('before-call', answers.before_call)
+    return Service(access_key_id=admin_key['AccessKeyId'], secret_access_key=admin_key['SecretAccessKey'],
+                   pool=pool, limiter=RateLimiter(default_rate=1e6), identity_cache=IdentityCache(),
+                   key_cache=KeyCache(), user_locks=UserLocks())
+
+
+@pytest.fixture
+def access_keys(iam):
+    """
+    :return: Function returning [(access key id, status)] of an IAM User.
+    """
+    return lambda user_name: [(key['AccessKeyId'], key['Status'])
+                              for key in iam.list_access_keys(UserName=user_name)['AccessKeyMetadata']]
@@ -0,0 +1,39 @@
+from account import IdentityCache, parse_user_name
+
+IDENTITY = {'UserArn': 'arn:aws:iam::123456789012:user/ops/admin', 'UserName': 'admin', 'Account': '123456789012'}
+
+
+def test_parse_user_name():
+    assert parse_user_name('arn:aws:iam::123456789012:user/ops/admin') == 'admin'
+    assert parse_user_name('arn:aws:iam::123456789012:user/admin') == 'admin'
+
+
+def test_identity_is_cached_per_secret():
+    cache = IdentityCache()
+    cache.put('AKIA1', IDENTITY, 'secret')
+    assert cache.get('AKIA1', 'secret') == IDENTITY
+    assert cache.get('AKIA1', 'wrong') is None
+    assert cache.invalidate('AKIA1') and not cache.invalidate('AKIA1')
+    assert cache.get('AKIA1', 'secret') is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_expired_identity_is_read_again():
+    cache = IdentityCache(ttl=-1)
+    cache.put('AKIA1', IDENTITY, 'secret')
+    assert cache.get('AKIA1', 'secret') is None
+
+
+def test_file_keeps_identities_without_secrets(tmp_path):
+    path = str(tmp_path / 'identities.json')
+    IdentityCache(path=path).put('AKIA1', IDENTITY, 'secret')
+    with open(path) as f:
+        assert 'secret' not in f.read()
+    assert IdentityCache(path=path).get('AKIA1', 'secret') == IDENTITY
+
+
+def test_service_calls_sts_once_per_key(service, admin_key):
+    assert service.get_account_info()['UserName'] == 'admin'
+    assert service.caller_user_name() == 'admin'
+    assert service.limiter.metrics()['GetCallerIdentity']['Calls'] == 1
+    assert service.identity_cache.get(admin_key['AccessKeyId'], admin_key['SecretAccessKey'])['UserName'] == 'admin'
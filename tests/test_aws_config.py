@@ -0,0 +1,68 @@
+import os
+import stat
+
+from aws_config import CredentialsFile, set_credentials
+
+ORIGINAL = """# Managed by hand
+[default]
+aws_access_key_id = AKIADEFAULT
+aws_secret_access_key = default-secret
+
+[iam-manager]
+region = us-east-1
+aws_access_key_id = AKIAOLD ; old key
+aws_secret_access_key = old-secret
+
+[other]
+output = json
+
+"""
+
+
+def test_profiles_are_updated_in_place(tmp_path):
+    path = tmp_path / 'credentials'
+    path.write_text(ORIGINAL)
+    set_credentials({'iam-manager': ('AKIANEW', 'new-secret'), 'other': ('AKIAOTHER', 'other-secret'),
+                     'added': ('AKIAADDED', 'added-secret')}, path=str(path))
+    assert path.read_text() == """# Managed by hand
+[default]
+aws_access_key_id = AKIADEFAULT
+aws_secret_access_key = default-secret
+
+[iam-manager]
+region = us-east-1
+aws_access_key_id = AKIANEW
+aws_secret_access_key = new-secret
+
+[other]
+output = json
+aws_access_key_id = AKIAOTHER
+aws_secret_access_key = other-secret
+
+[added]
+aws_access_key_id = AKIAADDED
+aws_secret_access_key = added-secret
+"""
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.credentials-')] == []
+
+
+def test_written_file_is_read_by_botocore(tmp_path, monkeypatch):
+    import boto3
+    path = tmp_path / 'aws' / 'credentials'
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(path))
+    set_credentials({'iam-manager': ('AKIANEW', 'new-secret')})
+    credentials = boto3.Session(profile_name='iam-manager').get_credentials()
+    assert (credentials.access_key, credentials.secret_key) == ('AKIANEW', 'new-secret')
+
+
+def test_get_and_unchanged_file_is_not_written(tmp_path):
+    path = tmp_path / 'credentials'
+    path.write_text(ORIGINAL)
+    credentials_file = CredentialsFile(path=str(path))
+    assert credentials_file.get('iam-manager', 'region') == 'us-east-1'
+    assert credentials_file.get('other', 'aws_access_key_id') is None
+    assert credentials_file.get('missing', 'region') is None
+    modified = os.stat(path).st_mtime_ns
+    credentials_file.commit()
+    assert os.stat(path).st_mtime_ns == modified
@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from coalesce import KeyCache, SingleFlight, UserLocks
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'AccessKeyMetadata': [{'AccessKeyId': f'AKIA{self.calls}'}]}
+
+
+def test_key_cache_hits_until_invalidated():
+    cache, loader = KeyCache(), Loader()
+    assert cache.get('AKIACALLER', 'user', loader) == cache.get('AKIACALLER', 'user', loader)
+    assert loader.calls == 1
+    cache.invalidate('user')
+    assert cache.get('AKIACALLER', 'user', loader)['AccessKeyMetadata'][0]['AccessKeyId'] == 'AKIA2'
+    assert loader.calls == 2
+
+
+def test_key_cache_is_per_caller():
+    cache, loader = KeyCache(), Loader()
+    cache.get('AKIACALLER1', 'user', loader)
+    cache.get('AKIACALLER2', 'user', loader)
+    assert loader.calls == 2
+
+
+def test_key_cache_fresh_skips_the_cache():
+    cache, loader = KeyCache(), Loader()
+    cache.get('AKIACALLER', 'user', loader)
+    cache.get('AKIACALLER', 'user', loader, fresh=True)
+    assert loader.calls == 2
+
+
+def test_key_cache_never_caches_a_load_across_an_invalidation():
+    cache = KeyCache(max_users=2)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+        return {'AccessKeyMetadata': []}
+
+    thread = threading.Thread(target=cache.get, args=('AKIACALLER', 'user', slow))
+    thread.start()
+    started.wait()
+    cache.invalidate('user')
+    for i in range(10):  # Prunes the stamp of 'user'.
+        cache.invalidate(f'other-{i}')
+    release.set()
+    thread.join()
+    assert 'user' not in cache.entries
+    assert len(cache.stamps) <= 2
+
+
+def test_key_cache_evicts_over_max_users():
+    cache, loader = KeyCache(max_users=3), Loader()
+    for i in range(10):
+        cache.invalidate(f'user-{i}')
+        cache.get('AKIACALLER', f'user-{i}', loader)
+    assert list(cache.entries) == ['user-7', 'user-8', 'user-9']
+    assert len(cache.stamps) <= 3
+
+
+def test_user_locks_serialize_a_user():
+    locks, inside, overlaps = UserLocks(), [], []
+    guard = threading.Lock()
+
+    def work():
+        with locks.hold('user'):
+            with guard:
+                inside.append(1)
+                overlaps.append(len(inside))
+            threading.Event().wait(0.01)
+            with guard:
+                inside.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(overlaps) == 1
+    assert locks.contended > 0
+    assert locks.locks == {}
+
+
+def test_user_locks_are_reentrant_and_per_user():
+    locks, done = UserLocks(), threading.Event()
+
+    def other():
+        with locks.hold('other'):
+            done.set()
+
+    with locks.hold('user'):
+        with locks.hold('user'):
+            threading.Thread(target=other).start()
+            assert done.wait(timeout=1)
+    assert locks.locks == {}
+
+
+def test_single_flight_shares_a_result_and_an_error():
+    flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+    results, calls = [], []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'result'
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while flight.coalesced < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ['result'] * 4 and len(calls) == 1
+    with pytest.raises(ZeroDivisionError):
+        flight.do('key', lambda: 1 / 0)
+    assert flight.flights == {}
+
+
+def test_service_reads_access_keys_once(service, users):
+    users(1)
+    threads = [threading.Thread(target=service.need_to_publish_new_credential, args=('user-000',))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert service.limiter.metrics()['ListAccessKeys']['Calls'] == 1
+    service.rotate_credential('user-000', force=True)  # Reads fresh and invalidates.
+    service.need_to_publish_new_credential('user-000')
+    assert service.limiter.metrics()['ListAccessKeys']['Calls'] == 3
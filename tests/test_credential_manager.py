@@ -0,0 +1,83 @@
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import credential_manager
+from credential_manager import BATCH_MAX_ITEMS, BATCH_MAX_WORKERS, RequestError, parse_batch, parse_request
+
+
+def custom(request_type: str, **fields):
+    return {'key': 'a2V5', 'key_alias': 'alias/groot', 'request_type': request_type, **fields}
+
+
+@pytest.mark.parametrize('fields, message', [
+    (None, 'is empty'),
+    ({'key_alias': 'alias/groot', 'request_type': 'check_credential'}, "'key' is required"),
+    (custom('rotate_everything'), "Unknown request_type 'rotate_everything'"),
+    (custom('check_credential'), "'user_name' is required for 'check_credential'"),
+    (custom('delete_credential', user_name='user-000'), "'access_key_id' is required"),
+])
+def test_invalid_request_is_refused(fields, message):
+    with pytest.raises(RequestError, match=message):
+        parse_request(fields)
+
+
+def test_request_is_routed():
+    handler, kwargs = parse_request(custom('delete_credential', user_name='user-000', access_key_id='AKIA'))
+    assert handler is credential_manager.delete_credential
+    assert kwargs == {'user_name': 'user-000', 'access_key_id': 'AKIA'}
+    assert parse_request(custom('batch')) == (None, {})
+
+
+def test_batch_is_validated():
+    with pytest.raises(RequestError, match="'items' is required"):
+        parse_batch({}, custom('batch'))
+    with pytest.raises(RequestError, match='Maximum items'):
+        parse_batch({'items': [{}] * (BATCH_MAX_ITEMS + 1)}, custom('batch'))
+    with pytest.raises(RequestError, match='must be an integer'):
+        parse_batch({'items': [{}], 'max_workers': 'many'}, custom('batch'))
+    assert parse_batch({'items': [{}], 'max_workers': 1000}, custom('batch'))[1] == BATCH_MAX_WORKERS
+    assert parse_batch({'items': [{}]}, custom('batch', max_workers='0'))[1] == 1
+
+
+@pytest.fixture
+def invoke(admin_key):
+    """
+    :return: Function invoking 'lambda_handler' with the admin key, returning the decrypted response.
+    """
+    import boto3
+    from groot.secure import DataKeyCache, Secure
+    key_id = boto3.client('kms').create_key()['KeyMetadata']['KeyId']
+    secure = Secure(session=boto3.session.Session(), cache=DataKeyCache())
+    key = base64.b64encode(secure.encrypt_envelope(json.dumps({
+        'aws_access_key_id': admin_key['AccessKeyId'],
+        'aws_secret_access_key': admin_key['SecretAccessKey']
+    }), key_id)).decode()
+
+    def invoke(request_type: str, event: dict = None, **fields):
+        context = SimpleNamespace(client_context=SimpleNamespace(custom={
+            'key': key, 'key_alias': key_id, 'request_type': request_type, **fields}))
+        response = credential_manager.lambda_handler(event or {}, context)
+        return json.loads(secure.decrypt_envelope(base64.b64decode(response), key_id))
+    return invoke
+
+
+def test_single_request(invoke, users):
+    users(1)
+    assert invoke('check_credential', user_name='user-000') == {'msg': '', 'data': False}
+
+
+def test_batch_request(invoke, users, access_keys):
+    keys = users(3)
+    items = [{'request_type': 'publish_credential', 'user_name': user_name} for user_name in keys]
+    items.append({'request_type': 'publish_credential', 'user_name': 'nobody'})
+    items.append({'request_type': 'check_credential'})
+    response = invoke('batch', event={'items': items, 'max_workers': 2})
+    assert response['msg'] == 'Batch done. Succeeded : 3, Failed : 2'
+    results = response['data']
+    assert [result['user_name'] for result in results] == list(keys) + ['nobody', None]
+    for user_name, result in zip(keys, results):
+        assert access_keys(user_name) == [(result['data']['AccessKey']['AccessKeyId'], 'Active')]
+    assert 'error' in results[3] and "'user_name' is required" in results[4]['error']
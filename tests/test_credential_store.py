@@ -0,0 +1,63 @@
+import os
+import stat
+
+from credential_store import CredentialStore
+
+
+def test_latest_record_is_current(tmp_path):
+    store = CredentialStore(str(tmp_path / 'store.jsonl'))
+    store.put('user', 'AKIA1', 'secret1', profile_name='iam-manager')
+    store.put('user', 'AKIA2', 'secret2', profile_name='iam-manager')
+    assert store.get_current('user')['access_key_id'] == 'AKIA2'
+    assert store.get('AKIA1')['secret_access_key'] == 'secret1'
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+
+
+def test_store_is_read_again_from_the_file(tmp_path):
+    path = str(tmp_path / 'store.jsonl')
+    store = CredentialStore(path)
+    store.put('user', 'AKIA1', 'secret1')
+    store.put('other', 'AKIA2', 'secret2')
+    store.remove('AKIA2')
+    with open(path, 'a') as f:
+        f.write('{"user_name": "torn", "access_')  # Crash during append.
+    reopened = CredentialStore(path)
+    assert reopened.get_current('user')['access_key_id'] == 'AKIA1'
+    assert reopened.get_current('other') is None and reopened.get('AKIA2') is None
+    assert reopened.get_current('torn') is None
+
+
+def test_remove_of_an_old_key_keeps_the_current_one(tmp_path):
+    store = CredentialStore(str(tmp_path / 'store.jsonl'))
+    store.put('user', 'AKIA1', 'secret1')
+    store.put('user', 'AKIA2', 'secret2')
+    store.remove('AKIA1')
+    store.remove('AKIA1')  # Unknown key, nothing appended.
+    assert store.get_current('user')['access_key_id'] == 'AKIA2'
+    assert store.records == 3
+
+
+def test_superseded_records_are_compacted(tmp_path):
+    path = str(tmp_path / 'store.jsonl')
+    store = CredentialStore(path, compact_threshold=10)
+    for i in range(30):
+        store.put(f'user-{i % 3}', f'AKIA{i}', f'secret{i}')
+    with open(path) as f:
+        lines = len(f.readlines())
+    assert lines <= 3 + 10 + 1
+    assert {user: store.get_current(user)['access_key_id'] for user in ('user-0', 'user-1', 'user-2')} == \
+           {'user-0': 'AKIA27', 'user-1': 'AKIA28', 'user-2': 'AKIA29'}
+    assert CredentialStore(path).get_current('user-2')['secret_access_key'] == 'secret29'
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.store-')] == []
+
+
+def test_export(tmp_path):
+    store = CredentialStore(str(tmp_path / 'store.jsonl'))
+    store.put('user', 'AKIA1', 'secret1', profile_name='iam-manager')
+    store.put('other', 'AKIA2', 'secret2', profile_name='iam-manager')
+    paths = store.export(str(tmp_path / 'export'), user_name='user')
+    assert paths == [f"{tmp_path / 'export'}/credentials-user-AKIA1"]
+    with open(paths[0]) as f:
+        assert f.read() == '[iam-manager]\naccess_key_id = AKIA1\nsecret_access_key = secret1\n'
+    assert len(store.export(str(tmp_path / 'export'))) == 2
+    assert store.export(str(tmp_path / 'export'), user_name='nobody') == []
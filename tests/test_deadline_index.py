@@ -0,0 +1,43 @@
+from deadline_index import DAY, DeadlineIndex
+
+
+def test_due_users_come_out_in_order(tmp_path):
+    index = DeadlineIndex(str(tmp_path / 'deadlines.json'), max_age_days=75)
+    index.update('late', 'AKIA1', created_ts=30 * DAY)
+    index.update('early', 'AKIA2', created_ts=10 * DAY)
+    index.update('never', 'AKIA3', created_ts=1000 * DAY)
+    assert index.next_due() == 85 * DAY
+    assert index.pop_due(now_ts=80 * DAY) == []
+    assert index.pop_due(now_ts=110 * DAY) == [('early', 'AKIA2'), ('late', 'AKIA1')]
+    assert len(index) == 1 and 'early' not in index
+    assert index.next_due() == 1075 * DAY
+
+
+def test_update_replaces_the_deadline(tmp_path):
+    index = DeadlineIndex(str(tmp_path / 'deadlines.json'), max_age_days=75)
+    index.update('user', 'AKIA1', created_ts=0)
+    index.update('user', 'AKIA2', created_ts=50 * DAY)
+    index.schedule('other', 'AKIA3', due_ts=DAY)
+    index.remove('other')
+    assert index.pop_due(now_ts=100 * DAY) == []
+    assert index.pop_due(now_ts=125 * DAY) == [('user', 'AKIA2')]
+    assert index.next_due() is None
+
+
+def test_stale_entries_are_bounded(tmp_path):
+    index = DeadlineIndex(str(tmp_path / 'deadlines.json'), max_age_days=75)
+    for i in range(1000):
+        index.update('user', f'AKIA{i}', created_ts=i)
+    assert len(index.heap) <= 2 * len(index) + 65
+    assert index.pop_due(now_ts=1e12) == [('user', 'AKIA999')]
+
+
+def test_saved_index_is_loaded_for_the_same_rule(tmp_path):
+    path = str(tmp_path / 'deadlines.json')
+    index = DeadlineIndex(path, max_age_days=75)
+    index.update('user', 'AKIA1', created_ts=0)
+    index.update('user', 'AKIA2', created_ts=DAY)
+    index.save()
+    loaded = DeadlineIndex(path, max_age_days=75)
+    assert len(loaded) == 1 and loaded.next_due() == 76 * DAY
+    assert len(DeadlineIndex(path, max_age_days=30)) == 0  # Rule changed.
@@ -0,0 +1,92 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from gossip import MAX_CLOCK_SKEW, MAX_DIGEST_ENTRIES, GossipNode, newer
+
+SECRET = 'test-secret'
+
+
+@pytest.fixture
+def nodes():
+    """
+    :return: Function starting a node on loopback. Every started node is stopped after the test.
+    """
+    started = []
+
+    def start(secret: str = SECRET, seeds: list = (), interval: float = 0.05, run: bool = True):
+        node = GossipNode(secret=secret, seeds=seeds, interval=interval)
+        started.append(node)
+        return node.start() if run else node
+    yield start
+    for node in started:
+        node.stop()
+
+
+def wait_for(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def signed(secret: str, message: dict):
+    payload = json.dumps(message).encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).digest() + payload
+
+
+def test_node_needs_a_secret():
+    with pytest.raises(ValueError):
+        GossipNode(secret=None)
+
+
+def test_newer_breaks_ties_by_origin():
+    assert newer({'version': 2, 'origin': 'a'}, [1, 'z'])
+    assert newer({'version': 1, 'origin': 'b'}, [1, 'a'])
+    assert not newer({'version': 1, 'origin': 'a'}, [1, 'a'])
+    assert newer({'version': 1, 'origin': 'a'}, None)
+
+
+def test_update_bumps_the_version_only_on_change(nodes):
+    node = nodes(run=False)
+    assert node.update('user', 'AKIA1', 100.0)['version'] == 1
+    assert node.update('user', 'AKIA1', 100.0) is None
+    assert node.update('user', 'AKIA1', 100.0, rotating=True)['version'] == 2
+    stale = dict(node.get('user'), version=1, access_key_id='AKIA0')
+    assert node.apply([stale]) == [] and node.get('user')['access_key_id'] == 'AKIA1'
+
+
+def test_forged_or_old_datagrams_are_dropped(nodes):
+    node = nodes(run=False)
+    assert node.open(signed(SECRET, {'type': 'PUSH', 'time': time.time()}))['type'] == 'PUSH'
+    assert node.open(signed('wrong', {'type': 'PUSH', 'time': time.time()})) is None
+    assert node.open(signed(SECRET, {'type': 'PUSH', 'time': time.time() - MAX_CLOCK_SKEW - 10})) is None
+
+
+def test_update_is_pushed_to_peers(nodes):
+    seed = nodes()
+    peer = nodes(seeds=[seed.address])
+    peer.update('user', 'AKIA1', 100.0)
+    assert wait_for(lambda: seed.get('user') is not None)
+    assert seed.get('user')['access_key_id'] == 'AKIA1'
+
+
+def test_anti_entropy_syncs_a_late_node(nodes):
+    seed = nodes()
+    amount = 2 * MAX_DIGEST_ENTRIES + 10  # More users than one digest range.
+    seed.apply([{'user': f'user-{i:04d}', 'access_key_id': f'AKIA{i}', 'created_at': 100.0, 'rotating': False,
+                 'updated_at': 100.0, 'version': 1, 'origin': 'other'} for i in range(amount)])
+    late = nodes(seeds=[seed.address])
+    assert wait_for(lambda: late.metrics()['users'] == amount)
+    assert wait_for(lambda: late.address in seed.peers)
+
+
+def test_node_with_another_secret_learns_nothing(nodes):
+    seed = nodes()
+    seed.update('user', 'AKIA1', 100.0)
+    stranger = nodes(secret='wrong', seeds=[seed.address])
+    assert wait_for(lambda: seed.metrics()['rejected'] > 0)
+    assert stranger.get('user') is None
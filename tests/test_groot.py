@@ -0,0 +1,63 @@
+import pytest
+
+from planner import ApplyError
+
+
+def own_key(admin_key: dict):
+    return lambda access_key_id, body: body.get('AccessKeyId') == admin_key['AccessKeyId']
+
+
+def new_key(admin_key: dict):
+    return lambda access_key_id, body: access_key_id != admin_key['AccessKeyId']
+
+
+def test_own_key_is_removed_after_the_session_switched(service, admin_key, access_keys, answers):
+    calls = []  # Signers of 'DeleteAccessKey'. The rule only records them and never answers.
+    answers.add('DeleteAccessKey', 'Unused', when=lambda access_key_id, body: calls.append(access_key_id))
+    result = service.rotate_credential('admin', force=True, switch_session=True)
+    new = result['AccessKey']['AccessKeyId']
+    assert [action['Action'] for action in result['Actions']] == ['Create', 'Delete']
+    assert service.session.access_key_id == new
+    assert calls == [new]  # The replaced key was deleted with the new key, so it worked first.
+    assert access_keys('admin') == [(new, 'Active')]
+
+
+def test_own_key_stays_when_the_new_key_never_works(service, admin_key, access_keys, answers):
+    answers.add('GetCallerIdentity', 'InvalidClientTokenId', when=new_key(admin_key))
+    with pytest.raises(Exception, match="isn't usable.*was deleted") as error:
+        service.rotate_credential('admin', force=True, switch_session=True, verify_timeout=0.1)
+    assert not isinstance(error.value, ApplyError)
+    assert service.session.access_key_id == admin_key['AccessKeyId']
+    assert access_keys('admin') == [(admin_key['AccessKeyId'], 'Active')]
+
+
+def test_failed_removal_of_own_key_returns_the_new_key(service, admin_key, access_keys, answers):
+    answers.add('DeleteAccessKey', 'ServiceFailure', when=own_key(admin_key))
+    with pytest.raises(ApplyError) as error:
+        service.rotate_credential('admin', force=True, switch_session=True)
+    new = error.value.result['AccessKey']
+    assert service.session.access_key_id == new['AccessKeyId']
+    assert sorted(access_keys('admin')) == sorted([(admin_key['AccessKeyId'], 'Active'),
+                                                   (new['AccessKeyId'], 'Active')])
+
+
+def test_fleet_rotates_the_owner_last(service, admin_key, users, access_keys):
+    keys = users(3)
+    result = service.rotate_fleet(path_prefix='/', force=True)
+    assert sorted(result['Rotated']) == sorted(list(keys) + ['admin'])
+    assert service.session.access_key_id == result['Rotated']['admin']['AccessKey']['AccessKeyId']
+    assert access_keys('admin') == [(service.session.access_key_id, 'Active')]
+
+
+def test_fleet_reports_the_new_owner_key_when_removing_the_old_fails(service, admin_key, answers):
+    answers.add('DeleteAccessKey', 'ServiceFailure', when=own_key(admin_key))
+    result = service.rotate_fleet(path_prefix='/', force=True)
+    assert 'ServiceFailure' in result['Rotated']['admin']['Error']
+    assert result['Rotated']['admin']['AccessKey']['SecretAccessKey']
+
+
+def test_pipeline_rotates_the_owner_last(service, admin_key, users, access_keys):
+    keys = users(2)
+    result = service.rotate_pipeline(path_prefix='/', force=True)
+    assert sorted(result['Rotated']) == sorted(list(keys) + ['admin'])
+    assert access_keys('admin') == [(service.session.access_key_id, 'Active')]
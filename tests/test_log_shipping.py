@@ -0,0 +1,166 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import gzip
+import json
+import threading
+import time
+
+import pytest
+
+import log_ingest
+from log_shipper import LogShipper, sign_batch
+
+SECRET = 'test-secret'
+
+
+class StandIn:
+    """
+    Local HTTP log endpoint running 'log_ingest.lambda_handler'. 'statuses' are answered first, one per post.
+    """
+
+    def __init__(self):
+        self.statuses = []
+        self.lines = []
+        self.posts = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stand_in.lock:
+                    stand_in.posts += 1
+                    status = stand_in.statuses.pop(0) if stand_in.statuses else None
+                if status is None:
+                    response = stand_in.handle(body, dict(self.headers))
+                else:
+                    response = {'statusCode': status, 'body': '{}'}
+                self.send_response(response['statusCode'])
+                self.send_header('Content-Length', str(len(response['body'])))
+                self.end_headers()
+                self.wfile.write(response['body'].encode('utf-8'))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/logs'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, body: bytes, headers: dict):
+        event = {'body': base64.b64encode(body).decode('ascii'), 'isBase64Encoded': True, 'headers': headers}
+        sink = Sink()
+        original, log_ingest.sys.stdout = log_ingest.sys.stdout, sink
+        try:
+            response = log_ingest.lambda_handler(event, None)
+        finally:
+            log_ingest.sys.stdout = original
+        with self.lock:
+            self.lines.extend(sink.lines)
+        return response
+
+
+class Sink:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data: str):
+        self.lines.extend(json.loads(line) for line in data.splitlines())
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    monkeypatch.setenv(log_ingest.SECRET_ENV, SECRET)
+    stand_in = StandIn()
+    yield stand_in
+    stand_in.server.shutdown()
+    stand_in.server.server_close()
+
+
+def wait_for(shipper: LogShipper, predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate(shipper.metrics()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def ship(shipper: LogShipper, amount: int):
+    for i in range(amount):
+        shipper.write(json.dumps({'event': 'test', 'i': i}))
+    shipper.close(timeout=10)
+    return shipper.metrics()
+
+
+def test_signed_batches_are_ingested(stand_in):
+    metrics = ship(LogShipper(stand_in.url, secret=SECRET, batch_size=10, flush_interval=0.05), 25)
+    assert metrics['shipped'] == 25 and metrics['batches'] == 3
+    assert sorted(line['i'] for line in stand_in.lines) == list(range(25))
+
+
+def test_server_error_spills_and_replays(stand_in, tmp_path):
+    stand_in.statuses = [503]
+    shipper = LogShipper(stand_in.url, secret=SECRET, spill_dir=str(tmp_path), batch_size=5, flush_interval=0.05)
+    for i in range(5):
+        shipper.write(json.dumps({'i': i}))
+    wait_for(shipper, lambda metrics: metrics['spilled'] == 5)
+    shipper.retry_at = 0.0  # Skip the backoff.
+    wait_for(shipper, lambda metrics: metrics['replayed'] == 5)
+    metrics = ship(shipper, 0)
+    assert metrics['spilled'] == 5 and metrics['replayed'] == 5 and metrics['rejected'] == 0
+    assert sorted(line['i'] for line in stand_in.lines) == list(range(5))
+    assert shipper.spill_files() == []
+
+
+def test_wrong_secret_is_rejected_not_spilled(stand_in, tmp_path):
+    metrics = ship(LogShipper(stand_in.url, secret='wrong', spill_dir=str(tmp_path), batch_size=10,
+                              flush_interval=0.05), 20)
+    assert metrics['rejected'] == 20
+    assert metrics['spilled'] == 0 and metrics['shipped'] == 0 and metrics['failures'] == 0
+    assert stand_in.lines == [] and stand_in.posts == 2
+
+
+def test_rejected_spill_is_removed(stand_in, tmp_path):
+    (tmp_path / f'{0:020d}-{1:06d}-3.ndjson.gz').write_bytes(b'not gzip')
+    shipper = LogShipper(stand_in.url, secret=SECRET, spill_dir=str(tmp_path), flush_interval=0.05)
+    wait_for(shipper, lambda metrics: metrics['rejected'] == 3)
+    metrics = ship(shipper, 0)
+    assert metrics['rejected'] == 3 and metrics['spill_files'] == 0
+
+
+def test_too_many_requests_is_retried(stand_in, tmp_path):
+    stand_in.statuses = [429]
+    metrics = ship(LogShipper(stand_in.url, secret=SECRET, spill_dir=str(tmp_path), flush_interval=0.05), 3)
+    assert metrics['spilled'] == 3 and metrics['rejected'] == 0 and metrics['failures'] == 1
+
+
+def test_shipper_needs_a_secret():
+    with pytest.raises(ValueError):
+        LogShipper('http://127.0.0.1:9/logs', secret=None)
+
+
+def test_verify_batch():
+    body = gzip.compress(b'{"a": 1}\n')
+    now = 1700000000
+    signature = sign_batch(SECRET, str(now), body)
+    log_ingest.verify_batch(body, str(now), signature, SECRET, now=now)
+    for timestamp, signed, secret, message in ((str(now), signature, None, 'is not set'),
+                                               (str(now), None, SECRET, 'not signed'),
+                                               ('soon', signature, SECRET, 'not a number'),
+                                               (str(now - 3600), signature, SECRET, 'out of range'),
+                                               (str(now), signature[::-1], SECRET, "doesn't match")):
+        with pytest.raises(log_ingest.AuthError, match=message):
+            log_ingest.verify_batch(body, timestamp, signed, secret, now=now)
+
+
+def test_ingest_batch_keeps_valid_lines():
+    sink = Sink()
+    body = gzip.compress(b'{"a": 1}\nnot json\n[1]\n\n' + b'{"b": "' + b'x' * log_ingest.MAX_LINE_BYTES + b'"}\n')
+    result = log_ingest.ingest_batch(body, content_encoding='gzip', source='10.0.0.1', sink=sink)
+    assert result == {'accepted': 1, 'rejected': 3}
+    assert sink.lines[0]['a'] == 1 and sink.lines[0]['source'] == '10.0.0.1'
+
+
+def test_gzip_bomb_is_refused():
+    with pytest.raises(log_ingest.BatchError, match='larger than'):
+        log_ingest.decode_body(gzip.compress(b'\n' * 4096), content_encoding='gzip', max_bytes=1024)
+    with pytest.raises(log_ingest.BatchError, match='truncated'):
+        log_ingest.decode_body(gzip.compress(b'{}\n')[:-4], content_encoding='gzip')
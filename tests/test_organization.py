@@ -0,0 +1,76 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from groot import Organization, RoleCredentialCache
+
+KEY = ('AKIABASE', 'arn:aws:iam::123456789012:role/groot', None, 'groot')
+
+
+class Assume:
+    def __init__(self, lifetime: timedelta = timedelta(hours=1)):
+        self.lifetime = lifetime
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        return {'AccessKeyId': f'ASIA{calls}', 'SecretAccessKey': 'secret', 'SessionToken': 'token',
+                'Expiration': datetime.now(timezone.utc) + self.lifetime}
+
+
+def test_role_cache_reuses_a_fresh_credential():
+    cache, assume = RoleCredentialCache(), Assume()
+    first, replaced = cache.get(KEY, assume)
+    assert replaced is None
+    assert cache.get(KEY, assume) == (first, None)
+    assert assume.calls == 1
+
+
+def test_role_cache_assumes_again_before_expiration():
+    cache, assume = RoleCredentialCache(refresh_before=300), Assume(lifetime=timedelta(seconds=299))
+    first, _ = cache.get(KEY, assume)
+    second, replaced = cache.get(KEY, assume)
+    assert assume.calls == 2
+    assert replaced == first['AccessKeyId']
+    assert second['AccessKeyId'] != first['AccessKeyId']
+
+
+def test_role_cache_is_per_base_credential_and_session():
+    cache, assume = RoleCredentialCache(), Assume()
+    keys = [KEY, ('AKIAOTHER',) + KEY[1:], KEY[:2] + ('external', KEY[3]), KEY[:3] + ('other',)]
+    assert len({cache.get(key, assume)[0]['AccessKeyId'] for key in keys}) == 4
+
+
+def test_role_cache_assumes_once_for_concurrent_callers():
+    cache, assume = RoleCredentialCache(), Assume()
+    threads = [threading.Thread(target=cache.get, args=(KEY, assume)) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert assume.calls == 1
+
+
+def test_account_service_moves_to_a_refreshed_credential(aws):
+    import boto3
+    account_id = '123456789012'
+    credentials = boto3.client('sts').assume_role(RoleArn=f'arn:aws:iam::{account_id}:role/groot',
+                                                  RoleSessionName='setup')['Credentials']
+    iam = boto3.client('iam', aws_access_key_id=credentials['AccessKeyId'],
+                       aws_secret_access_key=credentials['SecretAccessKey'],
+                       aws_session_token=credentials['SessionToken'])
+    iam.create_user(UserName='user')
+    iam.create_access_key(UserName='user')
+
+    cache = RoleCredentialCache()
+    organization = Organization(account_ids=[account_id], role_name='groot', role_cache=cache)
+    service = organization.service(account_id)
+    first = service.session.access_key_id
+    with cache.lock:
+        for entry in cache.entries.values():
+            entry['Expiration'] = datetime.now(timezone.utc)
+    assert service.rotate_credential('user', force=True)['AccessKey'] is not None
+    assert service.session.access_key_id != first
+    assert cache.metrics()['Assumed'] == 2
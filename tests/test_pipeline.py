@@ -0,0 +1,58 @@
+from groot import RotationPipeline
+
+
+def new_key(admin_key: dict):
+    """
+    :return: Predicate of 'answers' matching calls signed by any key but the admin's.
+    """
+    return lambda access_key_id, body: access_key_id != admin_key['AccessKeyId']
+
+
+def test_pipeline_rotates_users(service, users, access_keys):
+    keys = users(3)
+    result = RotationPipeline(service=service, force=True).run(keys)
+    assert sorted(result['Rotated']) == sorted(keys)
+    for user_name, rotated in result['Rotated'].items():
+        assert access_keys(user_name) == [(rotated['AccessKey']['AccessKeyId'], 'Active')]
+
+
+def test_young_keys_are_skipped(service, users):
+    keys = users(2)
+    result = RotationPipeline(service=service).run(keys)
+    assert sorted(result['Skipped']) == sorted(keys)
+
+
+def test_verify_timeout_deletes_the_new_key(service, users, access_keys, answers, admin_key):
+    keys = users(3)
+    answers.add('GetCallerIdentity', 'InvalidClientTokenId', when=new_key(admin_key))
+    result = RotationPipeline(service=service, force=True, verify_timeout=0.2, verify_base_delay=0.01,
+                              verify_max_delay=0.05).run(keys)
+    assert result['Rotated'] == {}
+    assert sorted(result['Failed']) == sorted(keys)
+    assert answers.answered['GetCallerIdentity'] > len(keys)  # Retried until the timeout.
+    for user_name, access_key_id in keys.items():
+        assert "isn't usable" in result['Failed'][user_name]
+        assert access_keys(user_name) == [(access_key_id, 'Active')]
+
+
+def test_access_denied_deletes_the_new_key_without_retry(service, users, access_keys, answers, admin_key):
+    keys = users(3)
+    answers.add('GetCallerIdentity', 'AccessDenied', when=new_key(admin_key))
+    result = RotationPipeline(service=service, force=True).run(keys)
+    assert sorted(result['Failed']) == sorted(keys)
+    assert answers.answered['GetCallerIdentity'] == len(keys)
+    for user_name, access_key_id in keys.items():
+        assert access_keys(user_name) == [(access_key_id, 'Active')]
+
+
+def test_failed_delete_keeps_the_new_key_in_the_result(service, users, access_keys, answers):
+    keys = users(2)
+    answers.add('DeleteAccessKey', 'ServiceFailure')
+    result = RotationPipeline(service=service, force=True).run(keys)
+    assert result['Failed'] == {}
+    for user_name, access_key_id in keys.items():
+        rotated = result['Rotated'][user_name]
+        assert 'ServiceFailure' in rotated['Error']
+        assert rotated['AccessKey']['SecretAccessKey']
+        assert sorted(access_keys(user_name)) == sorted([(access_key_id, 'Inactive'),
+                                                         (rotated['AccessKey']['AccessKeyId'], 'Active')])
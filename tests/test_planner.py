@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from planner import MAX_CREDENTIAL_AGE_DAYS, Action, ApplyError, Plan, Snapshot, plan_rotation
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def key(access_key_id: str, status: str = 'Active', age_days: int = 0):
+    return {'AccessKeyId': access_key_id, 'Status': status, 'CreateDate': NOW - timedelta(days=age_days)}
+
+
+def test_young_key_is_not_rotated():
+    snapshot = Snapshot('user', [key('AKIA1', age_days=MAX_CREDENTIAL_AGE_DAYS - 1)])
+    assert plan_rotation(snapshot, now=NOW).actions == []
+
+
+def test_old_key_is_replaced_and_deleted():
+    snapshot = Snapshot('user', [key('AKIA1', age_days=MAX_CREDENTIAL_AGE_DAYS)])
+    assert plan_rotation(snapshot, now=NOW).actions == [(Action.Create, None), (Action.Delete, 'AKIA1')]
+
+
+def test_inactive_key_is_deleted_before_create():
+    snapshot = Snapshot('user', [key('AKIA1', age_days=100), key('AKIA2', status='Inactive')])
+    assert plan_rotation(snapshot, now=NOW, keep_inactive=True).actions == [
+        (Action.Delete, 'AKIA2'), (Action.Create, None), (Action.Deactivate, 'AKIA1')]
+
+
+def test_force_rotates_a_young_key():
+    snapshot = Snapshot('user', [key('AKIA1')])
+    assert plan_rotation(snapshot, force=True, now=NOW).actions == [(Action.Create, None), (Action.Delete, 'AKIA1')]
+
+
+@pytest.mark.parametrize('credentials', [
+    [],
+    [key('AKIA1', status='Inactive')],
+    [key('AKIA1', age_days=100), key('AKIA2', age_days=100)],
+])
+def test_no_single_active_key_fails(credentials):
+    with pytest.raises(Exception, match='^Error, '):
+        plan_rotation(Snapshot('user', credentials), now=NOW)
+    with pytest.raises(Exception, match='^Error, '):
+        plan_rotation(Snapshot('user', credentials), force=True, now=NOW)
+
+
+class Handler:
+    """
+    Credential handler with the keys of one user in memory. 'fail' names the methods that raise.
+    """
+
+    def __init__(self, fail=()):
+        self.keys = {'AKIA1'}
+        self.fail = set(fail)
+
+    def create(self, user_name: str):
+        self.keys.add('AKIA2')
+        return {'AccessKey': {'UserName': user_name, 'AccessKeyId': 'AKIA2', 'SecretAccessKey': 'secret'}}
+
+    def make_inactive(self, user_name: str, access_key_id: str):
+        if 'make_inactive' in self.fail:
+            raise Exception('Error, UpdateAccessKey failed.')
+        return True
+
+    def delete(self, user_name: str, access_key_id: str):
+        if 'delete' in self.fail or (access_key_id == 'AKIA2' and 'delete_new' in self.fail):
+            raise Exception('Error, DeleteAccessKey failed.')
+        self.keys.discard(access_key_id)
+
+
+def test_apply_runs_actions_in_order():
+    handler = Handler()
+    result = Plan('user', [(Action.Create, None), (Action.Delete, 'AKIA1')]).apply(handler)
+    assert result['AccessKey']['AccessKeyId'] == 'AKIA2'
+    assert result['Actions'] == [{'Action': 'Create', 'AccessKeyId': 'AKIA2'},
+                                 {'Action': 'Delete', 'AccessKeyId': 'AKIA1'}]
+    assert result['ApiCalls'] == 3
+    assert handler.keys == {'AKIA2'}
+
+
+def test_apply_deletes_the_new_key_when_a_later_action_fails():
+    handler = Handler(fail=['make_inactive'])
+    with pytest.raises(Exception, match='was deleted') as error:
+        Plan('user', [(Action.Create, None), (Action.Deactivate, 'AKIA1')]).apply(handler)
+    assert not isinstance(error.value, ApplyError)
+    assert handler.keys == {'AKIA1'}
+
+
+def test_apply_returns_the_new_key_when_it_can_not_be_deleted():
+    handler = Handler(fail=['make_inactive', 'delete_new'])
+    with pytest.raises(ApplyError, match='still Active') as error:
+        Plan('user', [(Action.Create, None), (Action.Deactivate, 'AKIA1')]).apply(handler)
+    assert error.value.result['AccessKey']['SecretAccessKey'] == 'secret'
+    assert handler.keys == {'AKIA1', 'AKIA2'}
+
+
+def test_apply_failure_before_create_raises_as_is():
+    handler = Handler(fail=['delete'])
+    with pytest.raises(Exception, match='^Error, DeleteAccessKey failed.$'):
+        Plan('user', [(Action.Delete, 'AKIA0'), (Action.Create, None)]).apply(handler)
+    assert handler.keys == {'AKIA1'}
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from groot import RotationPipeline
+
+np = pytest.importorskip('numpy')
+from policy import KeyTable, PolicyEngine, RotationPolicy  # noqa: E402
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def key(user_name: str, age_days: float, active: bool = True, idle_days: float = None, path: str = '/'):
+    metadata = {'UserName': user_name, 'AccessKeyId': f'AKIA{user_name.upper()}', 'Path': path,
+                'Status': 'Active' if active else 'Inactive', 'CreateDate': NOW - timedelta(days=age_days)}
+    if idle_days is not None:
+        metadata['LastUsedDate'] = NOW - timedelta(days=idle_days)
+    return metadata
+
+
+def test_engine_decisions():
+    table = KeyTable.from_metadata([
+        key('young', 10, idle_days=1),
+        key('warned', 65, idle_days=1),
+        key('old', 80, idle_days=1),
+        key('unused', 200, idle_days=120),
+        key('inactive', 100, active=False, idle_days=30),
+        key('recent', 100, active=False, idle_days=3),
+        key('service', 40, idle_days=1, path='/service/'),
+    ])
+    policy = RotationPolicy(max_age_days=75, warn_age_days=60, unused_days=90, inactive_grace_days=14,
+                            path_overrides={'/service/': {'max_age_days': 30}})
+    result = PolicyEngine(policy).evaluate(table, now=NOW).as_dict()
+    assert {user_name for user_name, _ in result['Rotate']} == {'old', 'service'}
+    assert {user_name for user_name, _ in result['Warn']} == {'warned'}
+    assert {user_name for user_name, _ in result['Deactivate']} == {'unused'}
+    assert {user_name for user_name, _ in result['Delete']} == {'inactive'}
+
+
+def test_unknown_override_rule_is_refused():
+    with pytest.raises(ValueError):
+        RotationPolicy(path_overrides={'/service/': {'max_days': 30}})
+
+
+def test_service_rotates_at_the_policy_age(service, users, access_keys):
+    keys = users(1)
+    assert service.rotate_credential('user-000')['AccessKey'] is None
+    service.policy = RotationPolicy(max_age_days=0)
+    assert service.need_to_publish_new_credential('user-000')
+    rotated = service.rotate_credential('user-000')['AccessKey']
+    assert access_keys('user-000') == [(rotated['AccessKeyId'], 'Active')]
+    assert rotated['AccessKeyId'] != keys['user-000']
+
+
+def test_disabled_max_age_never_rotates(service, users):
+    keys = users(2)
+    service.policy = RotationPolicy(max_age_days=None)
+    result = service.rotate_fleet(path_prefix='/test/')
+    assert sorted(result['Skipped']) == sorted(keys)
+
+
+def test_pipeline_uses_the_policy_age(service, users):
+    keys = users(2)
+    service.policy = RotationPolicy(max_age_days=0)
+    result = RotationPipeline(service=service).run(keys)
+    assert sorted(result['Rotated']) == sorted(keys)
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+import math
+
+from report import KeyReport, parse_time
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+HEADER = ('user,arn,access_key_1_active,access_key_1_last_rotated,access_key_1_last_used_date,'
+          'access_key_2_active,access_key_2_last_rotated,access_key_2_last_used_date')
+
+
+def days_ago(days: float):
+    return (NOW - timedelta(days=days)).isoformat().replace('+00:00', 'Z')
+
+
+def report(*rows):
+    return KeyReport.parse('\n'.join((HEADER,) + rows).encode('utf-8'), generated_at=NOW.timestamp())
+
+
+def row(user_name: str, key1: tuple = ('false', 'N/A', 'N/A'), key2: tuple = ('false', 'N/A', 'N/A')):
+    return ','.join((user_name, f'arn:aws:iam::123456789012:user/{user_name}') + key1 + key2)
+
+
+def test_parse_time():
+    assert parse_time('2024-06-01T00:00:00+00:00') == NOW.timestamp()
+    assert parse_time(days_ago(0)) == NOW.timestamp()
+    for value in ('N/A', 'no_information', 'not_supported', ''):
+        assert math.isnan(parse_time(value))
+
+
+def test_parse_skips_the_root_account():
+    parsed = report(row('<root_account>'), row('young', key1=('true', days_ago(10), 'N/A')))
+    assert parsed.users == ['young'] and 'young' in parsed and len(parsed) == 1
+    assert parsed.key1_active[0] and math.isnan(parsed.key1_last_used[0])
+    assert parsed.key1_last_rotated[0] == (NOW - timedelta(days=10)).timestamp()
+
+
+def test_needs_check():
+    parsed = report(
+        row('young', key1=('true', days_ago(10), days_ago(1))),
+        row('young-in-slot-2', key1=('false', days_ago(100), 'N/A'), key2=('true', days_ago(10), 'N/A')),
+        row('old', key1=('true', days_ago(80), days_ago(1))),
+        row('two-active', key1=('true', days_ago(10), 'N/A'), key2=('true', days_ago(5), 'N/A')),
+        row('none-active'),
+        row('no-date', key1=('true', 'N/A', 'N/A')),
+    )
+    assert not parsed.needs_check('young', max_age_days=75, now=NOW)
+    assert not parsed.needs_check('young-in-slot-2', max_age_days=75, now=NOW)
+    assert parsed.needs_check('young', max_age_days=5, now=NOW)
+    assert parsed.needs_check('not-in-report', max_age_days=75, now=NOW)
+    assert parsed.users_need_check(max_age_days=75, now=NOW) == ['old', 'two-active', 'none-active', 'no-date']
+
+
+def test_fleet_skips_users_the_report_proves_young(service, users):
+    keys = users(3)
+    report = service.get_credential_report()
+    assert set(keys) <= set(report.users)
+    result = service.rotate_fleet(path_prefix='/test/', use_report=True)
+    assert sorted(result['Skipped']) == sorted(keys)
+    assert 'ListAccessKeys' not in service.limiter.metrics()
@@ -0,0 +1,43 @@
+import pytest
+
+
+@pytest.fixture
+def secure(aws):
+    import boto3
+    from secure import DataKeyCache, Secure
+    key_id = boto3.client('kms').create_key()['KeyMetadata']['KeyId']
+    return Secure(session=boto3.session.Session(), cache=DataKeyCache()), key_id
+
+
+def test_envelope_round_trip(secure):
+    secure, key_id = secure
+    envelope = secure.encrypt_envelope('secret' * 1000, key_id)
+    assert secure.decrypt_envelope(envelope, key_id) == 'secret' * 1000
+
+
+def test_envelope_reuses_the_data_key(secure):
+    secure, key_id = secure
+    first, second = secure.encrypt_envelope('a', key_id), secure.encrypt_envelope('b', key_id)
+    assert first[:-len('a') - 16 - 12] == second[:-len('b') - 16 - 12]  # Same header, other nonce.
+    assert secure.decrypt_envelope(second, key_id) == 'b'
+
+
+def test_plain_kms_ciphertext_still_decrypts(secure):
+    secure, key_id = secure
+    assert secure.decrypt_envelope(secure.encrypt('plain', key_id), key_id) == 'plain'
+
+
+@pytest.mark.parametrize('size', [5, 7, 20, -30])
+def test_truncated_envelope_fails(secure, size):
+    secure, key_id = secure
+    envelope = secure.encrypt_envelope('secret', key_id)
+    with pytest.raises(Exception, match='^Error, Envelope is'):
+        secure.decrypt_envelope(envelope[:size], key_id)
+
+
+def test_tampered_envelope_fails(secure):
+    secure, key_id = secure
+    envelope = bytearray(secure.encrypt_envelope('secret', key_id))
+    envelope[-1] ^= 1
+    with pytest.raises(Exception, match='^Error, Envelope is corrupted'):
+        secure.decrypt_envelope(bytes(envelope), key_id)
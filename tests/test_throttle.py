@@ -0,0 +1,85 @@
+import pytest
+
+from throttle import RateLimiter, TokenBucket, is_throttling
+
+
+class Throttled(Exception):
+    def __init__(self, code: str = 'Throttling'):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class Calls:
+    """
+    API stand-in failing with the given errors first, then answering.
+    """
+
+    def __init__(self, *errors, response: dict = None):
+        self.errors = list(errors)
+        self.response = response or {}
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.response
+
+
+@pytest.fixture
+def limiter():
+    return RateLimiter(default_rate=1000, max_attempts=3, base_delay=0.001, max_delay=0.001)
+
+
+def test_throttled_call_is_retried(limiter):
+    func = Calls(Throttled(), Throttled('RequestLimitExceeded'))
+    assert limiter.call('ListUsers', func) == {}
+    assert func.calls == 3
+    metrics = limiter.metrics()['ListUsers']
+    assert metrics['Calls'] == 3 and metrics['Retries'] == 2 and metrics['Throttled'] == 2
+    assert metrics['Rate'] < metrics['MaxRate']
+
+
+def test_last_throttled_attempt_is_counted(limiter):
+    func = Calls(*(Throttled() for _ in range(3)))
+    with pytest.raises(Throttled):
+        limiter.call('ListUsers', func)
+    metrics = limiter.metrics()['ListUsers']
+    assert metrics['Calls'] == 3 and metrics['Retries'] == 2 and metrics['Throttled'] == 3
+    assert metrics['Rate'] == 1000 / 2 ** 3
+
+
+def test_other_errors_are_not_retried(limiter):
+    func = Calls(Throttled('AccessDenied'))
+    with pytest.raises(Throttled):
+        limiter.call('ListUsers', func)
+    assert func.calls == 1 and limiter.metrics()['ListUsers']['Throttled'] == 0
+
+
+def test_botocore_retries_slow_the_bucket_down(limiter):
+    limiter.call('ListUsers', Calls(response={'ResponseMetadata': {'RetryAttempts': 2}}))
+    metrics = limiter.metrics()['ListUsers']
+    assert metrics['Rate'] == 500 and metrics['Retries'] == 0
+
+
+def test_rate_stays_between_min_and_max():
+    bucket = TokenBucket(max_rate=10, min_rate=1)
+    for _ in range(10):
+        bucket.decrease()
+    assert bucket.rate == 1
+    for _ in range(100):
+        bucket.increase()
+    assert bucket.rate == 10
+
+
+def test_apis_have_their_own_bucket():
+    limiter = RateLimiter(default_rate=10, rates={'CreateAccessKey': 2})
+    assert limiter.bucket('CreateAccessKey').max_rate == 2
+    assert limiter.bucket('ListUsers').max_rate == 10
+    assert limiter.bucket('ListUsers') is limiter.bucket('ListUsers')
+
+
+def test_is_throttling():
+    assert is_throttling(Throttled('SlowDown'))
+    assert not is_throttling(Throttled('AccessDenied'))
+    assert not is_throttling(ValueError())